@@ -58,4 +58,5 @@ FROM c4locs L
 LEFT JOIN c4ix X
   ON L.wellid = X.wellid
   WHERE X.wellid IS NULL
+ORDER BY L.rowid
 ;
@@ -88,65 +88,8 @@ https://www.sqlite.org
 -- ========================================================================= --
 
 -- 1) C4ID_KNOWN_XREFS  
---    Wells with 2 wellids, 2 entries in c4ix, and 2 entries in c4id that cross-
---    reference each other.  These are redundant records known to CWI maintainers,
---    that they choose to retain as redundant records.
+--    Moved to mnu_known_xrefs_o1.1.0.sql, which must run before this file.
 --
--- 1.1 explore the data
--- select A.wellid as wellidA, B.identifier as identifierB, C.wellid as wellidC, 
---        B.wellid as wellidB, A.identifier as identifierA, C.identifier as identifierC,
---       'C4ID_KNOWN_XREFS' as mexplain,
---       'DELETE ixB idA' as mplan,
---       0 as mresolved 
--- from c4id A
--- left join c4id B
---   on cast(A.wellid as text) = B.identifier
---   and A.MNU=1 and B.MNU=1 
--- left join c4id C
---   on cast(B.wellid as text) = C.identifier
---   and B.MNU=1 and C.MNU=1 
--- where A.wellid != B.wellid
---   and B.wellid != C.wellid
---   and A.identifier = C.identifier
--- order by A.wellid
--- ;
---
--- 1.2 set mexplain in c4id
-update c4id set  mexplain='C4ID_KNOWN_XREFS', mmid=11, MNU=11
-where rowid in ( 
-    select A.rowid  
-    from c4id A
-    left join c4id B
-      on cast(A.wellid as text) = B.identifier
-      and A.MNU in(1,11) and B.MNU in(1,11) 
-    left join c4id C
-      on cast(B.wellid as text) = C.identifier
-      and B.MNU in(1,11) and C.MNU in(1,11)
-    where A.wellid != B.wellid
-      and B.wellid != C.wellid
-      and A.identifier = C.identifier)
-;
-
--- 1.3 fill o1id_match  -- 87 rows
-insert into o1id_match (wellid1, identifier1, wellid2, identifier2, 
-                        mexplain, mplan, mmid, mresolved)
-select A.wellid as wellid1, A.identifier as identifier1,  
-       B.wellid as wellid1, B.identifier as identifier2,  
-      'C4ID_KNOWN_XREFS' as mexplain,
-      'MERGE id2 INTO id1' as mplan,
-       11 as mmid, 0 as mresolved 
-from c4id A
-left join c4id B
-  on cast(A.wellid as text) = B.identifier
-  and A.MNU in(1,11) and B.MNU in(1,11)  
-left join c4id C
-  on cast(B.wellid as text) = C.identifier
-  and B.mmid = 11  and C.mmid = 11 
-where A.wellid <= B.wellid
-  and B.wellid != C.wellid
-  and A.identifier = C.identifier
-;
-
 -- ========================================================================= --
 -- 12) C4ID_UNRESOLVED_MERGES
 -- 12.1 exploration 
@@ -183,6 +126,7 @@ select A.wellid as wellid1, A.identifier as identifier1,
        12 as mmid, 0 as mresolved 
 from c4id A
 where A.mmid=12
+order by A.rowid
 ;
 
 -- ========================================================================= --
@@ -220,6 +164,7 @@ select A.wellid as wellid1, A.identifier as identifier1,
        13 as mmid, 0 as mresolved 
 from c4id A
 where A.MNU=13
+order by A.rowid
 ;
 
 -- ========================================================================= --
@@ -258,6 +203,7 @@ select A.wellid as wellid1, A.identifier as identifier1,
        14 as mmid, 0 as mresolved 
 from c4id A
 where A.MNU=14
+order by A.rowid
 ;
 
 
@@ -307,6 +253,7 @@ left join c4id B
 where 
   A.wellid < B.wellid
   and A.identifier like('%W%')
+order by A.rowid, B.rowid
 ;
 
 -- ========================================================================= --
@@ -368,6 +315,7 @@ where A.mmid=16 and B.mmid=16
   and A.identifier < B.identifier 
   and A.identifier like ('H%')
   and B.identifier like ('H%')
+order by A.rowid, B.rowid, X.rowid, Y.rowid
 ;
 
 
@@ -409,6 +357,7 @@ select A.wellid as wellid1, A.identifier as identifier1,
        17 as mmid, 0 as mresolved 
 from c4id A
 where A.mmid=17
+order by A.rowid
 ;
  
 -- --18) Final check that there are no duplicate MNU identifiers in c4id
@@ -450,6 +399,7 @@ left join c4id B
   on A.IDENTIFIER = B.IDENTIFIER
 where A.MNU=1   
   and B.mmid=18
+order by A.rowid, B.rowid
 ;
 
 
@@ -459,6 +409,7 @@ Insert into o1id (wellid, RELATEID, IDENTIFIER, ID_TYPE, ID_PROG, MNU, sMNU)
     select wellid, RELATEID, IDENTIFIER, ID_TYPE, ID_PROG, MNU, sMNU
     from c4id
     where MNU=1 and mmid is null and mexplain is null
+    order by rowid
 ; 
 
 -- -- summarize results:
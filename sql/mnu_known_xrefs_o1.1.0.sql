@@ -0,0 +1,75 @@
+/* CWI SCHEMA
+
+Step 1 of the MNU fault analysis, split out of mnu_analyze_faults_o1.1.0.sql.
+It must run after mnu_reinit_o1id_o1.1.0.sql and before 
+mnu_analyze_faults_o1.1.0.sql.
+
+When OWI_MNU_XREF_ENGINE is set in OWI_config, OWI_import_csv makes the same
+edits with OWI_mnu_xref.apply_known_xrefs() instead of running this file,
+because the self-joins on cast(wellid as text) cannot use an index.  This 
+file remains the reference definition of the step.
+*/
+
+-- Assumes that c4id.MNU has been set to (0,1).
+-- ========================================================================= --
+
+-- 1) C4ID_KNOWN_XREFS  
+--    Wells with 2 wellids, 2 entries in c4ix, and 2 entries in c4id that cross-
+--    reference each other.  These are redundant records known to CWI maintainers,
+--    that they choose to retain as redundant records.
+--
+-- 1.1 explore the data
+-- select A.wellid as wellidA, B.identifier as identifierB, C.wellid as wellidC, 
+--        B.wellid as wellidB, A.identifier as identifierA, C.identifier as identifierC,
+--       'C4ID_KNOWN_XREFS' as mexplain,
+--       'DELETE ixB idA' as mplan,
+--       0 as mresolved 
+-- from c4id A
+-- left join c4id B
+--   on cast(A.wellid as text) = B.identifier
+--   and A.MNU=1 and B.MNU=1 
+-- left join c4id C
+--   on cast(B.wellid as text) = C.identifier
+--   and B.MNU=1 and C.MNU=1 
+-- where A.wellid != B.wellid
+--   and B.wellid != C.wellid
+--   and A.identifier = C.identifier
+-- order by A.wellid
+-- ;
+--
+-- 1.2 set mexplain in c4id
+update c4id set  mexplain='C4ID_KNOWN_XREFS', mmid=11, MNU=11
+where rowid in ( 
+    select A.rowid  
+    from c4id A
+    left join c4id B
+      on cast(A.wellid as text) = B.identifier
+      and A.MNU in(1,11) and B.MNU in(1,11) 
+    left join c4id C
+      on cast(B.wellid as text) = C.identifier
+      and B.MNU in(1,11) and C.MNU in(1,11)
+    where A.wellid != B.wellid
+      and B.wellid != C.wellid
+      and A.identifier = C.identifier)
+;
+
+-- 1.3 fill o1id_match  -- 87 rows
+insert into o1id_match (wellid1, identifier1, wellid2, identifier2, 
+                        mexplain, mplan, mmid, mresolved)
+select A.wellid as wellid1, A.identifier as identifier1,  
+       B.wellid as wellid1, B.identifier as identifier2,  
+      'C4ID_KNOWN_XREFS' as mexplain,
+      'MERGE id2 INTO id1' as mplan,
+       11 as mmid, 0 as mresolved 
+from c4id A
+left join c4id B
+  on cast(A.wellid as text) = B.identifier
+  and A.MNU in(1,11) and B.MNU in(1,11)  
+left join c4id C
+  on cast(B.wellid as text) = C.identifier
+  and B.mmid = 11  and C.mmid = 11 
+where A.wellid <= B.wellid
+  and B.wellid != C.wellid
+  and A.identifier = C.identifier
+order by A.rowid, B.rowid, C.rowid
+;
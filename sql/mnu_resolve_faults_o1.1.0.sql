@@ -49,7 +49,8 @@ LEFT JOIN c4id c2
   ON o.wellid1 = c2.wellid
 WHERE c.mexplain = 'C4ID_KNOWN_XREFS'
   AND c.ID_PROG = 'MNUNIQ'
-  AND c2.ID_PROG = 'MNUNIQ' ;
+  AND c2.ID_PROG = 'MNUNIQ'
+ORDER BY o.rowid, c.rowid, c2.rowid;
 
 -- 11b
 -- Second the cross references: larger wellid
@@ -65,7 +66,8 @@ LEFT JOIN c4id c2
   ON o.wellid1 = c2.wellid
 WHERE c.mexplain = 'C4ID_KNOWN_XREFS'
   AND c.mmid=11
-  AND c2.mmid=11;
+  AND c2.mmid=11
+ORDER BY o.rowid, c.rowid, c2.rowid;
 
 -- 12
 -- C4ID_UNRESOLVED_MERGES: merge to serve as examples.
@@ -78,6 +80,7 @@ LEFT JOIN c4id c2
   ON o.identifier1 = c2.identifier
 WHERE o.mmid = 12
   AND c2.mmid=12
+ORDER BY o.rowid, c2.rowid
   ;
 
 -- 13
@@ -98,6 +101,7 @@ SELECT wellid, RELATEID, IDENTIFIER, ID_TYPE, ID_PROG,
   8, 0, mmid, mexplain, 'Resolve manually', 'See o1id_match for candidate match.'
 FROM c4id
 WHERE mmid = 15
+ORDER BY rowid
 ;
 
 -- 16
@@ -108,6 +112,7 @@ SELECT wellid, RELATEID, IDENTIFIER, ID_TYPE, ID_PROG,
   8, 0, mmid, mexplain, 'Resolve manually', 'See o1id_match for matches.'
 FROM c4id
 WHERE mmid = 16
+ORDER BY rowid
 ;
 
 --17 
@@ -119,7 +124,8 @@ INSERT into o1id(wellid, RELATEID, IDENTIFIER, ID_TYPE, ID_PROG,
   MNU, sMNU, mmid, mexplain, mremark)
 select wellid, RELATEID, IDENTIFIER, ID_TYPE, ID_PROG,
   9 as MNU, 0 as sMNU, mmid, mexplain, 'unconfirmed' as mremark
-from c4id where mmid=17;
+from c4id where mmid=17
+order by rowid;
 
 -- 17b 
 -- Create the well set entries in c4ix.
@@ -159,7 +165,8 @@ from (select '8000' || substr(IDENTIFIER,2,6)  as wellid,
       where mmid=17  
       group by identifier) as S
 left join c4ix x
-  on S.linkid = x.wellid;
+  on S.linkid = x.wellid
+order by S.unique_no, x.rowid;
   
 -- 17c Create well set entries in o1id for the well set IDENTIFIERS
 -- use MNU=3 because the individual wells exist also.
@@ -178,7 +185,8 @@ SELECT CAST('8000' || substr(IDENTIFIER,2,6) AS INTEGER)  as wellid,
        'unverified' as mremark
 FROM c4id
 WHERE mmid=17  
-GROUP BY IDENTIFIER;
+GROUP BY IDENTIFIER
+ORDER BY IDENTIFIER;
 
 -- -- Inspect results of effort 17
 -- select mnu, smnu, id_type, id_prog, mexplain, mplan, mresolved, mremark, count(*) 
@@ -214,6 +222,7 @@ left join o1id o
 where m1.wellid1 is null
   and m2.wellid2 is null
   and (o.wellid is null OR o.sMNU=0)
+order by x.rowid, m1.rowid, m2.rowid, o.rowid
 ;
 
 -- Part 2b: append remaining records from c4ix
@@ -235,6 +244,7 @@ where x.wellid in (
     where s.wellid is null)
 and i.mnu > 0
 and o.identifier is null
+order by x.rowid, i.rowid, o.rowid
 ;
 
 -- Format all H-numbers in o1id as Hnnnnnn  (H + 6 digits, zero padded)
@@ -269,7 +269,7 @@ SELECT
     A.LITH_PRIM,
     A.LITH_SEC,
     A.LITH_MINOR
-FROM c4sts A
+FROM c4st A
 LEFT JOIN v1ids S
   ON A.wellid = S.wellid
 ;
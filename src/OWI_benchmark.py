@@ -0,0 +1,316 @@
+'''
+Benchmarks of the stages of building an OWI database, using demo_data.
+
+Each stage of the build is timed separately:
+    -   reading each csv file by ascii_lines and csv_rows, as the import does
+    -   execute the schema file
+    -   import_data_from_csv, per table
+    -   import_cwi_locs, from shapefiles made from demo_data/c4locs.csv
+    -   recreating indexes at the end of bulk_load
+    -   populate_wellid_and_index
+    -   each OWI_MNU_INSERT sql file
+    -   representative queries on the vo1* views
+
+For each stage the elapsed seconds, the number of rows (records imported,
+changed, or returned), rows per second, and the peak resident set size of
+the process at the end of the stage are recorded. The build is run several
+times in a temporary folder, and the median time of each stage is kept.
+
+The results are written as json, with the git commit, python and sqlite
+versions, so that results from different commits can be compared:
+
+    python OWI_benchmark.py bench_new.json
+    python OWI_benchmark.py bench_old.json --compare bench_new.json
+
+Methods
+-------
+    RUN_benchmark()
+    compare_benchmarks()
+    make_demo_shapefiles()
+'''
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import shapefile
+
+from OWI_config import OWI_version as C
+from OWI_sqlite import c4db
+from OWI_sqlfile import execute_statements_from_file
+from OWI_import_csv import (cwi_csvupdate, execute_mnu_file, ascii_lines, 
+                            csv_rows, read_csv_header)
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+DEMO_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'demo_data')
+
+# Representative queries on the views: (name, sql).
+BENCHMARK_QUERIES = (
+    ('count vo1ix',       "SELECT count(*) FROM vo1ix;"),
+    ('vo1ix by county',   "SELECT * FROM vo1ix WHERE COUNTY_C = 62 ORDER BY IDENTIFIER;"),
+    ('vo1st by wellid',   "SELECT S.* FROM c4ix I JOIN vo1st S ON S.wellid = I.wellid;"),
+    ('vo1locs all',       "SELECT * FROM vo1locs ORDER BY wellid;"),
+    ('vo1ad join vo1ix',  """SELECT X.IDENTIFIER, A.NAME, A.CITY
+                             FROM vo1ix X JOIN vo1ad A ON A.wellid = X.wellid;"""),
+    ('v1idsets',          "SELECT * FROM v1idsets;"),
+)
+
+def peak_rss_kb():
+    """ Return the peak resident set size of this process in KB, or None. """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+def git_commit():
+    """ Return the git commit of the source folder, or None. """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except Exception:
+        return None
+
+class stage_timer():
+    """ Collect the timings of the stages of one benchmark run. """
+    def __init__(self):
+        self.results = []
+
+    def time(self, stage, name, func, *args, rows=None, **kwargs):
+        """
+        Run func(*args, **kwargs) and record its timing.
+
+        rows is a function returning the number of rows handled, called after
+        func with func's return value.
+        """
+        t0 = time.perf_counter()
+        rv = func(*args, **kwargs)
+        seconds = time.perf_counter() - t0
+        self.record(stage, name, seconds, rows(rv) if rows else None)
+        return rv
+
+    def record(self, stage, name, seconds, nrows=None):
+        self.results.append({'stage': stage,
+                             'name': name,
+                             'seconds': seconds,
+                             'rows': nrows,
+                             'peak_rss_kb': peak_rss_kb()})
+
+def read_csv_file(csvname):
+    """
+    Read every column of every row of csvname, as the import reads it.
+
+    Returns the number of rows read.
+    """
+    col_names = next(csv.reader([read_csv_header(csvname)]))
+    return sum(1 for row in csv_rows(ascii_lines(csvname), col_names))
+
+def make_demo_shapefiles(csvname, outdir, db):
+    """
+    Write wells.shp and unloc_wells.shp from c4locs.csv, for import_cwi_locs.
+
+    Field types are taken from table c4locs in db: INTEGER as numeric
+    integers, REAL as numeric with 4 decimals, and others as characters.
+    Located wells are points at (UTME, UTMN); unlocated wells have no shape.
+    """
+    types = {k.upper(): v.upper() for k, v in db.get_column_type_dict('c4locs').items()}
+    with open(csvname, newline='') as f:
+        rows = list(csv.DictReader(f))
+    cols = [c for c in rows[0] if not c.upper() in ('WELLID', 'CWI_LOC')]
+    for fname, cwi_loc in (('wells', 'loc'), ('unloc_wells', 'unloc')):
+        with shapefile.Writer(os.path.join(outdir, fname)) as w:
+            for c in cols:
+                T = types.get(c.upper(), 'TEXT')
+                if 'INT' in T:
+                    w.field(c, 'N', 12, 0)
+                elif T == 'REAL':
+                    w.field(c, 'N', 19, 4)
+                else:
+                    w.field(c, 'C', max([len(r[c]) for r in rows] + [1]))
+            for r in rows:
+                if r['CWI_loc'] != cwi_loc:
+                    continue
+                vals = []
+                for c in cols:
+                    T = types.get(c.upper(), 'TEXT')
+                    v = r[c]
+                    if v == '':
+                        vals.append(None if T in ('INTEGER', 'REAL') else '')
+                    elif 'INT' in T:
+                        vals.append(int(float(v)))
+                    elif T == 'REAL':
+                        vals.append(float(v))
+                    else:
+                        vals.append(v)
+                if cwi_loc == 'loc' and r['UTME'] and r['UTMN']:
+                    w.point(float(r['UTME']), float(r['UTMN']))
+                else:
+                    w.null()
+                w.record(*vals)
+
+def benchmark_run(workdir, datadir):
+    """ Build a database in workdir from the csv files in datadir, timing each stage. """
+    T = stage_timer()
+    csvdir = os.path.join(workdir, 'csv')
+    shutil.copytree(datadir, csvdir)
+    db_name = os.path.join(workdir, 'OWI_benchmark.sqlite')
+    C4 = cwi_csvupdate(csvdir, csvdir)
+
+    for fname in sorted(os.listdir(csvdir)):
+        if fname.endswith('.csv'):
+            T.time('csv_rows', fname, read_csv_file, 
+                   os.path.join(csvdir, fname), rows=lambda rv: rv)
+
+    with c4db(db_name=db_name, commit=True) as db:
+        T.time('schema', os.path.basename(C.OWI_DB_SCHEMA),
+               execute_statements_from_file, db, C.OWI_DB_SCHEMA)
+        db.commit_db()
+
+        locscsv = os.path.join(csvdir, 'c4locs.csv')
+        make_demo_shapefiles(locscsv, csvdir, db)
+        os.remove(locscsv)
+
+        count = lambda t: lambda rv: db.queryone(f"SELECT count(*) FROM {t};")
+        changes = lambda n0: lambda rv: db.con.total_changes - n0
+        bulk = db.bulk_load(C4.data_table_names + [C4.locs_table_name])
+        bulk.__enter__()
+        for t in C4.data_table_names:
+            T.time('import_data_from_csv', t, C4.import_data_from_csv,
+                   db, C.OWI_SCHEMA_HAS_FKwellid_CONSTRAINTS,
+                   table_names=(t,), rows=count(t))
+        T.time('import_cwi_locs', 'c4locs', C4.import_cwi_locs, db,
+               rows=count('c4locs'))
+        T.time('bulk_load', 'recreate indexes', bulk.__exit__, None, None, None)
+
+        T.time('populate_wellid_and_index', 'all tables',
+               C4.populate_wellid_and_index, db, C.OWI_SCHEMA_HAS_LOCS,
+               rows=changes(db.con.total_changes))
+        db.commit_db()
+
+        for sqlfiles in C.OWI_MNU_INSERT:
+            if not isinstance(sqlfiles, (list, tuple)):
+                sqlfiles = [sqlfiles]
+            for sqlfile in sqlfiles:
+                T.time('OWI_MNU_INSERT', os.path.basename(sqlfile),
+                       execute_mnu_file, db, sqlfile,
+                       rows=changes(db.con.total_changes))
+                db.commit_db()
+
+        for name, sql in BENCHMARK_QUERIES:
+            T.time('query', name, db.query, sql, rows=len)
+    db.close_db()
+    return T.results
+
+def RUN_benchmark(outname=None, runs=3, datadir=DEMO_DATA_DIR):
+    """
+    Run the build benchmark runs times, and write the results as json.
+
+    Arguments
+    ---------
+    outname : json file name, or None to only return the results.
+    runs    : number of builds. The median seconds of each stage are kept.
+    datadir : folder of the csv files, default demo_data.
+
+    Returns
+    -------
+    dict with keys 'meta' and 'stages'.  Each stage is a dict of: stage,
+    name, seconds, rows, rows_per_sec, peak_rss_kb, and runs (seconds of
+    each run).
+    """
+    allruns = []
+    for i in range(runs):
+        with tempfile.TemporaryDirectory(prefix='owi_benchmark_') as workdir:
+            allruns.append(benchmark_run(workdir, datadir))
+    stages = []
+    for i, r in enumerate(allruns[0]):
+        times = [run[i]['seconds'] for run in allruns]
+        seconds = statistics.median(times)
+        stages.append({'stage': r['stage'],
+                       'name': r['name'],
+                       'seconds': seconds,
+                       'rows': r['rows'],
+                       'rows_per_sec': (r['rows'] / seconds
+                                        if r['rows'] and seconds > 0 else None),
+                       'peak_rss_kb': max((run[i]['peak_rss_kb'] or 0) for run in allruns) or None,
+                       'runs': times})
+    rv = {'meta': {'commit': git_commit(),
+                   'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(),
+                   'sqlite': sqlite3.sqlite_version,
+                   'platform': platform.platform(),
+                   'datadir': os.path.abspath(datadir),
+                   'runs': runs,
+                   'total_seconds': sum(s['seconds'] for s in stages)},
+          'stages': stages}
+    if outname:
+        with open(outname, 'w') as f:
+            json.dump(rv, f, indent=1)
+        print (f"Benchmark results written to {outname}")
+    print_benchmark(rv)
+    return rv
+
+def print_benchmark(results):
+    """ Print a table of benchmark results. """
+    print (f"{'stage':28} {'name':34} {'seconds':>9} {'rows':>9} {'rows/sec':>11} {'peak KB':>9}")
+    for s in results['stages']:
+        rps = f"{s['rows_per_sec']:11.0f}" if s['rows_per_sec'] else f"{'':11}"
+        print (f"{s['stage']:28} {s['name'][:34]:34} {s['seconds']:9.4f} "
+               f"{str(s['rows'] if s['rows'] is not None else ''):>9} {rps} "
+               f"{str(s['peak_rss_kb'] or ''):>9}")
+    print (f"total seconds: {results['meta']['total_seconds']:.4f}")
+
+def compare_benchmarks(old, new):
+    """
+    Print the change in seconds of each stage from json file old to new.
+
+    Returns a list of (stage, name, old seconds, new seconds, ratio).
+    """
+    with open(old) as f:
+        a = json.load(f)
+    with open(new) as f:
+        b = json.load(f)
+    olds = {(s['stage'], s['name']): s['seconds'] for s in a['stages']}
+    rv = []
+    print (f"old: {a['meta']['commit']}  new: {b['meta']['commit']}")
+    print (f"{'stage':28} {'name':34} {'old':>9} {'new':>9} {'new/old':>8}")
+    for s in b['stages']:
+        key = (s['stage'], s['name'])
+        if not key in olds:
+            continue
+        ratio = s['seconds'] / olds[key] if olds[key] else None
+        rv.append(key + (olds[key], s['seconds'], ratio))
+        print (f"{key[0]:28} {key[1][:34]:34} {olds[key]:9.4f} {s['seconds']:9.4f} "
+               f"{ratio if ratio is not None else float('nan'):8.2f}")
+    return rv
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Benchmark the OWI build on demo_data.')
+    parser.add_argument('outname', nargs='?', help='json file for the results')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--datadir', default=DEMO_DATA_DIR)
+    parser.add_argument('--compare', metavar='NEW',
+                        help='compare json outname (old) to json NEW, without running')
+    args = parser.parse_args()
+    if args.compare:
+        compare_benchmarks(args.outname, args.compare)
+    else:
+        RUN_benchmark(args.outname, runs=args.runs, datadir=args.datadir)
@@ -70,6 +70,7 @@ class CWI_base(OWIfiles):
     OWI_SCHEMA_HAS_FKwellid_CONSTRAINTS = False
     OWI_SCHEMA_HAS_DATA_CONSTRAINTS = False
     OWI_RUN_SQL_FILES = []
+    OWI_IMPORT_PARALLEL = False
 #####################################################################
     
 class OWI_version_0(CWI_base):
@@ -128,6 +129,11 @@ class OWI_base(OWIfiles):
     OWI_SCHEMA_HAS_DATA_CONSTRAINTS = True
     OWI_MNU_INSERT = []
     OWI_MNU_VIEWS = []
+    OWI_MNU_KNOWN_XREFS = None
+    OWI_MNU_XREF_ENGINE = True      # Run OWI_MNU_KNOWN_XREFS in python, see OWI_mnu_xref.py
+    OWI_MNU_INDEX_ADVISOR = True    # Index the MNU sql joins, see OWI_index_advisor.py
+    OWI_MNU_DROP_ADVISED_INDEXES = True
+    OWI_IMPORT_PARALLEL = False
 #####################################################################
 
 class OWI_version_40(OWI_base):
@@ -142,15 +148,19 @@ class OWI_version_40(OWI_base):
     OWI_MNU_CLEAN_C4ID = "../sql/mnu_clean_c4id_o1.1.0.sql"
     OWI_MNU_REINIT_O1ID = "../sql/mnu_reinit_o1id_o1.1.0.sql"
     OWI_MNU_VIEWS = ["../sql/mnu_views_o1.1.0.sql"]
+    OWI_MNU_KNOWN_XREFS = "../sql/mnu_known_xrefs_o1.1.0.sql"
     OWI_MNU_ANALYZE_O1ID = "../sql/mnu_analyze_faults_o1.1.0.sql"
     OWI_MNU_RESOLVE_O1ID = "../sql/mnu_resolve_faults_o1.1.0.sql"
     
+    # OWI_MNU_KNOWN_XREFS is step 1 of OWI_MNU_ANALYZE_O1ID, moved to a file
+    # of its own. It shares entry 5, so the resume_MNU_at numbers are kept.
     OWI_MNU_INSERT = [OWI_MNU_INIT_MNU_RELATIONSHIP, # 0
                       OWI_MNU_INSERT_LOCS,           # 1
                       OWI_MNU_CLEAN_C4ID,            # 2
                       OWI_MNU_REINIT_O1ID,           # 3
                       OWI_MNU_VIEWS,                 # 4
-                      OWI_MNU_ANALYZE_O1ID,          # 5
+                      [OWI_MNU_KNOWN_XREFS,          # 5
+                       OWI_MNU_ANALYZE_O1ID],
                       OWI_MNU_RESOLVE_O1ID,          # 6
                      ]
     #
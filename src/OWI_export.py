@@ -0,0 +1,322 @@
+'''
+Export tables and views of an OWI database to csv, Parquet, or Arrow files.
+
+Each table or view is streamed from the database in chunks of rows, so the
+memory used does not depend on the size of the table.  Several tables are
+exported in parallel by worker processes, each with its own connection.
+
+Formats
+-------
+    'csv'     : csv, 'excel' dialect, with a header row.  Optionally compressed
+                by 'gzip', 'bz2', or 'xz'.
+    'parquet' : Parquet, optionally compressed by 'snappy', 'gzip', 'brotli',
+                'zstd', or 'lz4'.  Requires pyarrow.
+    'arrow'   : Arrow IPC file format, optionally compressed by 'zstd' or
+                'lz4'.  Requires pyarrow.
+
+Column types of Parquet and Arrow files are taken from the declared column
+types in the database schema.
+
+Usage
+-----
+    export_tables(db_name, outdir)                     # all c4, o1 and vo1
+    export_tables(db_name, outdir, ('c4st', 'vo1ix'), fmt='parquet',
+                  compression='zstd')
+    export_table(db_name, 'c4ix', 'c4ix.csv.gz', compression='gzip',
+                 where='COUNTY_C = ?', vals=(19,), order_by='wellid')
+
+Methods
+-------
+    export_tables()
+    export_table()
+    default_export_tables()
+    export_file_name()
+'''
+import bz2
+import csv
+import datetime
+import gzip
+import lzma
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from OWI_sqlite import c4db
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+EXPORT_FORMATS = ('csv', 'parquet', 'arrow')
+
+# File extensions and openers of the compressions available for csv files.
+CSV_COMPRESSION = {None   : ('',     open),
+                   'gzip' : ('.gz',  gzip.open),
+                   'bz2'  : ('.bz2', bz2.open),
+                   'xz'   : ('.xz',  lzma.open)}
+
+# Default number of rows read and written at a time.
+EXPORT_CHUNK_ROWS = 100000
+
+# Names of the tables and views exported by default.
+EXPORT_TABLE_PATTERN = re.compile(r'^(c4[a-z0-9]+|o1id|vo1[a-z0-9]+)$')
+
+def default_export_tables(db):
+    """
+    Return the names of the c4 and o1 tables and vo1 views in db.
+
+    Index tables such as c4locs_rtree and c4rm_fts are not included.
+    """
+    return [name for name in db.get_tablenames() + db.get_viewnames()
+            if EXPORT_TABLE_PATTERN.match(name)]
+
+def export_file_name(outdir, table_name, fmt='csv', compression=None):
+    """ Return the path of the export file of table_name. """
+    ext = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}[fmt]
+    if fmt == 'csv':
+        ext += CSV_COMPRESSION[compression][0]
+    return os.path.join(outdir, f'{table_name}{ext}')
+
+def arrow_type(T):
+    """
+    Return the pyarrow type for declared SQLite column type T.
+
+    Follows SQLite's type affinity rules, with DATE and TIMESTAMP added
+    because the db converts them (PARSE_DECLTYPES).
+    """
+    T = (T or '').upper()
+    if T == 'DATE':
+        return pa.date32()
+    if T == 'TIMESTAMP':
+        return pa.timestamp('us')
+    if 'INT' in T:
+        return pa.int64()
+    if 'CHAR' in T or 'CLOB' in T or 'TEXT' in T:
+        return pa.string()
+    if 'BLOB' in T:
+        return pa.binary()
+    if 'REAL' in T or 'FLOA' in T or 'DOUB' in T:
+        return pa.float64()
+    return pa.string()
+
+def _select(db, table_name, where='', order_by=None):
+    """ Return (column names, column types, select statement) for table_name. """
+    types = db.get_column_type_dict(table_name)
+    cols = list(types.keys())
+    s = 'SELECT ' + ', '.join(f'"{c}"' for c in cols) + f' FROM {table_name}'
+    if where:
+        s += f" WHERE {where}"
+    if order_by:
+        s += f" ORDER BY {order_by}"
+    return cols, [types[c] for c in cols], s + ';'
+
+def _iter_rows(db, s, vals, arraysize):
+    """
+    Yield the rows of query s, fetched arraysize at a time.
+
+    Unlike DB_SQLite.iter_query(), errors are raised, so that a failed query
+    is not taken for an empty table.
+    """
+    cur = db.con.cursor()
+    cur.arraysize = arraysize
+    try:
+        cur.execute(s, vals or ())
+        while True:
+            rows = cur.fetchmany()
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cur.close()
+
+def _chunks(rows, chunk_rows):
+    """ Yield lists of up to chunk_rows rows from iterator rows. """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _write_csv(fname, cols, types, rows, compression, chunk_rows):
+    opener = CSV_COMPRESSION[compression][1]
+    n = 0
+    with opener(fname, 'wt', newline='') as f:
+        w = csv.writer(f, dialect='excel')
+        w.writerow(cols)
+        for chunk in _chunks(rows, chunk_rows):
+            w.writerows(chunk)
+            n += len(chunk)
+    return n
+
+def _arrow_batches(cols, types, rows, chunk_rows):
+    """ Return (schema, generator of RecordBatches) for rows. """
+    schema = pa.schema([(c, arrow_type(t)) for c, t in zip(cols, types)])
+    def batches():
+        for chunk in _chunks(rows, chunk_rows):
+            arrays = [pa.array(values, type=field.type, from_pandas=False)
+                      for values, field in zip(zip(*chunk), schema)]
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+    return schema, batches()
+
+def _write_parquet(fname, cols, types, rows, compression, chunk_rows):
+    schema, batches = _arrow_batches(cols, types, rows, chunk_rows)
+    n = 0
+    with pa.parquet.ParquetWriter(fname, schema,
+                                  compression=compression or 'none') as w:
+        for batch in batches:
+            w.write_batch(batch)
+            n += batch.num_rows
+    return n
+
+def _write_arrow(fname, cols, types, rows, compression, chunk_rows):
+    schema, batches = _arrow_batches(cols, types, rows, chunk_rows)
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    n = 0
+    with pa.OSFile(fname, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema, options=options) as w:
+            for batch in batches:
+                w.write_batch(batch)
+                n += batch.num_rows
+    return n
+
+_WRITERS = {'csv': _write_csv, 'parquet': _write_parquet, 'arrow': _write_arrow}
+
+def export_table(db_name, table_name, fname, fmt='csv', compression=None,
+                 where='', vals=None, order_by=None,
+                 chunk_rows=EXPORT_CHUNK_ROWS, overwrite=False):
+    """
+    Export [selected] records of a table or view to a file.
+
+    Arguments
+    ---------
+    db_name    : string. Database file name.
+    table_name : string. Name of a table or view in the database.
+    fname      : string. Filename of the export file (with path).
+    fmt        : 'csv', 'parquet', or 'arrow'
+    compression: None, or a compression of fmt. See module notes.
+    where      : string, Optional. Where condition, without 'WHERE'. Values
+                 should be given by '?' parameters and vals. E.g.
+                 where='wellid = ?', vals=(123,)
+    vals       : tuple. Parameter values of where.
+    order_by   : string, Optional. Order by clause, without 'ORDER BY'.  If
+                 None, rows are in the order read.
+    chunk_rows : int. Number of rows read and written at a time.
+    overwrite  : If False, an existing fname is not replaced.
+
+    Returns
+    -------
+    (table_name, fname, number of records), or (table_name, None, 0) if the
+    table was not exported.
+
+    Notes
+    -----
+    -   The file is written under a temporary name and then renamed, so an
+        incomplete or failed export never replaces fname.  If the query or 
+        the writer fails, the error is printed and the temporary file is 
+        deleted.
+    -   All columns are exported, including rowid if it is declared.
+    """
+    if not fmt in EXPORT_FORMATS:
+        print (f'export_table: ERROR - unknown format {fmt}')
+        return table_name, None, 0
+    if fmt != 'csv' and pa is None:
+        print (f'export_table: ERROR - format {fmt} requires pyarrow')
+        return table_name, None, 0
+    if fmt == 'csv' and not compression in CSV_COMPRESSION:
+        print (f'export_table: ERROR - unknown csv compression {compression}')
+        return table_name, None, 0
+    if os.path.exists(fname) and not overwrite:
+        print (f'export_table: {fname} exists, {table_name} not exported')
+        return table_name, None, 0
+
+    tmpname = f'{fname}.tmp{os.getpid()}'
+    with c4db(db_name=db_name) as db:
+        rows = None
+        try:
+            cols, types, s = _select(db, table_name, where, order_by)
+            if not cols:
+                print (f'export_table: ERROR - {table_name} not found in {db_name}')
+                return table_name, None, 0
+            rows = _iter_rows(db, s, vals, chunk_rows)
+            n = _WRITERS[fmt](tmpname, cols, types, rows, compression, chunk_rows)
+            os.replace(tmpname, fname)
+        except Exception as e:
+            print (f'export_table: ERROR - {table_name}: {e}')
+            return table_name, None, 0
+        finally:
+            if rows is not None:
+                rows.close()
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            db.close_db()
+    print (f"{table_name}: {n} records written to {fname}")
+    return table_name, fname, n
+
+def export_tables(db_name, outdir, table_names=None, fmt='csv',
+                  compression=None, chunk_rows=EXPORT_CHUNK_ROWS,
+                  overwrite=False, max_workers=None):
+    """
+    Export tables and views to files in outdir, in parallel.
+
+    Arguments
+    ---------
+    db_name     : string. Database file name.
+    outdir      : string. Folder for the export files.  It is created if needed.
+    table_names : iterable of names of tables and views, or None for
+                  default_export_tables().
+    fmt, compression, chunk_rows, overwrite : see export_table()
+    max_workers : int or None. Number of worker processes. If None, the number
+                  of cpus is used.  If 1, the tables are exported in this
+                  process.
+
+    Each table is written to export_file_name(outdir, table_name, fmt,
+    compression).
+
+    Returns
+    -------
+    A list of (table_name, fname, number of records), see export_table().
+
+    Notes
+    -----
+    -   On Windows the calling script must be protected by
+        if __name__ == '__main__':  because workers re-import it.
+    """
+    with c4db(db_name=db_name) as db:
+        if table_names is None:
+            table_names = default_export_tables(db)
+        db.close_db()
+    os.makedirs(outdir, exist_ok=True)
+    jobs = [(db_name, t, export_file_name(outdir, t, fmt, compression), fmt,
+             compression, '', None, None, chunk_rows, overwrite)
+            for t in table_names]
+    t0 = datetime.datetime.now()
+    if max_workers == 1:
+        rv = [export_table(*job) for job in jobs]
+    else:
+        rv = []
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(export_table, *job) for job in jobs]
+            for future in as_completed(futures):
+                rv.append(future.result())
+    failed = [table_name for table_name, fname, n in rv if fname is None]
+    print (f"export_tables: {len(rv) - len(failed)} tables exported to {outdir} in "
+           f"{datetime.datetime.now() - t0}")
+    if failed:
+        print (f"export_tables: {len(failed)} tables not exported: {', '.join(sorted(failed))}")
+    return rv
+
+
+if __name__ == '__main__':
+    from OWI_config import OWI_version as C
+    if 0:
+        export_tables(C.OWI_DOWNLOAD_DB_NAME,
+                      os.path.join(C.OWI_DOWNLOAD_DIR, 'export'),
+                      fmt='csv', compression='gzip')
+
+    print ('\n',r'\\\\\\\\\\\\\\\ DONE (OWI_export.py) ///////////////')
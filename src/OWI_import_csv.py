@@ -5,10 +5,19 @@ Created on Oct 10, 2020
 '''
 import csv
 import datetime
+import hashlib
 import os
-import shapefile
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from itertools import islice
+from operator import itemgetter
 
-from OWI_sqlfile import execute_statements_from_file
+from OWI_shapefile import (DBF_BATCH_ROWS, _file_names, iter_dbf_columns, 
+                           shapefile_encoding, shapefile_fields)
+from OWI_sqlfile import (execute_statements_from_file, sql_profile_report,
+                         profile_function)
 from OWI_sqlite import c4db
 
 from OWI_config import  OWI_version as C
@@ -77,9 +86,118 @@ class safedate():
                     pass
         return None
 
+class row_converter():
+    """
+    A type converter for rows of csv values, compiled for one table schema.
+    
+    The converter is built once from the column types of a table, and then 
+    converts a whole row per call. The conversion of each column is written 
+    inline in a generated function, so the common values (empty strings, 
+    plain digits, numbers, text) are converted without a function call or an 
+    exception per value.  If any value in a row is malformed, the row is 
+    converted again by the per-value functions safeint(), safefloat(), 
+    safetext(), and safedate().date(), so results are identical to theirs.
+    
+    Arguments
+    ---------
+    col_types : iterable of normalized type names, as from converter_type()
+    
+    Usage
+    -----
+    convert = row_converter(('INTEGER', 'TEXT', 'REAL'))
+    convert(('12', ' A ', ''))                  => (12, 'A', None)
+    convert.batch([('12', 'A', '1.5'), 
+                   ('', '', 'x')])              => [(12, 'A', 1.5), 
+                                                    (None, None, None)]
+    
+    Method batch() is a column oriented alternative: a chunk of rows is 
+    transposed to columns, each column is converted by one list 
+    comprehension, and the columns are transposed back to rows.
+    """
+    _expressions = {
+        'INTEGER': "(int({v}) if {v}.isdigit() else _safeint({v}) if {v} else None)",
+        'REAL'   : "(float({v}) if {v} else None)",
+        'TEXT'   : "({v}.strip() or None)",
+        'DATE'   : "(_date{i}({v}) if {v} else None)",
+    }
+
+    def __init__(self, col_types):
+        self.col_types = tuple(col_types)
+        self.funcs = []
+        namespace = {'_safeint': safeint}
+        for i, T in enumerate(self.col_types):
+            if T == 'INTEGER':
+                f = safeint
+            elif T == 'REAL':
+                f = safefloat
+            elif T == 'TEXT':
+                f = safetext
+            elif T == 'DATE':
+                f = safedate().date
+                namespace[f'_date{i}'] = f
+            else:
+                raise NotImplementedError(f'type {T} is not implemented')
+            self.funcs.append(f)
+        namespace['_safe_row'] = self.safe_convert
+        
+        vals = [f'v{i}' for i in range(len(self.col_types))]
+        exprs = [self._expressions[T].format(v=v, i=i) 
+                 for i, (T, v) in enumerate(zip(self.col_types, vals))]
+        src = ( "def convert(row):\n"
+                "    try:\n"
+               f"        ({''.join(v + ', ' for v in vals)}) = row\n"
+               f"        return ({''.join(e + ', ' for e in exprs)})\n"
+                "    except Exception:\n"
+                "        return _safe_row(row)\n")
+        exec(src, namespace)
+        self.convert = namespace['convert']
+        
+        self.column_funcs = []
+        for i, T in enumerate(self.col_types):
+            namespace[f'_f{i}'] = self.funcs[i]
+            src = (f"def column{i}(col):\n"
+                    "    try:\n"
+                   f"        return [{self._expressions[T].format(v='v', i=i)} for v in col]\n"
+                    "    except Exception:\n"
+                   f"        return [_f{i}(v) for v in col]\n")
+            exec(src, namespace)
+            self.column_funcs.append(namespace[f'column{i}'])
+    
+    def __call__(self, row):
+        return self.convert(row)
+    
+    def safe_convert(self, row):
+        """ Convert row one value at a time using the safe* functions. """
+        return tuple(f(v) for f, v in zip(self.funcs, row))
+    
+    def batch(self, rows):
+        """ Convert a list of rows column by column. Return a list of tuples."""
+        cols = zip(*rows)
+        return list(zip(*(f(c) for f, c in zip(self.column_funcs, cols))))
+
+def converter_type(T):
+    """
+    Return the row_converter type name for an sqlite declared type T.
+    
+    Returns one of 'INTEGER', 'REAL', 'TEXT', 'DATE', or None if the declared 
+    type is not one that is imported from csv files.
+    """
+    T = T.upper()
+    if   T[:3] == 'INT':
+        return 'INTEGER'
+    elif T == 'REAL':
+        return 'REAL'
+    elif T == 'TEXT':
+        return 'TEXT'
+    elif T == 'CHAR':
+        return 'TEXT'
+    elif T == 'DATE':
+        return 'DATE'
+    return None
+
 def get_col_names_and_converters(db, table_name, csv_cols):
     """ 
-    Return a list of column names, and a dict of type converter functions.
+    Return a list of column names, and a row_converter for those columns.
     
     Arguments
     ---------
@@ -88,102 +206,438 @@ def get_col_names_and_converters(db, table_name, csv_cols):
     csv_cols: iterable, list of column names
     
     Only include columns appearing in BOTH the table def and in csv_cols. 
-    The csv DictReader method is case sensitive to the column names as entered
-    in the csv file, while the sql queries are not case sensitive to the column 
-    names.  Returned column names must match the case in csv_cols.
+    The csv header is case sensitive to the column names as entered in the csv
+    file, while the sql queries are not case sensitive to the column names.  
+    Returned column names must match the case in csv_cols.
     """
-    data = db.cur.execute(f'PRAGMA TABLE_INFO({table_name})').fetchall() 
+    data = db.get_table_info(table_name)
     utbl_cols = [c[1].upper() for c in data]
     ucol_types = [c[2].upper() for c in data]
     ucsv_cols = [c.upper() for c in csv_cols]
-    col_names, dcol_func = [], {}
+    col_names, col_types = [], []
 
     for N,T in zip(utbl_cols, ucol_types):
         if not N in ucsv_cols:
             continue
         n = csv_cols[ucsv_cols.index(N)] 
-        col_names.append(n)   
-        if   T[:3] == 'INTE':
-            dcol_func[n] = safeint
-        elif T == 'REAL':
-            dcol_func[n] = safefloat
-        elif T == 'TEXT':
-            dcol_func[n] = safetext
-        elif T == 'CHAR':
-            dcol_func[n] = safetext
-        elif T == 'DATE':
-            dcol_func[n] = safedate().date
-        else:
+        t = converter_type(T)
+        if t is None:
             raise NotImplementedError(f'type {T} is not implemented for table {table_name} in column {n}')
-    return col_names, dcol_func
+        col_names.append(n)   
+        col_types.append(t)
+    return col_names, row_converter(col_types)
+
+class ascii_lines():
+    """
+    Iterate over the lines of a text file, dropping any non-ASCII bytes.
+    
+    The file is read as binary one line at a time, so memory use is bounded
+    by the longest line, and the file itself is not modified.  Windows line 
+    endings (CR LF) are read as LF, as in a file opened in text mode.
+    
+    Attributes
+    ----------
+    fname   : The file name
+    dropped : The number of non-ASCII bytes dropped so far.
+    
+    Usage
+    -----
+    lines = ascii_lines(csvname)
+    for row in csv.reader(lines):
+        <do stuff>
+    print (lines.dropped)
+    
+    This is a crude fix that deletes information.  But experience shows that 
+    the only data affected in Dec 2021 was a single address with encoded '1/2' 
+    symbol.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.dropped = 0
+    
+    def __iter__(self):
+        with open(self.fname, 'rb') as f:
+            for bline in f:
+                line = bline.decode('ascii', 'ignore')
+                if len(line) < len(bline):
+                    self.dropped += len(bline) - len(line)
+                if line.endswith('\r\n'):
+                    line = line[:-2] + '\n'
+                yield line
+
+def read_csv_header(csvname):
+    """ Return the first line of csvname as ASCII text. """
+    for line in ascii_lines(csvname):
+        return line
+    return ''
+
+def csv_rows(datafile, col_names):
+    """
+    Yield the values of col_names from each line of an open csv file.
+    
+    Values are yielded as a tuple of strings, in the order of col_names.
+    As with csv.DictReader, the first line is the header, blank lines are 
+    skipped, and missing values at the end of a short line are read as ''. 
+    """
+    reader = csv.reader(datafile)
+    header = next(reader)
+    icol = {c: i for i, c in enumerate(header)}
+    icols = [icol[c] for c in col_names]
+    nhead = len(header)
+    pad = [''] * nhead
+    if len(icols) == 1:
+        i = icols[0]
+        pick = lambda line: (line[i],)
+    else:
+        pick = itemgetter(*icols)
+    for line in reader:
+        if not line:
+            continue
+        if len(line) < nhead:
+            line = line + pad[len(line):]
+        yield pick(line)
 
-def csv_generator(csvname, col_names, colfunc):
+def convert_rows(rows, convert, batch_size=None):
+    """
+    Yield type converted rows, either one at a time or in column batches.
+    """
+    if not batch_size:
+        yield from map(convert.convert, rows)
+        return
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            return
+        yield from convert.batch(chunk)
+
+def csv_generator(csvname, col_names, convert, batch_size=None, stats=None):
     """ 
     Yield next line from csv file as a tuple of type converted values
     
     Arguments:
     csvname   : Filename of an existing csv file to be read.
     col_names : Column names as entered in csv header (may be subset or reordered)
-    col_func  : Dictionary of type conversion functions 
+    convert   : row_converter for col_names
+    batch_size: int or None. If given, convert rows in column batches 
+    stats     : dict or None. If given, stats['ascii_dropped'] is set to the
+                number of non-ASCII bytes dropped from the file.
     
     Notes:
     -   The yielded values are ordered as in col_names.
-    -   The yielded values are type converted using functions in colfunc.
-    -   Both col_names and the keys used in col_func must match csv header  
-        entries exactly, including case.
+    -   The yielded values are type converted by convert.
+    -   col_names must match csv header entries exactly, including case.
+    -   Non-ASCII bytes are dropped as the file is read. See ascii_lines.
     """
-    # with open(csvname, 'r', encoding='ascii') as datafile:
-    with open(csvname, 'r') as datafile:
-        reader = csv.DictReader(datafile)
-        for line in reader:
-            yield tuple(colfunc[col](line[col]) for col in col_names)
+    datafile = ascii_lines(csvname)
+    rows = csv_rows(datafile, col_names)
+    yield from convert_rows(rows, convert, batch_size)
+    if stats is not None:
+        stats['ascii_dropped'] = datafile.dropped
 
-def csv_wellid_generator(csvname, col_names, colfunc, MNUcol='RELATEID'):
+def csv_wellid_generator(csvname, col_names, convert, MNUcol='RELATEID', 
+                         batch_size=None, stats=None):
     """ 
     Yield next line from csv file as a tuple of type converted values
     
     Arguments:
     csvname   : Filename of an existing csv file to be read.
     col_names : Column names as entered in csv header (may be subset or reordered)
-    col_func  : Dictionary of type conversion functions 
+    convert   : row_converter for col_names
+    batch_size: int or None. If given, convert rows in column batches 
+    stats     : dict or None. If given, stats['ascii_dropped'] is set to the
+                number of non-ASCII bytes dropped from the file.
     
     Notes:
     -   The yielded values are ordered as in col_names.
-    -   The yielded values are type converted using functions in colfunc.
-    -   Both col_names and the keys used in col_func must match csv header  
-        entries exactly, including case.
+    -   The yielded values are type converted by convert.
+    -   col_names must match csv header entries exactly, including case.
     -   Sets wellid to Null if the MNUcol cannot be converted to an integer. 
+    -   Non-ASCII bytes are dropped as the file is read. See ascii_lines.
     """
-    with open(csvname, 'r') as datafile:
-        reader = csv.DictReader(datafile)
-        for line in reader:
-            wellid = safeint(line[MNUcol])
-            yield tuple([wellid]+[colfunc[col](line[col]) for col in col_names])
+    convert = row_converter(('INTEGER',) + convert.col_types)
+    datafile = ascii_lines(csvname)
+    rows = csv_rows(datafile, [MNUcol] + list(col_names))
+    yield from convert_rows(rows, convert, batch_size)
+    if stats is not None:
+        stats['ascii_dropped'] = datafile.dropped
          
-def shp_locs_generator(shpname):
+def shp_locs_batches(shpname, wellid=False, batch_size=DBF_BATCH_ROWS):
     """
-    Yield next row from a shapefile's attribute table as a tuple.
+    Yield batches of rows from a shapefile's attribute table, as lists of tuples.
+    
+    shpname may name the .shp, the .dbf, or any other file of the shapefile.
     
     The first column in a shapefile is an internal flag that is not of interest.
     It is replaced with a text value of either 'loc' or 'unloc' depending on
-    whether 'unloc' appears in shpname. 
+    whether 'unloc' appears in shpname. If wellid is True, a wellid column
+    computed from RELATEID by safeint() is added before it, so a blank or
+    non-numeric RELATEID gives a NULL wellid, as in the csv import.
       
     The order and values of all other columns are preserved
     
     The coordinates are not read from the shape, but are assumed entered 
     correctly in attribute fields.
+
+    The attribute table is memory mapped and decoded a column at a time, see
+    OWI_shapefile.iter_dbf_columns(), and each batch can be passed directly
+    to executemany. Text is decoded with the encoding of the shapefile's 
+    .cpg file, see OWI_shapefile.shapefile_encoding().  A field value that 
+    cannot be decoded is NULL, and the well is kept.  A record marked 
+    deleted is skipped with a message.
     """
     if 'unloc' in shpname:
         cwi_loc = 'unloc'
     else:
         cwi_loc = 'loc'
-    assert os.path.exists(shpname), f"Shape file not found {shpname}."
+    shp, dbf = _file_names(shpname)
+    assert os.path.exists(dbf), f"Shape file not found {dbf}."
 
-    with shapefile.Reader(shpname) as shpf: 
-        keys = tuple((f[0] for f in shpf.fields[1:]))
+    encoding = shapefile_encoding(dbf)
+    if wellid:
+        irelateid = [f[0] for f in shapefile_fields(dbf, encoding)].index('RELATEID')
+    nread = 0
+    for columns, bad in iter_dbf_columns(dbf, batch_size, encoding):
+        n = len(columns[0]) if columns else 0
+        for i in sorted(bad):
+            print (f"shp_locs_batches: record {nread+i+1} of {dbf} is deleted, not read")
+        nread += n
+        if bad:
+            keep = [i for i in range(n) if not i in bad]
+            columns = [[c[i] for i in keep] for c in columns]
+            n = len(keep)
+        columns = [[cwi_loc] * n] + columns
+        if wellid:
+            columns = [[safeint(v) for v in columns[irelateid+1]]] + columns
+        yield list(zip(*columns))
 
-        for srec in shpf:
-            yield tuple([cwi_loc] + [srec.record[k] for k in keys])
+def insert_csv_into_table(db, table_name, csvname, schema_has_constraints,
+                          batch_size=None):
+    """
+    Read a csv file and insert its rows into table_name.
+    
+    Arguments
+    ---------
+    db        : open SQLite database with open cursor
+    table_name: str, a table that exists in the db
+    csvname   : Filename of an existing csv file to be read.
+    schema_has_constraints: boolean. If True and the csv file has no wellid
+                column, then wellid is supplied from column RELATEID.
+    batch_size: int or None. If given, values are type converted in column 
+                batches of batch_size rows. See row_converter.batch()
+    
+    Returns
+    -------
+    tuple : (list of table columns that were inserted, in insert order,
+             number of non-ASCII bytes dropped from the csv file,
+             number of rows read from the csv file and inserted)
+    """
+    headers = read_csv_header(csvname)
+    csv_cols = headers.replace('"',' ').replace(',',' ').split()
+ 
+    col_names, col_convert = get_col_names_and_converters(db, table_name, csv_cols)
+    
+    if schema_has_constraints and not 'WELLID' in headers.upper():
+        cols = ['wellid'] + col_names
+        csvgen = csv_wellid_generator
+    else:
+        cols = list(col_names)
+        csvgen = csv_generator
+    insert = (f"INSERT INTO {table_name}\n"
+              f" ({', '.join(cols)})\n"
+              f" VALUES ({db.qmarks(cols)});")
+    print ('begin: ',insert)
+    stats = {}
+    db.cur.executemany(insert, csvgen(csvname, col_names, col_convert, 
+                                      batch_size=batch_size, stats=stats))
+    nrows = db.cur.rowcount
+    dropped = stats.get('ascii_dropped', 0)
+    if dropped:
+        print (f"{dropped} non-ASCII bytes dropped from {csvname}")
+    return cols, dropped, nrows
+
+def import_csv_to_shard(table_name, table_sql, csvname, shard_name, 
+                        schema_has_constraints):
+    """
+    Worker process for cwi_csvupdate.import_data_from_csv_parallel()
+    
+    Create table_name in a new shard database using table_sql, and import 
+    csvname into it. The shard is scratch space, so it is written without a
+    journal or syncing.
+    
+    Returns
+    -------
+    tuple : (table_name, shard_name, inserted column names, number of rows
+             read from csvname, number of non-ASCII bytes dropped)
+    """
+    with c4db(db_name=shard_name, commit=True) as db:
+        db.query('PRAGMA journal_mode = OFF')
+        db.query('PRAGMA synchronous = OFF')
+        db.query(table_sql)
+        cols, dropped, n = insert_csv_into_table(db, table_name, csvname, 
+                                                 schema_has_constraints)
+    return table_name, shard_name, cols, n, dropped
+
+def merge_shard_into_table(db, shard_name, table_name, cols):
+    """
+    Append all rows of table_name in database shard_name to table_name in db.
+    
+    Only columns in cols are copied; other columns take their default values.
+    The shard rows are appended in their original order.  The merge is 
+    committed so that the shard can be detached, so db must permit commits.
+    """
+    collist = ', '.join(cols)
+    db.query("ATTACH DATABASE ? AS shard;", (shard_name,))
+    db.query(f"""INSERT INTO main.{table_name} ({collist})
+                 SELECT {collist} FROM shard.{table_name}
+                 ORDER BY rowid;""")
+    db.commit_db(msg=f'Merged table {table_name}')
+    db.query("DETACH DATABASE shard;")
+
+SOURCE_HASH_TABLE = 'owi_source_hash'
+
+def create_source_hash_table(db):
+    """
+    Create the table of per-well source hashes used by incremental updates.
+    
+    One row per (table_name, wellid) records a hash of the rows of that wellid
+    as they were read from the source file, the number of rows, and the 
+    latest ENTRY_DATE or UPDT_DATE among them (if the table has those).
+    """
+    db.query(f"""CREATE TABLE IF NOT EXISTS {SOURCE_HASH_TABLE} (
+                    table_name  TEXT    NOT NULL,
+                    wellid      INTEGER NOT NULL,
+                    rowhash     INTEGER NOT NULL,
+                    nrows       INTEGER NOT NULL,
+                    updt_date   INTEGER,
+                    PRIMARY KEY (table_name, wellid)
+                 ) WITHOUT ROWID;""")
+
+def well_source_hashes(rows, iwellid, idates=()):
+    """
+    Return a dict of {wellid: [rowhash, nrows, updt_date]} for source rows.
+    
+    Arguments
+    ---------
+    rows    : iterable of tuples of source values (raw csv text)
+    iwellid : index of the wellid or RELATEID value in each row
+    idates  : indexes of the ENTRY_DATE and UPDT_DATE values, if any
+    
+    The rowhash of a wellid is the sum of a 64 bit hash of each of its rows,
+    so it does not depend on the order of the rows in the file. It is stored
+    as a signed 64 bit integer, as sqlite requires.
+    Rows whose wellid is not an integer are counted under wellid None.
+    """
+    rv = {}
+    blake2b = hashlib.blake2b
+    for row in rows:
+        w = safeint(row[iwellid])
+        h = int.from_bytes(blake2b(repr(row).encode(), digest_size=8).digest(), 'little')
+        d = max((safeint(row[i]) or 0 for i in idates), default=None)
+        e = rv.get(w)
+        if e is None:
+            rv[w] = [h, 1, d]
+        else:
+            e[0] = (e[0] + h) & 0xFFFFFFFFFFFFFFFF
+            e[1] += 1
+            if d is not None and (e[2] is None or d > e[2]):
+                e[2] = d
+    for e in rv.values():
+        if e[0] >= 0x8000000000000000:
+            e[0] -= 0x10000000000000000
+    return rv
+
+SOURCE_FILE_TABLE = 'owi_source_file'
+
+def create_source_file_table(db):
+    """
+    Create the table of source file fingerprints of imported tables.
+    
+    One row per (table_name, source_name) records the size and sha256 hash of
+    the source file (csv or dbf) when it was last imported, and the number of
+    rows read from that file.
+    """
+    db.query(f"""CREATE TABLE IF NOT EXISTS {SOURCE_FILE_TABLE} (
+                    table_name  TEXT    NOT NULL,
+                    source_name TEXT    NOT NULL,
+                    size        INTEGER NOT NULL,
+                    sha256      TEXT    NOT NULL,
+                    nrows       INTEGER,
+                    imported    TEXT,
+                    PRIMARY KEY (table_name, source_name)
+                 ) WITHOUT ROWID;""")
+
+def file_fingerprint(fname, blocksize=1<<20):
+    """ Return (size, sha256 hex digest) of file fname. """
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return os.path.getsize(fname), h.hexdigest()
+
+BUILD_JOURNAL_TABLE = 'owi_build_journal'
+
+class build_journal():
+    """
+    Journal of the completed steps of a database build, kept in the database.
+    
+    Each step is journaled in the same commit as its last edits, so that a 
+    rerun of an interrupted build can skip the steps that were completed. The
+    journal is cleared when the build is finished, so that the next build 
+    starts from the first step.
+    
+    Each step is journaled with build_id, which identifies the source files
+    and options of the build (see cwi_csvupdate.build_id()).  A journal left
+    by a build with another build_id is cleared, so that a rerun with changed
+    source files starts from the first step rather than resuming.
+    
+    Usage
+    -----
+    J = build_journal(db, build_id)
+    if not J.done('step a'):
+        <edit db>
+        J.complete('step a', msg='Completed step a')
+    ...
+    J.finish()
+    """
+    def __init__(self, db, build_id=''):
+        self.db = db
+        self.build_id = build_id
+        db.query(f"""CREATE TABLE IF NOT EXISTS {BUILD_JOURNAL_TABLE} (
+                        step      TEXT PRIMARY KEY,
+                        build_id  TEXT NOT NULL,
+                        completed TEXT NOT NULL
+                     );""")
+        if db.queryone(f"""SELECT count(*) FROM {BUILD_JOURNAL_TABLE} 
+                           WHERE build_id <> ?;""", (build_id,)):
+            print ("The source files or options changed since the interrupted build, "
+                   "it is not resumed.")
+            db.query(f"DELETE FROM {BUILD_JOURNAL_TABLE};")
+            db.commit_db(msg='Cleared the build journal.')
+        self.completed = {r[0] for r in 
+                          db.query(f"SELECT step FROM {BUILD_JOURNAL_TABLE};")}
+        if self.completed:
+            print (f"Resuming build: {len(self.completed)} steps were completed previously.")
+
+    def done(self, step):
+        """ Return True if step is journaled as completed. """
+        if step in self.completed:
+            print (f"Skipping completed step: {step}")
+            return True
+        return False
+
+    def complete(self, step, msg=''):
+        """ Journal step as completed, and commit. """
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        self.db.query(f"INSERT OR REPLACE INTO {BUILD_JOURNAL_TABLE} VALUES (?,?,?);",
+                      (step, self.build_id, now))
+        self.completed.add(step)
+        return self.db.commit_db(msg=msg or step)
+
+    def finish(self):
+        """ Clear the journal at the end of a completed build, and commit. """
+        self.db.query(f"DELETE FROM {BUILD_JOURNAL_TABLE};")
+        self.completed.clear()
+        return self.db.commit_db(msg='Build complete.')
 
 class cwi_csvupdate():
     """ Methods for importing csv files into OWI database tables. """
@@ -196,12 +650,18 @@ class cwi_csvupdate():
         self.data_table_suffixes = 'ix id ad an c1 c2 pl rm st wl'.split()
         self.data_table_names = [f'c4{x}' for x in self.data_table_suffixes]
         self.locs_table_name = 'c4locs'
+        self.unique_wellid_table_names = ('c4ix', 'c4locs')
+        self.ascii_dropped = {}
+        self.fingerprints = {}
+        # {source file name: number of rows read from it by this instance}
+        self.source_nrows = {}
 
         assert os.path.exists(self.cwidatacsvdir), f"Missing {self.cwidatacsvdir}"
         assert os.path.exists(self.locsdir), f"Missing {self.locsdir}"
     
     def delete_table_data(self, db, 
-                          tables=None):    
+                          tables=None,
+                          table_names=None):    
         """
         Delete all from the c4* data and locs tables. Preparing to import.
         
@@ -209,16 +669,21 @@ class cwi_csvupdate():
         ---------
         db     : an open database instance
         tables : either None, or a string including 'data' and/or 'locs' 
+        table_names : iterable of data table names to empty, or None for all
+                 data tables.
         """
         dodata = tables is None or 'data' in tables
         dolocs = tables is None or 'locs' in tables
+        if table_names is None:
+            table_names = self.data_table_names
         if dodata:
-            for t in self.data_table_names:
+            for t in table_names:
                 csvname = os.path.join(self.cwidatacsvdir, f'{t}.csv')
                 if not os.path.exists(csvname):
                     print(f'Missing {csvname}, Table {t} not refreshed')
                     continue
                 db.query(f"DELETE FROM {t};")
+                self.delete_source_hashes(db, t)
             print ('data files emptied')
         if dolocs:
             for fname, val in(('wells.shp',       'loc'  ), 
@@ -226,6 +691,7 @@ class cwi_csvupdate():
                 shpname = os.path.join(self.locsdir, fname)
                 if os.path.exists(shpname):
                     db.query (f"DELETE FROM c4locs where cwi_loc = '{val}';",)
+                    self.delete_source_hashes(db, 'c4locs')
                     print (f"DELETE FROM c4locs where cwi_loc = '{val}';")
                 else:
                     print(f'Missing {shpname}, {val} records not refreshed')
@@ -233,16 +699,30 @@ class cwi_csvupdate():
         db.vacuum()
                  
     def import_data_from_csv(self, db, schema_has_constraints, 
-                             table_names=None):    
+                             table_names=None,
+                             parallel=False,
+                             max_workers=None):    
         """ 
         Create c4 tables in an sqlite db, and read in data from csv files
  
+        Arguments
+        ---------
+        db          : an open database instance
+        schema_has_constraints : boolean, passed to insert_csv_into_table()
+        table_names : iterable of table names, or None for all data tables
+        parallel    : boolean, default=False. If True, read the tables in 
+                      worker processes (see import_data_from_csv_parallel)
+        max_workers : int or None. Number of worker processes if parallel.
+
         Notes
         ----- 
         Assumes that the csv files have already been downloaded and extracted.
             fullset/cwi_CSV.zip
         Assumes that data tables have been created.
         Skips any table that already has at least 1 record in it.
+        Non-ASCII bytes are dropped as the csv files are read, and the count
+        dropped from each table is kept in self.ascii_dropped. The csv files
+        are not modified.
         Some details and steps will depend on the c4version selected, described
            below.
          
@@ -260,6 +740,7 @@ class cwi_csvupdate():
         
         existing_tables = db.get_tablenames()
 
+        pending = []
         for table_name in table_names:
             assert table_name in existing_tables, f'{table_name} missing from db'
             print (f'OK {table_name}')
@@ -271,29 +752,83 @@ class cwi_csvupdate():
                         
             csvname = os.path.join(self.cwidatacsvdir, f'{table_name}.csv')
             assert os.path.exists(csvname), csvname
+            pending.append((table_name, csvname))
 
-            ok = self.force_to_ascii(csvname)
-            
-            with open(csvname, 'r') as f:
-                headers = f.readline()
-            csv_cols = headers.replace('"',' ').replace(',',' ').split()
-         
-            col_names, col_convert = get_col_names_and_converters(db, table_name, csv_cols)
-            
-            if schema_has_constraints and not 'WELLID' in headers.upper():
-                insert = (f"INSERT INTO {table_name}\n"
-                          f" (wellid, {', '.join(col_names)})\n"
-                          f" VALUES ({db.qmarks( len(col_names) + 1 )});")
-                csvgen = csv_wellid_generator
-            else:
-                insert = (f"INSERT INTO {table_name}\n"
-                          f" ({', '.join(col_names)})\n"
-                          f" VALUES ({db.qmarks(col_names)});")
-                csvgen = csv_generator
-            print ('begin: ',insert)
-            db.cur.executemany(insert, csvgen(csvname, col_names, col_convert))
+        if parallel and len(pending) > 1:
+            if self.import_data_from_csv_parallel(db, schema_has_constraints,
+                                                  pending, max_workers):
+                return
+            print ('Parallel import not possible, importing tables serially.')
+
+        for table_name, csvname in pending:
+            cols, dropped, nrows = insert_csv_into_table(db, table_name, csvname, 
+                                                         schema_has_constraints)
+            self.ascii_dropped[table_name] = dropped
+            self.source_nrows[csvname] = nrows
             print (f"Completed table {table_name}") 
-    
+
+    def import_data_from_csv_parallel(self, db, schema_has_constraints, 
+                                      pending, max_workers=None):
+        """
+        Import csv files in parallel worker processes, then merge into db.
+        
+        Each table is read, type converted, and inserted into its own 
+        temporary shard database by import_csv_to_shard() running in a worker
+        process.  As each shard is finished it is ATTACHed to db, its rows are
+        appended to the db table with INSERT .. SELECT, and it is committed, 
+        DETACHed, and deleted. 
+        
+        Arguments
+        ---------
+        db          : an open database instance. Must permit commits.
+        schema_has_constraints : boolean, passed to insert_csv_into_table()
+        pending     : list of (table_name, csvname) tuples
+        max_workers : int or None. Number of worker processes. If None, the 
+                      number of cpus is used.
+        
+        Returns
+        -------
+        True if the tables were imported, False if the parallel import was not
+        attempted.
+        
+        Notes
+        -----
+        -   Shard files are written to a temporary folder beside db, so there 
+            must be room there for a second copy of the imported data.
+        -   Each table is committed as it is merged, because an attached 
+            database cannot be detached inside an open transaction.
+        -   The largest csv files are submitted first to balance the workers.
+        -   On Windows the calling script must be protected by 
+            if __name__ == '__main__':  because workers re-import it.
+        """
+        if db.db_name == ':memory:' or not db._context_autocommit:
+            return False
+
+        shard_dir = tempfile.mkdtemp(prefix='owi_shards_',
+                                     dir=os.path.dirname(os.path.abspath(db.db_name)))
+        ddl = dict(db.cur.execute(
+            "select name, sql from sqlite_master where type='table'").fetchall())
+        pending = sorted(pending, key=lambda p: os.path.getsize(p[1]), reverse=True)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = [pool.submit(import_csv_to_shard, 
+                                       table_name, 
+                                       ddl[table_name], 
+                                       csvname,
+                                       os.path.join(shard_dir, f'{table_name}.sqlite'),
+                                       schema_has_constraints)
+                           for table_name, csvname in pending]
+                for future in as_completed(futures):
+                    table_name, shard_name, cols, n, dropped = future.result()
+                    self.ascii_dropped[table_name] = dropped
+                    self.source_nrows[dict(pending)[table_name]] = n
+                    print (f'merging {n} records into {table_name} from {shard_name}')
+                    merge_shard_into_table(db, shard_name, table_name, cols)
+                    os.remove(shard_name)
+                    print (f"Completed table {table_name}") 
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        return True
 
     def import_locs_from_csv(self, db, schema_has_constraints):
         """
@@ -322,7 +857,12 @@ class cwi_csvupdate():
 
         The shapefiles have many columns that either reproduce data in c4ix
         or other tables, or summarize multiple values as a single value.
+
+        If c4locs has a wellid column, the wellid is supplied from RELATEID as
+        each record is inserted, as required by schemas with a NOT NULL or 
+        foreign key constraint on wellid.
         """
+        has_wellid = 'wellid' in db.get_column_names(self.locs_table_name)
         fnames = ['wells.dbf', 'unloc_wells.dbf']
         for fname in fnames:
             shpname = os.path.join(self.locsdir, fname)
@@ -332,17 +872,258 @@ class cwi_csvupdate():
             
             # Peek into the shapefile to get the column names.
             # Change the name of column 1 to 'cwi_loc'
-            with shapefile.Reader(shpname) as shpf: 
-                cols = tuple(['cwi_loc'] + [f[0] for f in shpf.fields[1:]])
+            cols = tuple(['cwi_loc'] + [f[0] for f in shapefile_fields(shpname)])
+            wellid = has_wellid and not 'wellid' in cols
+            if wellid:
+                cols = ('wellid',) + cols
             qmarks = db.qmarks(cols)
             insert = f"""insert into {self.locs_table_name} (
                          {', '.join(cols)}
                          ) values ({qmarks});""".replace('                         ','  ')
 
             print ('begin: ',insert)
-            db.cur.executemany(insert, shp_locs_generator(shpname))
+            n = 0
+            for rows in shp_locs_batches(shpname, wellid):
+                db.cur.executemany(insert, rows)
+                n += len(rows)
+            self.source_nrows[shpname] = n
             print (f'completed import of shapefile {shpname}')
 
+    def source_file_names(self, table_name):
+        """
+        Return a list of the existing source files for table_name.
+        
+        c4locs is read from c4locs.csv if it exists, else from the attribute
+        tables of the shapefiles wells.dbf and unloc_wells.dbf.
+        """
+        csvname = os.path.join(self.cwidatacsvdir, f'{table_name}.csv')
+        if table_name != self.locs_table_name or os.path.exists(csvname):
+            fnames = [csvname]
+        else:
+            fnames = [os.path.join(self.locsdir, f) 
+                      for f in ('wells.dbf', 'unloc_wells.dbf')]
+        return [f for f in fnames if os.path.exists(f)]
+
+    def source_fingerprint(self, fname):
+        """ 
+        Return (size, sha256) of fname, hashing it only once per version.
+        """
+        key = (fname, os.path.getsize(fname), os.path.getmtime(fname))
+        if not key in self.fingerprints:
+            self.fingerprints[key] = file_fingerprint(fname)
+        return self.fingerprints[key]
+
+    def build_id(self, table_names, *options):
+        """
+        Return a sha256 hex digest identifying a build from the source files
+        of table_names, and options.
+        
+        The digest covers the name, size, and sha256 of each source file, so
+        it changes if any source file is changed, added, or removed.
+        """
+        h = hashlib.sha256(repr(options).encode())
+        for table_name in table_names:
+            for fname in self.source_file_names(table_name):
+                size, sha256 = self.source_fingerprint(fname)
+                h.update(f"{table_name} {os.path.basename(fname)} {size} {sha256}\n".encode())
+        return h.hexdigest()
+
+    def changed_tables(self, db, table_names):
+        """
+        Return the tables in table_names whose source files have changed.
+        
+        A table is unchanged if each of its source files has the same size and
+        sha256 as recorded in table owi_source_file at its last import, and 
+        the table is not empty (unless it was imported empty). Tables with no
+        recorded fingerprint are changed.
+        """
+        create_source_file_table(db)
+        rv = []
+        for table_name in table_names:
+            fnames = self.source_file_names(table_name)
+            old = {row[0]: row[1:] for row in db.query(
+                      f"""SELECT source_name, size, sha256, nrows 
+                          FROM {SOURCE_FILE_TABLE} WHERE table_name = ?;""",
+                      (table_name,))}
+            same = bool(fnames) and len(fnames) == len(old)
+            for fname in fnames:
+                o = old.get(os.path.basename(fname))
+                if not same or o is None or tuple(o[:2]) != self.source_fingerprint(fname):
+                    same = False
+                    break
+            if same and not all(o[2] == 0 for o in old.values()):
+                same = db.queryone(f"SELECT count(*) FROM (SELECT 1 FROM {table_name} LIMIT 1);") > 0
+            if same:
+                print (f"skipping {table_name}, source files unchanged since last import.")
+            else:
+                rv.append(table_name)
+        return rv
+
+    def record_source_fingerprints(self, db, table_names):
+        """
+        Record the fingerprints of the source files of table_names.
+        
+        Call this after the tables have been imported from their sources. The
+        number of rows read from each file is recorded if it was read by this
+        instance, else NULL.
+        """
+        create_source_file_table(db)
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        for table_name in table_names:
+            db.query(f"DELETE FROM {SOURCE_FILE_TABLE} WHERE table_name = ?;",
+                     (table_name,))
+            for fname in self.source_file_names(table_name):
+                size, sha256 = self.source_fingerprint(fname)
+                n = self.source_nrows.get(fname)
+                db.query(f"INSERT INTO {SOURCE_FILE_TABLE} VALUES (?,?,?,?,?,?);",
+                         (table_name, os.path.basename(fname), size, sha256, n, now))
+
+    def delete_source_hashes(self, db, table_name):
+        """ Forget the source hashes of table_name, if any are recorded. """
+        if SOURCE_HASH_TABLE in db.get_tablenames():
+            db.query(f"DELETE FROM {SOURCE_HASH_TABLE} WHERE table_name = ?;",
+                     (table_name,))
+
+    def update_data_from_csv(self, db, table_names=None):
+        """
+        Incrementally update c4 tables from new csv files.
+        
+        Only the wells whose rows have changed since the last update are 
+        deleted and re-inserted.  The tables are not emptied first.
+        
+        Arguments
+        ---------
+        db          : an open database instance
+        table_names : iterable of table names, or None for all data tables
+        
+        Returns
+        -------
+        dict of {table_name: (number of wells replaced, number deleted)}
+        
+        Notes
+        -----
+        -   Requires a schema with a wellid column in every table.
+        -   The rows of each wellid are hashed as they are read from the csv
+            file, and compared to the hashes recorded in table 
+            owi_source_hash by the previous update.  Tables are compared 
+            separately, so a change in c4st does not touch c4ix.
+        -   A full import (delete_table_data) forgets the recorded hashes, so
+            the first update after a full import replaces every well once,
+            and deletes the wells of the table that are not in the csv file
+            (rows added by OWI excepted).
+        -   Rows added by OWI (owi_remark is not NULL) are not deleted, except
+            in c4ix and c4locs, where wellid must be unique.
+        -   The MNU model SQL files should be run again after an update.
+        """
+        if table_names is None: 
+            table_names = self.data_table_names 
+        create_source_hash_table(db)
+
+        rv = {}
+        for table_name in table_names:
+            csvname = os.path.join(self.cwidatacsvdir, f'{table_name}.csv')
+            if not os.path.exists(csvname):
+                print(f'Missing {csvname}, Table {table_name} not updated')
+                continue
+            rv[table_name] = self.update_table_from_csv(db, table_name, csvname)
+        return rv
+
+    def update_table_from_csv(self, db, table_name, csvname):
+        """
+        Incrementally update one table from a csv file.
+        
+        See update_data_from_csv().  The csv file is read twice: once to hash
+        the rows of every wellid, and again to insert the rows of the changed
+        wellids only.
+        
+        Returns
+        -------
+        tuple : (number of wells replaced or added, number of wells deleted)
+        """
+        tbl_cols = [c.upper() for c in db.get_column_names(table_name)]
+        assert 'WELLID' in tbl_cols, f'{table_name} has no wellid column'
+        headers = read_csv_header(csvname)
+        csv_cols = headers.replace('"',' ').replace(',',' ').split()
+        col_names, convert = get_col_names_and_converters(db, table_name, csv_cols)
+        ucols = [c.upper() for c in col_names]
+        if 'WELLID' in ucols:
+            read_cols = col_names
+            iwellid = ucols.index('WELLID')
+        else:
+            read_cols = [col_names[ucols.index('RELATEID')]] + col_names
+            iwellid = 0
+            convert = row_converter(('INTEGER',) + convert.col_types)
+            ucols = ['WELLID'] + ucols
+        cols = ['wellid' if c == 'WELLID' else read_cols[i] 
+                for i, c in enumerate(ucols)]
+        idates = [i for i, c in enumerate(ucols) if c in ('ENTRY_DATE', 'UPDT_DATE')]
+
+        print (f'hashing {csvname} ...')
+        lines = ascii_lines(csvname)
+        new = well_source_hashes(csv_rows(lines, read_cols), iwellid, idates)
+        self.ascii_dropped[table_name] = lines.dropped
+        nbad = new.pop(None, [0, 0])[1]
+        self.source_nrows[csvname] = nbad + sum(e[1] for e in new.values())
+        if nbad:
+            print (f'{nbad} rows in {csvname} have no integer wellid, not imported')
+
+        old = {row[0]: row[1:] for row in db.query(
+                  f"""SELECT wellid, rowhash, nrows, updt_date 
+                      FROM {SOURCE_HASH_TABLE} WHERE table_name = ?;""", 
+                  (table_name,))}
+        changed = []
+        for w, e in new.items():
+            o = old.get(w)
+            if o is None or o[0] != e[0] or o[1] != e[1]:
+                changed.append(w)
+        if old:
+            deleted = [w for w in old if not w in new]
+        else:
+            # No hashes are recorded after a full import, so the wells to
+            # delete are those in the table that are not in the csv file.
+            remark = " AND owi_remark IS NULL" if 'OWI_REMARK' in tbl_cols else ''
+            deleted = [row[0] for row in db.query(
+                          f"""SELECT DISTINCT wellid FROM {table_name}
+                              WHERE wellid IS NOT NULL{remark};""")
+                       if not row[0] in new]
+        ndated = sum(1 for w in changed 
+                     if w in old and (new[w][2] or 0) > (old[w][2] or 0))
+        print (f'{table_name}: {len(changed)} wells new or changed '
+               f'({ndated} with newer ENTRY_DATE/UPDT_DATE), '
+               f'{len(deleted)} wells deleted, {len(new)} wells in {csvname}')
+        if not changed and not deleted:
+            return 0, 0
+
+        db.query("""CREATE TEMP TABLE IF NOT EXISTS owi_changed_wellid (
+                        wellid INTEGER PRIMARY KEY);""")
+        db.query("DELETE FROM temp.owi_changed_wellid;")
+        db.cur.executemany("INSERT INTO temp.owi_changed_wellid VALUES (?);",
+                           ((w,) for w in changed + deleted))
+        where = "wellid IN (SELECT wellid FROM temp.owi_changed_wellid)"
+        if ('OWI_REMARK' in tbl_cols 
+                and not table_name in self.unique_wellid_table_names):
+            where += " AND owi_remark IS NULL"
+        db.query(f"DELETE FROM {table_name} WHERE {where};")
+        
+        changedset = set(changed)
+        insert = (f"INSERT INTO {table_name}\n"
+                  f" ({', '.join(cols)})\n"
+                  f" VALUES ({db.qmarks(cols)});")
+        rows = (convert.convert(row) 
+                for row in csv_rows(ascii_lines(csvname), read_cols)
+                if safeint(row[iwellid]) in changedset)
+        db.cur.executemany(insert, rows)
+
+        db.query(f"""DELETE FROM {SOURCE_HASH_TABLE} 
+                     WHERE table_name = ? 
+                       AND wellid IN (SELECT wellid FROM temp.owi_changed_wellid);""",
+                 (table_name,))
+        db.cur.executemany(
+            f"INSERT INTO {SOURCE_HASH_TABLE} VALUES (?,?,?,?,?);",
+            ((table_name, w, *new[w]) for w in changed))
+        print (f"Completed update of table {table_name}") 
+        return len(changed), len(deleted)
+
     def populate_wellid_and_index(self, db, haslocs):
         """
         Set the wellid values in all data tables.
@@ -362,10 +1143,15 @@ class cwi_csvupdate():
             db.query(s.format(tablename=tablename))
         print (f"Completed updating wellid in table {tablename}")
 
-    def force_to_ascii(self, fname):
+    @staticmethod
+    def force_to_ascii(fname):
         """ 
         Remove any non-ASCII characters from the csv files.
         
+        The import methods no longer need this, because the csv generators
+        drop non-ASCII bytes as they read (see ascii_lines).  It remains 
+        available for preparing the files for other uses.
+        
         This is a crude fix that deletes information.  But experience shows that the
         only data affected in Dec 2021 was a single address with encoded '1/2' 
         symbol.
@@ -381,13 +1167,50 @@ class cwi_csvupdate():
             print (e)
             return False
 
+def execute_mnu_file(db, sqlfile, **kwargs):
+    """
+    Execute an OWI_MNU_INSERT sql file, or the python step that replaces it.
+    
+    If OWI_MNU_XREF_ENGINE is set, OWI_MNU_KNOWN_XREFS is run by 
+    OWI_mnu_xref.apply_known_xrefs(), which makes the same edits; if kwarg
+    profile is True it is profiled as one step by profile_function(). 
+    Otherwise kwargs are passed to execute_statements_from_file().
+    
+    If OWI_MNU_INDEX_ADVISOR is set, the indexes advised for each statement
+    are created just before it is run, and dropped after the file if 
+    OWI_MNU_DROP_ADVISED_INDEXES is set.  See OWI_index_advisor.
+    """
+    if C.OWI_MNU_XREF_ENGINE and C.OWI_MNU_KNOWN_XREFS and \
+       os.path.basename(sqlfile) == os.path.basename(C.OWI_MNU_KNOWN_XREFS):
+        from OWI_mnu_xref import apply_known_xrefs
+        print (f"execute_mnu_file: {sqlfile} by OWI_mnu_xref.apply_known_xrefs()")
+        if kwargs.get('profile'):
+            return profile_function(db, sqlfile, apply_known_xrefs, run=kwargs.get('run'))
+        return apply_known_xrefs(db)
+    if not C.OWI_MNU_INDEX_ADVISOR:
+        return execute_statements_from_file(db, sqlfile, **kwargs)
+    
+    from OWI_index_advisor import provision_statement_indexes, drop_indexes
+    created = []
+    row_counts = {}
+    rv = execute_statements_from_file(db, sqlfile, 
+            before=lambda db, s: created.extend(provision_statement_indexes(
+                                     db, s, row_counts=row_counts)),
+            **kwargs)
+    if C.OWI_MNU_DROP_ADVISED_INDEXES:
+        drop_indexes(db, created)
+    return rv
+
 def RUN_import_csv(data=True, 
                    locs=True,
                    wellids=True,
-                   resume_MNU_at = 0):
+                   resume_MNU_at = 0,
+                   incremental=False,
+                   profile_sql=False):
     """ 
     Demonstrate full import from csv files (and shape files). 
-    Creates a new OWI.sqlite.  Does not update an existing OWI.sqlite
+    Creates a new OWI.sqlite, or updates an existing OWI.sqlite if 
+    incremental is True.
 
     Arguments
     ---------
@@ -403,7 +1226,29 @@ def RUN_import_csv(data=True,
         
         resume_MNU_at: int, default=0
                   Resume processing at step n in OWI_MNU_INSERT
-                  (n should be shown in prior output)
+                  (n should be shown in prior output). Normally not needed,
+                  see the build journal below.
+        
+        incremental: boolean, default=False
+                  If True, update an existing OWI.sqlite from the csv files
+                  by replacing only the wells that have changed, rather than
+                  emptying and re-importing the tables. c4locs is updated the
+                  same way if it is supplied as c4locs.csv; shapefile locs are
+                  re-imported.  See cwi_csvupdate.update_data_from_csv()
+                  The indexes are kept during the update (no bulk_load), and
+                  the OWI_MNU_INSERT files are skipped if no well changed.
+        
+        profile_sql: boolean, default=False
+                  If True, each statement of the OWI_MNU_INSERT files is 
+                  timed and its query plan captured in table owi_sql_profile,
+                  and a ranked report is printed.  See OWI_sqlfile.
+    
+    Tables whose source files are unchanged since their last import are 
+    skipped, in either mode, and a full import drops and recreates only the
+    indexes of the changed tables.  If no table changed, the wellids, the
+    location and text indexes, the MNU model, and the materialized views are
+    not rebuilt.  The fingerprints are kept in table owi_source_file; delete
+    its rows to force a table to be re-imported.
                 
     Prerequisites
     -------------
@@ -414,14 +1259,22 @@ def RUN_import_csv(data=True,
         - OWI_DOWNLOAD_DIR            must exist: wells.shp and unloc_wells.shp 
         - OWI_DOWNLOAD_CWIDATACSV_DIR must exist: cwidata .csv files
         
+    Build journal
+    -------------
+    Each step (deleting and importing data, deleting and importing locs, 
+    populating wellid, reformatting UNIQUE_NO, indexing c4locs locations and 
+    text columns, each OWI_MNU_INSERT file, and refreshing materialized views)
+    is recorded in table owi_build_journal when it is committed. If a build 
+    is interrupted, just run it again: the completed steps are skipped and it
+    resumes at the first incomplete step.  The journal is cleared when the 
+    build finishes, or when it is rerun with changed source files or options.
+    See build_journal.
+    
     IMPORTANT!!!!!
     --------------
-    -   If it runs incompletely or with errors, the final state may be faulty.
-    -   If it runs incompletely or with errors, you can try to comment out
-        sections below that have been complete in order to only run the 
-        incomplete portions. The logic allows limited user control from this
-        method, but does not recognize when steps have been completed.  For 
-        example, reading in csv files twice will just create duplicate records.
+    -   If it runs with errors that are only printed, the steps are still 
+        journaled and the final state may be faulty.  Empty the table 
+        owi_build_journal before rerunning such a build from the beginning.
     """
     from OWI_sqlite import c4db 
 
@@ -430,6 +1283,9 @@ def RUN_import_csv(data=True,
         assert locs == False, 'option locs should be False if resum_MUN_at > 0'
         assert wellids == False, 'option wellids should be False if resum_MUN_at > 0'
        
+    if incremental:
+        assert C.OWI_SCHEMA_HAS_WELLID, 'option incremental requires a schema with wellid'
+
     if C.OWI_SCHEMA_HAS_DATA_CONSTRAINTS:
         print('Warning. The CWI data files do not pass UNIQUE constaints')
         #raise NotImplementedError('Data constraints models are not implemented')
@@ -449,21 +1305,74 @@ def RUN_import_csv(data=True,
         if C.OWI_SCHEMA_HAS_FKwellid_CONSTRAINTS:
             db.query('PRAGMA foreign_keys = False')
  
-        if data: 
-            C4.delete_table_data(db, 'data')
-            C4.import_data_from_csv( db, C.OWI_SCHEMA_HAS_FKwellid_CONSTRAINTS)
-            db.commit_db(msg='Imported data from csv files.')
-        
-        if locs and C.OWI_SCHEMA_HAS_LOCS: 
-            C4.delete_table_data(db,'locs')
-            if not C4.import_locs_from_csv(db, C.OWI_SCHEMA_HAS_FKwellid_CONSTRAINTS):
-                C4.import_cwi_locs(db)
-            db.commit_db(msg='Imported c4locs from files.')
-        
-        if wellids:
-            if C.OWI_SCHEMA_HAS_WELLID:
+        bulk_tables = list(C4.data_table_names)
+        if C.OWI_SCHEMA_HAS_LOCS:
+            bulk_tables.append(C4.locs_table_name)
+        J = build_journal(db, C4.build_id(bulk_tables, data, locs, wellids, incremental))
+        tables = C4.changed_tables(db, C4.data_table_names) if data else []
+        dolocs = (locs and C.OWI_SCHEMA_HAS_LOCS and 
+                  C4.changed_tables(db, (C4.locs_table_name,)))
+        # The later steps and the MNU model are run again only if some table
+        # (or in an incremental update, some well) changed, if this build 
+        # resumes an interrupted one, or if no tables are imported, as when 
+        # resuming the MNU model.
+        if incremental:
+            changed = bool(J.completed)
+        else:
+            changed = bool(J.completed or tables or dolocs) or not (data or locs)
+        mviews = db.get_materialized_views()
+        if mviews and not incremental and changed:
+            # The materialized views are recreated after the full import.
+            db.drop_materialized_view_triggers()
+        # An incremental update deletes and inserts the rows of a few wells 
+        # by wellid, so it keeps the indexes rather than using bulk_load.  A
+        # full import drops the indexes of the changed tables only; a resumed
+        # build also recreates any indexes an interrupted bulk_load dropped.
+        bulk = list(tables) + list(dolocs or [])
+        with (nullcontext() if incremental or not (bulk or J.completed) 
+              else db.bulk_load(bulk)):
+            if tables and incremental and not J.done('update data'):
+                counts = C4.update_data_from_csv(db, table_names=tables)
+                changed = changed or any(sum(c) for c in counts.values())
+                C4.record_source_fingerprints(db, tables)
+                J.complete('update data', msg='Updated data from csv files.')
+            elif tables and not incremental and not J.done('import data'):
+                if not J.done('delete data'):
+                    C4.delete_table_data(db, 'data', table_names=tables)
+                    J.complete('delete data', msg='Deleted data from c4 tables.')
+                else:
+                    # A parallel import commits each table as it is merged. 
+                    C4.delete_table_data(db, 'data', table_names=tables)
+                C4.import_data_from_csv( db, C.OWI_SCHEMA_HAS_FKwellid_CONSTRAINTS,
+                                         table_names=tables,
+                                         parallel=C.OWI_IMPORT_PARALLEL)
+                C4.record_source_fingerprints(db, tables)
+                J.complete('import data', msg='Imported data from csv files.')
+            
+            if (dolocs and incremental and 
+                    os.path.exists(os.path.join(C4.cwidatacsvdir, 'c4locs.csv'))):
+                if not J.done('update locs'):
+                    counts = C4.update_data_from_csv(db, table_names=('c4locs',))
+                    changed = changed or any(sum(c) for c in counts.values())
+                    C4.record_source_fingerprints(db, ('c4locs',))
+                    J.complete('update locs', msg='Updated c4locs from csv file.')
+            elif dolocs and not J.done('import locs'): 
+                changed = True
+                if not J.done('delete locs'):
+                    C4.delete_table_data(db,'locs')
+                    J.complete('delete locs', msg='Deleted c4locs.')
+                if not C4.import_locs_from_csv(db, C.OWI_SCHEMA_HAS_FKwellid_CONSTRAINTS):
+                    C4.import_cwi_locs(db)
+                C4.record_source_fingerprints(db, ('c4locs',))
+                J.complete('import locs', msg='Imported c4locs from files.')
+        
+        if not changed:
+            print ('No tables changed, the indexes and the MNU model are not rebuilt.')
+        
+        if wellids and changed:
+            if C.OWI_SCHEMA_HAS_WELLID and not J.done('populate wellid'):
                 C4.populate_wellid_and_index(db, C.OWI_SCHEMA_HAS_LOCS)
-                db.commit_db(msg='Populated wellid in c4 data tables.')
+                J.complete('populate wellid', msg='Populated wellid in c4 data tables.')
             
             
             if C.OWI_REFORMAT_UNIQUE_NO:
@@ -471,28 +1380,51 @@ def RUN_import_csv(data=True,
                     c4locs.UNIQUE_NO.  This is really optional.
                 """
                 print (f"OWI_REFORMAT_UNIQUE_NO: {C.OWI_REFORMAT_UNIQUE_NO}, data:{data}, locs:{locs}")
-                if data:
+                if data and not J.done('reformat c4ix unique_no'):
                     db.update_unique_no_from_wellid('c4ix')
-                    db.commit_db(msg='Reformatted unique_no in c4ix')
-                if locs and C.OWI_SCHEMA_HAS_LOCS:
+                    J.complete('reformat c4ix unique_no', msg='Reformatted unique_no in c4ix')
+                if (locs and C.OWI_SCHEMA_HAS_LOCS and 
+                        not J.done('reformat c4locs unique_no')):
                     db.update_unique_no_from_wellid('c4locs')
-                    db.commit_db(msg='Reformatted unique_no in c4locs')
+                    J.complete('reformat c4locs unique_no', msg='Reformatted unique_no in c4locs')
+
+        if (changed and C.OWI_SCHEMA_HAS_LOCS and C.OWI_SCHEMA_HAS_WELLID and 
+                not J.done('locs rtree')):
+            db.create_locs_rtree()
+            J.complete('locs rtree', msg=f'Indexed c4locs in {db.locs_rtree}')
+
+        if changed and C.OWI_SCHEMA_HAS_WELLID and not J.done('text indexes'):
+            db.create_text_indexes(tables=C4.data_table_names)
+            J.complete('text indexes', msg='Created full-text indexes')
  
-        if C.OWI_SCHEMA_IDENTIFIER_MODEL == 'MNU':
+        if C.OWI_SCHEMA_IDENTIFIER_MODEL == 'MNU' and changed:
+            run = datetime.datetime.now().isoformat(timespec='seconds')
             for sqlfiles in C.OWI_MNU_INSERT[resume_MNU_at:]:
                 if not isinstance(sqlfiles, (list, tuple)):
                     sqlfiles = [sqlfiles]
                 for sqlfile in sqlfiles:
-                    execute_statements_from_file(db, sqlfile)
                     fname = os.path.basename(sqlfile)
-                    db.commit_db(msg=f'MNU model commands: {fname}')
+                    if J.done(f'MNU {fname}'):
+                        continue
+                    execute_mnu_file(db, sqlfile, commit=False,
+                                     profile=profile_sql, run=run)
+                    J.complete(f'MNU {fname}', msg=f'MNU model commands: {fname}')
                 # Resumat: (remember to set data, locs, wellids = False)
                 #       0:  mnu_MNU_relationship_o1.1.0.sql
                 #       1:  insert_c4locs_to_c4ix.sql
                 #       2:  mnu_clean_c4id_o1.1.0.sql
                 #       3:  mnu_reinit_o1id_o1.1.0.sql     
-                #       4:  mnu_analyze_faults_o1.1.0.sql 
-                #       5:  mnu_resolve_faults_o1.1.0.sql
+                #       4:  mnu_views_o1.1.0.sql
+                #       5:  mnu_known_xrefs_o1.1.0.sql, 
+                #           mnu_analyze_faults_o1.1.0.sql 
+                #       6:  mnu_resolve_faults_o1.1.0.sql
+            if profile_sql:
+                sql_profile_report(db, run)
+
+        if mviews and changed and not J.done('refresh materialized views'):
+            db.refresh_materialized_views(full=not incremental)
+            J.complete('refresh materialized views', msg='Refreshed materialized views')
+        J.finish()
         
         # if C.OWI_SCHEMA_HAS_FKwellid_CONSTRAINTS and C.OWI_SCHEMA_HAS_LOCS:
         #     C4.append_c4locs_to_c4ix(db)
@@ -502,7 +1434,7 @@ def RUN_import_csv(data=True,
             db.query('PRAGMA foreign_keys = True')
 
 
-def import_swuds_full(self, db, csvname, table_name='r1ap_full'):
+def import_swuds_full(db, csvname, table_name='r1ap_full'):
     """
     Import the swuds csv file into r1ap without modification.
     """
@@ -510,8 +1442,7 @@ def import_swuds_full(self, db, csvname, table_name='r1ap_full'):
     assert table_name in existing_tables,  f'{table_name} missing from db'
 
     assert os.path.exists(csvname), csvname
-    with open(csvname, 'r') as f:
-        headers = f.readline()
+    headers = read_csv_header(csvname)
     csv_cols = headers.replace('"',' ').replace(',',' ').split()
 
     col_names, col_convert = get_col_names_and_converters(db, table_name, csv_cols)
@@ -542,7 +1473,8 @@ def RUN_import_swuds(create=False):
     with c4db(db_name=db_name, commit=True) as db:
         if create:
             execute_statements_from_file(db, S.OWI_SWUDS_SCHEMA)
-        import_swuds_full(db, csvname)
+        with db.bulk_load((S.OWI_SWUDS_TABLEAP,)):
+            import_swuds_full(db, csvname)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,395 @@
+'''
+Index advisor for the sql files of the MNU model.
+
+The MNU sql files join and filter c4id, c4ix, o1id, and o1id_match on
+columns and expressions that have no index, such as c4id.IDENTIFIER,
+c4ix.UNIQUE_NO, o1id_match.identifier1, cast(wellid as text), and mmid.
+SQLite then either scans the inner table of a join for every outer row, or
+builds a temporary automatic index for the one statement.
+
+The advisor runs EXPLAIN QUERY PLAN on a statement, with automatic
+indexes on and off, and proposes an index for:
+    -   each automatic index in the plan, on the same columns.
+    -   each full SCAN of a table that is repeated for each row of an outer
+        loop (the inner table of a join, or a correlated subquery) when
+        automatic indexes are off, or that is replaced by an automatic
+        index, for each candidate in MNU_INDEX_CANDIDATES on that table
+        whose expression is compared in the statement on that table.
+Tables with fewer than min_rows rows at the time of the statement are not
+indexed.  Indexes that already exist are not proposed.  The advised indexes
+are named 'owi_adv_<table>__<expression>', so they are easily recognized
+and dropped.
+
+With OWI_MNU_INDEX_ADVISOR set in OWI_config, OWI_import_csv advises and
+creates the indexes of each statement of an OWI_MNU_INSERT file just before
+the statement, and drops them after the file if 
+OWI_MNU_DROP_ADVISED_INDEXES is set (the default), so that they do not slow
+the later inserts or take space in the database.
+
+    Usage:
+        advice = advise_indexes(db, sql_files)          # nothing created
+        names = provision_statement_indexes(db, sql)    # just before sql
+        drop_indexes(db, names)                         # after the file
+
+Methods
+-------
+    advise_indexes()
+    provision_statement_indexes()
+    drop_indexes()
+    advised_index_names()
+    RUN_index_advice()
+'''
+import os
+import re
+
+from OWI_sqlfile import is_select_statement, read_sql_file, strip_sql_comments
+
+# Candidate indexes of the MNU sql files: (table, expression, where).
+MNU_INDEX_CANDIDATES = (
+    ('c4id',       'IDENTIFIER',           None),
+    ('c4id',       'cast(wellid as text)', None),
+    ('c4id',       'mmid',                 'mmid IS NOT NULL'),
+    ('c4ix',       'UNIQUE_NO',            None),
+    ('o1id',       'IDENTIFIER',           None),
+    ('o1id_match', 'identifier1',          None),
+    ('o1id_match', 'identifier2',          None),
+    ('o1id_match', 'wellid1',              None),
+    ('o1id_match', 'wellid2',              None),
+)
+
+ADVISED_INDEX_PREFIX = 'owi_adv_'
+
+# Full scans of tables smaller than this are not worth an index.
+ADVISOR_MIN_ROWS = 10000
+
+_SQL_NOT_ALIAS = {'on', 'where', 'left', 'right', 'inner', 'outer', 'cross',
+                  'natural', 'join', 'set', 'group', 'order', 'limit', 'using',
+                  'union', 'except', 'intersect', 'select', 'values', 'as',
+                  'default', 'indexed', 'not'}
+
+_TABLE_REF = re.compile(r'\b(?:from|join|update|into)\s+([A-Za-z_]\w*)'
+                        r'(?:\s+(?:as\s+)?([A-Za-z_]\w*))?', re.I)
+
+_WRITTEN_TABLE = re.compile(r'\s*(?:insert(?:\s+or\s+\w+)?\s+into|replace\s+into'
+                            r'|update(?:\s+or\s+\w+)?|delete\s+from'
+                            r'|create\s+(?:temp\w*\s+)?table(?:\s+if\s+not\s+exists)?)'
+                            r'\s+([\w."]+)', re.I)
+
+_PLAN_STEP = re.compile(r'^(SCAN|SEARCH)(?: TABLE)? (\w+)(?: AS (\w+))?(.*)$')
+
+def _normalize(sql):
+    """ Return sql lower case, without comments or extra spaces. """
+    sql = strip_sql_comments(sql).lower()
+    sql = re.sub(r'\s+', ' ', sql)
+    return re.sub(r'\s*([(),=<>.])\s*', r'\1', sql)
+
+def _is_compared(expression, nsql, alias, columns, other_columns):
+    """
+    Return True if expression on table instance alias is compared or joined
+    in normalized sql.
+
+    columns are the column names of the table, and other_columns those of
+    the other tables of the statement (all lower case).  A column of the
+    expression must be qualified by alias, or be unqualified and not be a
+    column of another table.
+    """
+    e = _normalize(expression)
+    cols = []
+    pattern = ''
+    for token in re.split(r'(\b[a-z_]\w*\b)', e):
+        if token in columns:
+            cols.append(token)
+            pattern += rf'(?<![\w.])(?:([a-z_]\w*)\.)?{token}\b'
+        else:
+            pattern += re.escape(token)
+    if not cols:
+        return False
+    for m in re.finditer(pattern, nsql):
+        before, after = nsql[:m.start()], nsql[m.end():]
+        if re.search(r'(\bset |,)$', before) and after.startswith('='):
+            continue        # an assignment of UPDATE ... SET
+        if re.match(r'^\w+$', e) and not (
+               re.search(r'(=|<|>|\bin |\blike |\bglob )$', before) or
+               re.match(r'(=|<|>| in\b| is\b| like\b| glob\b)', after)):
+            continue
+        if all(q == alias if q else not c in other_columns
+               for q, c in zip(m.groups(), cols)):
+            return True
+    return False
+
+def table_aliases(sql):
+    """ Return {name or alias (lower case): table name} of the tables in sql. """
+    rv = {}
+    for table, alias in _TABLE_REF.findall(strip_sql_comments(sql)):
+        rv[table.lower()] = table
+        if alias and not alias.lower() in _SQL_NOT_ALIAS:
+            rv[alias.lower()] = table
+    return rv
+
+def advised_index_name(table, expression, where=None):
+    """ Return the name of the advised index on table(expression). """
+    name = re.sub(r'\W+', '_', expression.lower()).strip('_')
+    return f"{ADVISED_INDEX_PREFIX}{table.lower()}__{name}" + ('__partial' if where else '')
+
+def advised_index_sql(table, expression, where=None):
+    """ Return the CREATE INDEX statement of the advised index. """
+    s = (f'CREATE INDEX IF NOT EXISTS {advised_index_name(table, expression, where)}'
+         f' ON {table} ({expression})')
+    if where:
+        s += f' WHERE {where}'
+    return s + ';'
+
+def _existing_index_columns(db, table):
+    """ Return a list of the column lists of the full (not partial) indexes on table. """
+    rv = []
+    for seq, name, unique, origin, partial in db.con.execute(
+                                    f'PRAGMA index_list("{table}");').fetchall():
+        if not partial:
+            rv.append([str(r[2]).lower() for r in
+                       db.con.execute(f'PRAGMA index_info("{name}");').fetchall()])
+    return rv
+
+def _plan_steps(db, sql, automatic_index=True):
+    """
+    Yield (detail, repeated) for each step of the query plan of sql.
+
+    repeated is True if the step runs once per row of an outer loop: it
+    follows another SCAN or SEARCH in the same join, or it is inside a
+    correlated subquery.  If automatic_index is False, the plan is made with
+    PRAGMA automatic_index=OFF, so that the scans that automatic indexes
+    replace are shown.
+    """
+    auto = db.con.execute('PRAGMA automatic_index;').fetchone()[0]
+    try:
+        db.con.execute(f'PRAGMA automatic_index={int(automatic_index)};')
+        rows = db.con.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    except Exception:
+        return
+    finally:
+        db.con.execute(f'PRAGMA automatic_index={auto};')
+    detail = {0: ''}
+    parent_of = {}
+    loops = {}
+    for node, parent, notused, d in rows:
+        detail[node] = d
+        parent_of[node] = parent
+        repeated = loops.get(parent, 0) > 0
+        p = parent
+        while p and not repeated:
+            repeated = detail.get(p, '').startswith('CORRELATED')
+            p = parent_of.get(p, 0)
+        if _PLAN_STEP.match(d):
+            loops[parent] = loops.get(parent, 0) + 1
+        yield d, repeated
+
+def _advise_statement(db, sql, min_rows, candidates, row_counts=None):
+    """
+    Return a list of (table, expression, where, reason) for statement sql.
+
+    The statement is explained against the tables of db as they are when
+    called.  row_counts is a dict {table: number of rows} of the tables
+    counted so far; tables not in it are counted and added.
+    """
+    tables = {t.lower(): t for t in db.get_tablenames()}
+    aliases = table_aliases(sql)
+    nsql = _normalize(sql)
+    if row_counts is None:
+        row_counts = {}
+    rv = []
+
+    def step_table(line):
+        """ Return (step, table, alias, rest) of a plan step on a large table, or None. """
+        m = _PLAN_STEP.match(line.strip())
+        if not m:
+            return None
+        step, name, alias, rest = m.groups()
+        table = tables.get(aliases.get((alias or name).lower(), name).lower())
+        if not table:
+            return None
+        if not table in row_counts:
+            row_counts[table] = db.queryone(f'SELECT count(*) FROM "{table}";') or 0
+        if row_counts[table] < min_rows:
+            return None
+        return step, table, (alias or name).lower(), rest
+
+    def compared_candidates(table, alias, reason):
+        columns = {c.lower() for c in db.get_column_names(table)}
+        other_columns = {c.lower() for t in set(aliases.values()) 
+                         if t.lower() != table.lower() and t.lower() in tables
+                         for c in db.get_column_names(tables[t.lower()])}
+        for ctable, expression, where in candidates:
+            if ctable.lower() == table.lower() and \
+               _is_compared(expression, nsql, alias, columns, other_columns):
+                rv.append((table, expression, where, reason))
+
+    for line, repeated in _plan_steps(db, sql):
+        st = step_table(line)
+        if st and 'AUTOMATIC' in st[3]:
+            step, table, alias, rest = st
+            cols = re.search(r'\((.*?)\)', rest)
+            if cols:
+                cols = [re.split(r'[=<>]', c)[0].strip() for c in cols.group(1).split(' AND ')]
+                rv.append((table, ', '.join(cols), None, 'automatic index'))
+            compared_candidates(table, alias, 'automatic index')
+    for line, repeated in _plan_steps(db, sql, automatic_index=False):
+        st = step_table(line)
+        if st and repeated and st[0] == 'SCAN' and not ' USING ' in st[3]:
+            step, table, alias, rest = st
+            compared_candidates(table, alias, 
+                                f'repeated scan of {row_counts[table]} rows')
+    return rv
+
+def _new_advice(db, advice, existing, index_columns):
+    """
+    Yield (name, table, expression, where, reason) of the items of advice
+    that are not indexed yet, and add their names to set existing.
+
+    existing is the set of index names in db; index_columns caches the
+    column lists of the indexes on each table.
+    """
+    for table, expression, where, reason in advice:
+        name = advised_index_name(table, expression, where)
+        if name in existing:
+            continue
+        cols = [c.strip().lower() for c in expression.split(',')]
+        if not table in index_columns:
+            index_columns[table] = _existing_index_columns(db, table)
+        if not where and any(ix[:len(cols)] == cols for ix in index_columns[table]):
+            continue
+        existing.add(name)
+        yield name, table, expression, where, reason
+
+def _index_names(db):
+    """ Return the set of index names in db. """
+    return {r[0] for r in db.con.execute(
+                "SELECT name FROM sqlite_master WHERE type='index';").fetchall()}
+
+def advise_indexes(db, sql_files, min_rows=ADVISOR_MIN_ROWS,
+                   candidates=MNU_INDEX_CANDIDATES):
+    """
+    Return the indexes advised for the statements of sql_files.
+
+    Arguments
+    ---------
+    db         : an open database instance
+    sql_files  : sql file name, or iterable of names
+    min_rows   : int. Tables with fewer rows are not indexed.
+    candidates : iterable of (table, expression, where) proposed for
+                 automatic indexes and repeated full scans.  See 
+                 MNU_INDEX_CANDIDATES.
+
+    Returns
+    -------
+    A list of dicts with keys: name, table, expression, where, sql, reason,
+    sql_file, stmt_index.  Each index is listed once, for the first
+    statement that needs it.  Indexes that exist are omitted.
+
+    Notes
+    -----
+    Statements are explained against the database as it is, without
+    running them, so a statement on a table created or filled by an earlier
+    statement is not advised as it will be when run.  Use 
+    provision_statement_indexes() to advise each statement as it is run.
+    """
+    if isinstance(sql_files, str):
+        sql_files = [sql_files]
+    existing = _index_names(db)
+    index_columns = {}
+    row_counts = {}
+    rv = []
+    for sql_file in sql_files:
+        for i, sql in enumerate(read_sql_file(sql_file)):
+            advice = _advise_statement(db, sql, min_rows, candidates, row_counts)
+            for name, table, expression, where, reason in _new_advice(
+                                      db, advice, existing, index_columns):
+                rv.append({'name': name, 'table': table, 'expression': expression,
+                           'where': where,
+                           'sql': advised_index_sql(table, expression, where),
+                           'reason': reason, 'sql_file': os.path.basename(sql_file),
+                           'stmt_index': i})
+    return rv
+
+def _written_table(sql):
+    """ Return the name of the table edited or created by statement sql, or None. """
+    m = _WRITTEN_TABLE.match(strip_sql_comments(sql))
+    return m.group(1).split('.')[-1].strip('"') if m else None
+
+def provision_statement_indexes(db, sql, min_rows=ADVISOR_MIN_ROWS,
+                                candidates=MNU_INDEX_CANDIDATES, row_counts=None):
+    """
+    Create the indexes advised for statement sql.  Return the names created.
+
+    The statement is advised against the current tables, so call it just 
+    before the statement is executed, as the before function of 
+    execute_statements_from_file().  Edits are not committed.
+
+    row_counts is a dict of the row counts of the tables, to be shared by 
+    the statements of a file, so that each table is counted once rather 
+    than once per statement.  The count of the table that sql edits is 
+    removed from it, so that the table is counted again when next needed; 
+    if that table is not known, all counts are removed.
+    """
+    if row_counts is None:
+        row_counts = {}
+    created = []
+    advice = _advise_statement(db, sql, min_rows, candidates, row_counts)
+    for name, table, expression, where, reason in _new_advice(
+                                      db, advice, _index_names(db), {}):
+        print (f"provision_statement_indexes: {name} ({reason})")
+        if db._execute(db.cur, advised_index_sql(table, expression, where)):
+            created.append(name)
+    written = _written_table(sql)
+    if written is None:
+        if not is_select_statement(sql):
+            row_counts.clear()
+    else:
+        for table in [t for t in row_counts if t.lower() == written.lower()]:
+            del row_counts[table]
+    return created
+
+def advised_index_names(db):
+    """ Return the names of the advised indexes in db. """
+    return [r[0] for r in db.con.execute(
+                "SELECT name FROM sqlite_master WHERE type='index';").fetchall()
+            if r[0].startswith(ADVISED_INDEX_PREFIX)]
+
+def drop_indexes(db, names=None):
+    """
+    Drop indexes names, or all advised indexes if names is None.
+
+    Edits are not committed.
+    """
+    if names is None:
+        names = advised_index_names(db)
+    for name in names:
+        db.query(f'DROP INDEX IF EXISTS "{name}";')
+    if names:
+        print (f"drop_indexes: dropped {len(names)} indexes")
+    return names
+
+def RUN_index_advice(db_name, sql_files, min_rows=ADVISOR_MIN_ROWS):
+    """
+    Print the indexes advised for sql_files on database db_name.
+
+    The database is not changed.
+    """
+    from OWI_sqlite import c4db
+    with c4db(db_name) as db:
+        advice = advise_indexes(db, sql_files, min_rows)
+        db.close_db()
+    for a in advice:
+        print (f"{a['sql_file']:34} {a['stmt_index']:3}  {a['reason']}\n"
+               f"    {a['sql']}")
+    print (f"{len(advice)} indexes advised")
+    return advice
+
+
+if __name__ == '__main__':
+    from OWI_config import OWI_version as C
+    if 0:
+        sql_files = []
+        for f in C.OWI_MNU_INSERT:
+            sql_files.extend(f if isinstance(f, (list, tuple)) else [f])
+        RUN_index_advice(C.OWI_DOWNLOAD_DB_NAME, sql_files)
+
+    print ('\n',r'\\\\\\\\\\\\\\\ DONE (OWI_index_advisor.py) ///////////////')
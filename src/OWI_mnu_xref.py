@@ -0,0 +1,295 @@
+'''
+Cross-references between wells in c4id, found with a union-find.
+
+A record in c4id cross-references another well when its IDENTIFIER is the
+wellid (as text) of that well.  Step C4ID_KNOWN_XREFS of the MNU model
+(sql/mnu_known_xrefs_o1.1.0.sql) labels the pairs of wells whose c4id
+records cross-reference each other, and adds them to o1id_match.  In sql that
+needs a self-join of c4id on cast(wellid as text) = IDENTIFIER that no index
+can serve.
+
+Class c4id_xrefs reads (rowid, wellid, IDENTIFIER, MNU, mmid) from c4id in
+one pass, and finds the same labels and o1id_match rows as the sql using
+hash lookups.  The cross-references are also joined in a union-find, so that
+groups of wells linked by chains of any length can be listed.
+
+    Usage:
+        X = c4id_xrefs(db)
+        X.known_xrefs()        # rowids of c4id to label C4ID_KNOWN_XREFS
+        X.match_rows()         # rows of o1id_match
+        X.components()         # groups of cross-referenced wellids
+        X.apply(db)            # label c4id and fill o1id_match, as the sql
+        check_known_xrefs(db)  # compare with the sql, on copies of the tables
+
+Methods
+-------
+    c4id_xrefs(db)
+    c4id_xrefs.known_xrefs()
+    c4id_xrefs.match_rows()
+    c4id_xrefs.components()
+    c4id_xrefs.component_of()
+    c4id_xrefs.apply()
+    apply_known_xrefs()
+    check_known_xrefs()
+'''
+from collections import Counter, defaultdict
+
+# Labels of step C4ID_KNOWN_XREFS
+KNOWN_XREFS_MEXPLAIN = 'C4ID_KNOWN_XREFS'
+KNOWN_XREFS_MPLAN = 'MERGE id2 INTO id1'
+KNOWN_XREFS_MMID = 11
+# c4id records with these MNU values take part in the cross-references.
+KNOWN_XREFS_MNU = (1, 11)
+
+class union_find():
+    """ Disjoint sets of hashable items, with path halving and union by size. """
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, x):
+        """ Return the representative item of the set of x, adding x if new. """
+        parent = self.parent
+        if not x in parent:
+            parent[x] = x
+            self.size[x] = 1
+            return x
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        """ Join the sets of x and y. Return the representative item. """
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return x
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size.pop(y)
+        return x
+
+    def sets(self):
+        """ Return {representative: [items]} of all sets. """
+        rv = defaultdict(list)
+        for x in self.parent:
+            rv[self.find(x)].append(x)
+        return rv
+
+class c4id_xrefs():
+    """
+    The cross-references between wells in table c4id of db.
+
+    Arguments
+    ---------
+    db  : an open c4db with table c4id.
+    mnu : MNU values of the c4id records that take part.
+
+    Notes
+    -----
+    Wellids are compared to identifiers as SQLite's cast(wellid as text),
+    exactly as in the sql.
+    """
+    def __init__(self, db, mnu=KNOWN_XREFS_MNU):
+        # Records of c4id: (rowid, wellid, wellid as text, IDENTIFIER, mmid)
+        self.records = [r for r in db.iter_query(
+                            f"""SELECT rowid, wellid, cast(wellid as text),
+                                       IDENTIFIER, mmid
+                                FROM c4id
+                                WHERE MNU in ({db.qmarks(mnu)})
+                                  AND wellid IS NOT NULL
+                                  AND IDENTIFIER IS NOT NULL
+                                ORDER BY rowid;""", tuple(mnu))]
+        # mmid of the other records, which may match in o1id_match as C.
+        self.other_mmid = [r for r in db.iter_query(
+                            f"""SELECT cast(wellid as text), IDENTIFIER
+                                FROM c4id
+                                WHERE MNU not in ({db.qmarks(mnu)})
+                                  AND mmid = ?
+                                  AND wellid IS NOT NULL
+                                  AND IDENTIFIER IS NOT NULL;""",
+                            tuple(mnu) + (KNOWN_XREFS_MMID,))]
+        self.by_identifier = defaultdict(list)
+        self.links = set()
+        for r in self.records:
+            self.by_identifier[r[3]].append(r)
+            self.links.add((r[2], r[3]))
+        self.uf = None
+
+    def known_xrefs(self):
+        """
+        Return the rowids of c4id records labelled C4ID_KNOWN_XREFS.
+
+        A record of well a with IDENTIFIER b is labelled if a record of well
+        b has IDENTIFIER a, and a != b.
+        """
+        return [r[0] for r in self.records
+                if r[3] != r[2] and (r[3], r[2]) in self.links]
+
+    def match_rows(self, labelled=None):
+        """
+        Return the rows of o1id_match for the known cross-references.
+
+        Each row is (wellid1, identifier1, wellid2, identifier2, mexplain,
+        mplan, mmid, mresolved), with wellid1 <= wellid2.  As in the sql
+        join, a pair is repeated once for each record labelled mmid=11 with
+        IDENTIFIER wellid2 and a different wellid.
+
+        labelled is the list of known_xrefs(), if already found.
+        """
+        if labelled is None:
+            labelled = self.known_xrefs()
+        labelled = set(labelled)
+        # Records with mmid=11 once the labels are set, by IDENTIFIER.
+        mmid11 = defaultdict(Counter)
+        for rowid, wellid, wtext, identifier, mmid in self.records:
+            if rowid in labelled or mmid == KNOWN_XREFS_MMID:
+                mmid11[identifier][wtext] += 1
+        for wtext, identifier in self.other_mmid:
+            mmid11[identifier][wtext] += 1
+        matched = {rowid for rowid, wellid, wtext, identifier, mmid in self.records
+                   if rowid in labelled or mmid == KNOWN_XREFS_MMID}
+
+        rows = []
+        for rowid, a, atext, x, mmid in self.records:
+            for brow, b, btext, y, bmmid in self.by_identifier.get(atext, ()):
+                if btext != x or a > b or not brow in matched:
+                    continue
+                C = mmid11.get(btext)
+                n = sum(C.values()) - C[btext] if C else 0
+                rows.extend([(a, x, b, y, KNOWN_XREFS_MEXPLAIN,
+                              KNOWN_XREFS_MPLAN, KNOWN_XREFS_MMID, 0)] * n)
+        return rows
+
+    def _union_find(self):
+        """ Join each pair of wells linked by a cross-reference. """
+        if self.uf is None:
+            self.uf = union_find()
+            wellid = {r[2]: r[1] for r in self.records}
+            for rowid, a, atext, x, mmid in self.records:
+                if x != atext and x in wellid:
+                    self.uf.union(a, wellid[x])
+        return self.uf
+
+    def components(self, min_size=2):
+        """
+        Return the groups of wellids joined by chains of cross-references.
+
+        A well is joined to another if any of its c4id records has the other
+        wellid as IDENTIFIER, in either direction.  The groups, as sorted
+        lists of wellids, are returned largest first, then by first wellid.
+        Groups smaller than min_size are omitted.
+        """
+        groups = [sorted(g) for g in self._union_find().sets().values()
+                  if len(g) >= min_size]
+        return sorted(groups, key=lambda g: (-len(g), g[0]))
+
+    def component_of(self, wellid):
+        """ Return the sorted list of wellids cross-referenced with wellid. """
+        uf = self._union_find()
+        if not wellid in uf.parent:
+            return [wellid]
+        root = uf.find(wellid)
+        return sorted(w for w in uf.parent if uf.find(w) == root)
+
+    def apply(self, db):
+        """
+        Label the known cross-references in c4id, and add them to o1id_match.
+
+        Makes the same edits as sql/mnu_known_xrefs_o1.1.0.sql. Edits are not
+        committed.  Returns (number of records labelled, number of rows added
+        to o1id_match).
+        """
+        labelled = self.known_xrefs()
+        rows = self.match_rows(labelled)
+        db.cur.executemany(
+            """UPDATE c4id SET mexplain=?, mmid=?, MNU=? WHERE rowid = ?;""",
+            [(KNOWN_XREFS_MEXPLAIN, KNOWN_XREFS_MMID, KNOWN_XREFS_MMID, rowid)
+             for rowid in labelled])
+        db.cur.executemany(
+            """INSERT INTO o1id_match (wellid1, identifier1, wellid2, identifier2,
+                                       mexplain, mplan, mmid, mresolved)
+               VALUES (?,?,?,?,?,?,?,?);""", rows)
+        print (f"{KNOWN_XREFS_MEXPLAIN}: {len(labelled)} c4id records labelled, "
+               f"{len(rows)} o1id_match rows added")
+        return len(labelled), len(rows)
+
+def apply_known_xrefs(db):
+    """ Run step C4ID_KNOWN_XREFS of the MNU model on db. See c4id_xrefs.apply(). """
+    return c4id_xrefs(db).apply(db)
+
+# Columns of o1id_match written by step C4ID_KNOWN_XREFS.
+KNOWN_XREFS_MATCH_COLS = ('wellid1', 'identifier1', 'wellid2', 'identifier2',
+                          'mexplain', 'mplan', 'mmid', 'mresolved')
+
+def check_known_xrefs(db, sql_file=None):
+    """
+    Check that c4id_xrefs makes the same edits as the sql of the step.
+
+    Tables c4id and o1id_match of db are copied twice into memory. The sql
+    file is run on one copy and apply_known_xrefs() on the other, and the 
+    resulting c4id labels and o1id_match rows are compared. db is not edited.
+
+    Arguments
+    ---------
+    db       : an open c4db, in the state before step C4ID_KNOWN_XREFS.
+    sql_file : the sql file of the step, default OWI_MNU_KNOWN_XREFS.
+
+    Returns
+    -------
+    True if both engines give the same result.  The differences are printed.
+    """
+    from OWI_config import OWI_version as C
+    from OWI_sqlite import c4db
+    from OWI_sqlfile import execute_statements_from_file
+    sql_file = sql_file or C.OWI_MNU_KNOWN_XREFS
+    tables = ('c4id', 'o1id_match')
+    ddl = dict(db.query("""SELECT name, sql FROM sqlite_master 
+                           WHERE type = 'table' AND name IN (?,?);""", tables))
+    if len(ddl) < len(tables):
+        print (f"check_known_xrefs: ERROR - {db.db_name} lacks {', '.join(tables)}")
+        return False
+    rv = {}
+    for engine in ('sql', 'python'):
+        mem = c4db(':memory:', open_db=True)
+        mem.query("ATTACH DATABASE ? AS src;", (db.db_name,))
+        for t in tables:
+            mem.query(ddl[t])
+            mem.query(f"INSERT INTO main.{t} SELECT * FROM src.{t} ORDER BY rowid;")
+        if engine == 'sql':
+            execute_statements_from_file(mem, sql_file, commit=False)
+        else:
+            apply_known_xrefs(mem)
+        rv[engine] = (mem.query("SELECT rowid, mexplain, mmid, MNU FROM c4id ORDER BY rowid;"),
+                      Counter(mem.query(f"SELECT {', '.join(KNOWN_XREFS_MATCH_COLS)} "
+                                        f"FROM o1id_match;")))
+        mem.close_db()
+    (sql_c4id, sql_match), (py_c4id, py_match) = rv['sql'], rv['python']
+    ndiff = sum(a != b for a, b in zip(sql_c4id, py_c4id))
+    nmatch = sum(((sql_match - py_match) + (py_match - sql_match)).values())
+    if ndiff or nmatch or len(sql_c4id) != len(py_c4id):
+        print (f"check_known_xrefs: DIFFERENT - {ndiff} c4id records, "
+               f"{nmatch} o1id_match rows differ")
+        return False
+    print (f"check_known_xrefs: same - {len(sql_c4id)} c4id records, "
+           f"{sum(sql_match.values())} o1id_match rows")
+    return True
+
+
+if __name__ == '__main__':
+    from OWI_config import OWI_version as C
+    from OWI_sqlite import c4db
+    if 0:
+        # Run before step C4ID_KNOWN_XREFS, e.g. resume_MNU_at=5 interrupted.
+        with c4db(C.OWI_DOWNLOAD_DB_NAME) as db:
+            check_known_xrefs(db)
+            db.close_db()
+    if 0:
+        with c4db(C.OWI_DOWNLOAD_DB_NAME) as db:
+            X = c4id_xrefs(db)
+            for g in X.components()[:20]:
+                print (len(g), g)
+            db.close_db()
+
+    print ('\n',r'\\\\\\\\\\\\\\\ DONE (OWI_mnu_xref.py) ///////////////')
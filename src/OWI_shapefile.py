@@ -0,0 +1,320 @@
+'''
+Read shapefiles into table rows in one sequential pass.
+
+A shapefile is read as two streams: the shape records of the .shp file and
+the attribute records of the .dbf file.  Both are read front to back, so
+memory does not grow with the number of records, and no record is read
+twice.  Only the first point of each shape is decoded, which is all that is
+needed for the well and sealing layers.
+
+The .dbf file is memory mapped and read in batches of DBF_BATCH_ROWS
+records.  The fixed width fields of a batch are unpacked straight from the
+mapped buffer by offset, and decoded a column at a time, so that a batch of
+rows can be passed to executemany without building an object per record.
+
+Values are decoded as pyshp decodes them: N and F fields as int or float,
+D fields as datetime.date, L fields as bool, and C fields as text without
+trailing blanks.  Empty numeric, date, and logical values are None.
+
+Text is decoded with the code page named in the .cpg file of the
+shapefile, or as utf-8 if there is no .cpg file.
+
+A shape that cannot be read gives coordinates (None, None).  A field value
+that cannot be decoded is None, and the other values of its record are
+kept.  A record that is marked deleted gives None for each attribute.
+
+    Usage:
+        fields = shapefile_fields(shpname)      # [(name, type, size, decimal)]
+        encoding = shapefile_encoding(shpname)  # from the .cpg file
+        for irec, x, y, *attrs in shapefile_rows(shpname):
+            ...
+        for attrs in shapefile_rows(dbfname, coordinates=False):
+            ...
+        for rows in iter_dbf_batches(dbfname):
+            db.cur.executemany(insert, rows)
+
+Methods
+-------
+    shapefile_encoding()
+    shapefile_fields()
+    shapefile_rows()
+    iter_shp_points()
+    iter_dbf_columns()
+    iter_dbf_batches()
+    iter_dbf_records()
+    decode_dbf_value()
+'''
+import codecs
+import datetime
+import mmap
+import os
+from struct import Struct
+
+# .shp file header and record header
+SHP_HEADER_SIZE = 100
+_SHP_RECORD_HEADER = Struct('>2i')
+_SHAPE_TYPE = Struct('<i')
+_POINT = Struct('<2d')
+_COUNT = Struct('<i')
+
+# Offset of the first point in the shape record content, by shape type.
+# Null shapes (0) have no points.  Multipoints: type, bbox, numPoints.
+_POINT_SHAPES = (1, 11, 21)
+_MULTIPOINT_SHAPES = (8, 18, 28)
+_PARTS_SHAPES = (3, 5, 13, 15, 23, 25, 31)
+
+# .dbf file header and field descriptor
+_DBF_HEADER = Struct('<4xLHH20x')
+_DBF_FIELD = Struct('<11sc4xBB14x')
+
+# Records of a .dbf file decoded at a time.
+DBF_BATCH_ROWS = 10000
+
+# Code page names found in .cpg files that are not python codec names.
+_CPG_CODECS = {'ansi 1252': 'cp1252', '1252': 'cp1252', '88591': 'latin-1',
+               '437': 'cp437', '850': 'cp850', '65001': 'utf-8'}
+
+def _file_names(shpname):
+    """ Return (shp, dbf) file names of the shapefile named by any of its files. """
+    base = os.path.splitext(shpname)[0]
+    return base + '.shp', base + '.dbf'
+
+def shapefile_encoding(shpname, default='utf-8'):
+    """
+    Return the encoding of the text fields of a shapefile.
+
+    The encoding is read from the .cpg file of the shapefile named by any of
+    its files.  default is returned if there is no .cpg file, or if its code
+    page is not known to python.
+    """
+    cpg = os.path.splitext(shpname)[0] + '.cpg'
+    if not os.path.exists(cpg):
+        return default
+    with open(cpg, 'r', encoding='ascii', errors='replace') as f:
+        name = f.read().strip()
+    name = _CPG_CODECS.get(name.lower(), name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        print (f"shapefile_encoding: code page '{name}' of {cpg} is unknown, using {default}")
+        return default
+
+def _read_dbf_header(f, encoding='utf-8'):
+    """
+    Read the header of open .dbf file f.
+
+    Returns (number of records, header length, record length, fields), where
+    fields is a list of (name, type, size, decimal), without the deletion
+    flag.
+    """
+    f.seek(0)
+    nrecords, header_length, record_length = _DBF_HEADER.unpack(f.read(32))
+    fields = []
+    for i in range((header_length - 33) // 32):
+        name, typ, size, decimal = _DBF_FIELD.unpack(f.read(32))
+        name = name.split(b'\x00')[0].decode(encoding)
+        fields.append((name, typ.decode('ascii'), size, decimal))
+    return nrecords, header_length, record_length, fields
+
+def shapefile_fields(shpname, encoding=None):
+    """ 
+    Return the attribute fields of a shapefile as a list of (name, type, size, decimal). 
+    
+    encoding defaults to shapefile_encoding(shpname).
+    """
+    shp, dbf = _file_names(shpname)
+    encoding = encoding or shapefile_encoding(shpname)
+    with open(dbf, 'rb') as f:
+        return _read_dbf_header(f, encoding)[3]
+
+def decode_dbf_value(typ, decimal, value, encoding='utf-8'):
+    """
+    Return the value of dbf field bytes value of field type typ.
+
+    Decodes as pyshp does.  Raises an exception on text that does not decode.
+    """
+    if typ in 'NF':
+        value = value.partition(b'\x00')[0].strip().strip(b'*')
+        if not value:
+            return None
+        try:
+            if decimal:
+                return float(value)
+            try:
+                return int(value)
+            except ValueError:
+                return int(float(value))
+        except ValueError:
+            return None
+    elif typ == 'D':
+        if not value.replace(b'\x00', b'').replace(b' ', b'').replace(b'0', b''):
+            return None
+        value = value.decode('ascii')
+        try:
+            return datetime.datetime.strptime(value, '%Y%m%d').date()
+        except ValueError:
+            return value
+    elif typ == 'L':
+        if value in (b' ', b'?'):
+            return None
+        if value in b'YyTt1':
+            return True
+        if value in b'NnFf0':
+            return False
+        return None
+    return value.rstrip(b' \x00').decode(encoding)
+
+def _dbf_record_struct(fields, record_length):
+    """ Return a Struct unpacking a dbf record as (deletion flag, <field bytes ...>). """
+    fmt = '<c' + ''.join(f'{size}s' for name, typ, size, decimal in fields)
+    return Struct(fmt + 'x' * (record_length - Struct(fmt).size))
+
+def _decode_dbf_column(typ, decimal, raw, encoding='utf-8'):
+    """
+    Return the values of one field in a batch of records, given its raw bytes.
+
+    The whole column is decoded at once when it can be.  Otherwise the values
+    are decoded one by one, and a value that cannot be decoded is None.
+    """
+    try:
+        if typ == 'C':
+            return [v.rstrip(b' \x00').decode(encoding) for v in raw]
+        if typ in 'NF':
+            return list(map(float if decimal else int, raw))
+    except (ValueError, UnicodeDecodeError):
+        pass
+    rv = []
+    for i, v in enumerate(raw):
+        try:
+            rv.append(decode_dbf_value(typ, decimal, v, encoding))
+        except Exception:
+            rv.append(None)
+    return rv
+
+def iter_dbf_columns(dbfname, batch_size=DBF_BATCH_ROWS, encoding=None):
+    """
+    Yield the records of a .dbf file in batches, as (columns, bad).
+
+    The file is memory mapped, and each batch of up to batch_size records is
+    unpacked from the mapped buffer by field offset, then decoded a column at
+    a time.  columns is a list with one list of values per field; a value
+    that cannot be decoded is None.  bad is the set of indexes in the batch
+    of the records that are marked deleted, whose values are all None.
+    encoding defaults to shapefile_encoding(dbfname).
+    """
+    encoding = encoding or shapefile_encoding(dbfname)
+    with open(dbfname, 'rb') as f:
+        nrecords, header_length, record_length, fields = _read_dbf_header(f, encoding)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            navailable = (len(mm) - header_length) // record_length
+            if navailable < nrecords:
+                print (f"iter_dbf_columns: {dbfname} ends at record {navailable} of {nrecords}")
+                nrecords = navailable
+            unpack = _dbf_record_struct(fields, record_length).iter_unpack
+            for start in range(0, nrecords, batch_size):
+                n = min(batch_size, nrecords - start)
+                offset = header_length + start * record_length
+                raw = list(zip(*unpack(mm[offset : offset + n * record_length])))
+                bad = {i for i, flag in enumerate(raw[0]) if flag != b' '}
+                columns = [_decode_dbf_column(typ, decimal, values, encoding)
+                           for (name, typ, size, decimal), values in zip(fields, raw[1:])]
+                for column in columns:
+                    for i in bad:
+                        column[i] = None
+                yield columns, bad
+
+def iter_dbf_records(dbfname, encoding=None):
+    """
+    Yield the attribute values of each record of a .dbf file as a list.
+
+    None is yielded for a record that is marked deleted.  See 
+    iter_dbf_columns().
+    """
+    for columns, bad in iter_dbf_columns(dbfname, encoding=encoding):
+        for i, rec in enumerate(zip(*columns)):
+            yield None if i in bad else list(rec)
+
+def iter_dbf_batches(dbfname, batch_size=DBF_BATCH_ROWS, encoding=None):
+    """
+    Yield the records of a .dbf file in batches, as lists of tuples.
+
+    The rows of a batch can be passed directly to executemany. Records that
+    are marked deleted are given as None, in place of a tuple.  See 
+    iter_dbf_columns().
+    """
+    for columns, bad in iter_dbf_columns(dbfname, batch_size, encoding):
+        rows = list(zip(*columns))
+        for i in bad:
+            rows[i] = None
+        yield rows
+
+def _first_point(content):
+    """ Return (x, y) of the first point of shape record content, or (None, None). """
+    try:
+        shape_type = _SHAPE_TYPE.unpack_from(content)[0]
+        if shape_type in _POINT_SHAPES:
+            return _POINT.unpack_from(content, 4)
+        if shape_type in _MULTIPOINT_SHAPES:
+            if _COUNT.unpack_from(content, 36)[0] > 0:
+                return _POINT.unpack_from(content, 40)
+        elif shape_type in _PARTS_SHAPES:
+            nparts, npoints = _COUNT.unpack_from(content, 36)[0], _COUNT.unpack_from(content, 40)[0]
+            if npoints > 0:
+                return _POINT.unpack_from(content, 44 + 4 * nparts)
+    except Exception:
+        pass
+    return None, None
+
+def iter_shp_points(shpname):
+    """
+    Yield (x, y) of the first point of each shape of a .shp file.
+
+    (None, None) is yielded for null shapes, shapes without points, and
+    shapes that cannot be read.  The records are read in order, one at a
+    time.
+    """
+    with open(shpname, 'rb') as f:
+        f.seek(SHP_HEADER_SIZE)
+        while True:
+            header = f.read(_SHP_RECORD_HEADER.size)
+            if len(header) < _SHP_RECORD_HEADER.size:
+                return
+            recnum, length = _SHP_RECORD_HEADER.unpack(header)
+            content = f.read(2 * length)
+            if len(content) < 2 * length:
+                print (f"iter_shp_points: {shpname} is truncated at record {recnum}")
+                yield None, None
+                return
+            yield _first_point(content)
+
+def shapefile_rows(shpname, coordinates=True, encoding=None):
+    """
+    Yield a tuple for each record of a shapefile, in one sequential pass.
+
+    Arguments
+    ---------
+    shpname     : name of the .shp or .dbf file of the shapefile.
+    coordinates : If True, rows are (irec, x, y, <attributes ...>), with x,y
+                  the first point of the shape, and there is one row per
+                  shape.  If False, rows are (<attributes ...>), and the .shp
+                  file is not read.
+    encoding    : encoding of the text fields of the .dbf file.  By default
+                  it is read from the .cpg file, see shapefile_encoding().
+
+    A row with attribute values None is yielded for a record that is marked
+    deleted, an attribute value None for a field that cannot be decoded, and
+    coordinates None for a shape that cannot be read.
+    """
+    shp, dbf = _file_names(shpname)
+    encoding = encoding or shapefile_encoding(shpname)
+    nullrecord = [None] * len(shapefile_fields(dbf, encoding))
+    if not coordinates:
+        nullrecord = tuple(nullrecord)
+        for rows in iter_dbf_batches(dbf, encoding=encoding):
+            for rec in rows:
+                yield nullrecord if rec is None else rec
+        return
+    records = iter_dbf_records(dbf, encoding)
+    for i, (x, y) in enumerate(iter_shp_points(shp)):
+        rec = next(records, None)
+        yield tuple([i+1, x, y] + (nullrecord if rec is None else rec))
@@ -2,42 +2,373 @@
 Created on Dec 16, 2021
 
 @author: bill
+
+Read and execute sql statement files.
+
+Parsing
+-------
+A file is split into statements where sqlite3.complete_statement() finds a
+complete statement, so a ';' in a string literal, a comment, or a trigger
+body does not end a statement.  Each file is parsed once; the statements are
+cached until the file's modification time or size changes.
+
+Execution
+---------
+All statements of a file run in one transaction, which is committed at the
+end of the file.  Query-only statements (the exploratory SELECTs of the MNU
+files) are skipped by default, or optionally streamed without keeping rows.
+
+Profiling
+---------
+execute_statements_from_file(db, sql_file, profile=True) records for each
+statement its elapsed time, the number of rows changed, and its
+EXPLAIN QUERY PLAN, keyed by file and statement index.  The records are
+appended to table owi_sql_profile in the database, with a run label, so that
+the history of builds can be compared.  sql_profile_report() prints the
+statements ranked by time, and flags plans with full table scans, automatic
+(missing) indexes, and temporary b-trees.
+
+Methods
+-------
+    read_sql_file()
+    split_sql_statements()
+    is_select_statement()
+    execute_statements_from_file()
+    create_sql_profile_table()
+    profile_function()
+    sql_profile_report()
 '''
+import datetime
 import os
+import re
+import sqlite3
+import time
+
+SQL_PROFILE_TABLE = 'owi_sql_profile'
+
+# Parsed sql files: {absolute path: ((mtime_ns, size), statements, is_select)}
+_sql_file_cache = {}
+
+# String literals and quoted names (group 1), or comments (group 2).
+_SQL_LITERAL_OR_COMMENT = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])"""
+    r"""|(--[^\n]*|/\*.*?(?:\*/|$))""", re.S)
+
+_SQL_EDIT_KEYWORDS = re.compile(r'\b(INSERT|UPDATE|DELETE|REPLACE)\b', re.I)
+
+def strip_sql_comments(sql):
+    """ Return sql with its comments replaced by spaces. Literals are kept. """
+    return _SQL_LITERAL_OR_COMMENT.sub(
+               lambda m: m.group(1) if m.group(1) else ' ', sql)
+
+def split_sql_statements(text):
+    """
+    Split the text of an sql script into a list of complete statements.
+
+    A ';' ends a statement only if sqlite3.complete_statement() agrees, so
+    semicolons in string literals, comments, and trigger bodies do not split
+    statements.  Comments are kept with the statement that follows them.
+    Pieces that hold only comments are dropped, and an incomplete statement
+    at the end of the text is dropped with a warning.
+    """
+    statements = []
+    buf = ''
+    for piece in text.split(';'):
+        buf += piece + ';'
+        if sqlite3.complete_statement(buf):
+            if strip_sql_comments(buf).strip(' \t\r\n;'):
+                statements.append(buf.strip())
+            buf = ''
+    rest = strip_sql_comments(buf[:-1]).strip()
+    if rest:
+        print (f"split_sql_statements: incomplete statement ignored: {rest[:60]}...")
+    return statements
+
+def is_select_statement(sql):
+    """
+    Return True if sql is a query that does not edit the database.
+
+    That is a SELECT, or a WITH clause that is not followed by an INSERT,
+    UPDATE, DELETE, or REPLACE.
+    """
+    words = strip_sql_comments(sql).split(None, 1)
+    if not words:
+        return False
+    first = words[0].upper()
+    if first == 'SELECT':
+        return True
+    if first == 'WITH':
+        return not _SQL_EDIT_KEYWORDS.search(strip_sql_comments(sql))
+    return False
+
+def _parse_sql_file(sql_file):
+    """
+    Return (statements, is_select) of sql_file, parsed once per version.
+
+    The parsed statements are cached, and the file is parsed again only if
+    its modification time or size changes.
+    """
+    assert os.path.exists(sql_file), os.path.abspath(sql_file)
+    fullname = os.path.abspath(sql_file)
+    st = os.stat(fullname)
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _sql_file_cache.get(fullname)
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+
+    with open(fullname) as f:
+        statements = tuple(split_sql_statements(f.read()))
+    is_select = tuple(is_select_statement(s) for s in statements)
+    _sql_file_cache[fullname] = (version, statements, is_select)
+    return statements, is_select
 
 def read_sql_file(sql_file): 
     """
     Read sql statments from an sql file.
     Returns a list of the statements in the order read.
     The statements are not checked for validity.
-    """
-    assert os.path.exists(sql_file), os.path.abspath(sql_file)
 
-    with open(sql_file) as f:
-        ftxt = f.read()    
-    
-    # The file is allowed to have 1 comment block before the sql statements.
-    # So try splitting on the close comment symbol.
-    try:  
-        ftxt = ftxt.split('*/')[1] 
-    except:
-        pass
-    #Split the text on the ';' symbol into distinct sql statements.
-    statements = [t.strip() + ';' for t in ftxt.split(';')[:-1]]
-    
+    See split_sql_statements(). The file is parsed only once unless it is
+    modified.
+    """
+    statements, is_select = _parse_sql_file(sql_file)
     assert len(statements) >= 1
-    return statements
-     
-       
-def execute_statements_from_file(db, sql_file):
+    return list(statements)
+
+def create_sql_profile_table(db):
+    """
+    Create the history table of statement profiles.
+
+    One row per (run, sql_file, stmt_index) records the elapsed seconds, the
+    rows changed, the number of rows returned, the query plan, and flags for
+    full table scans, automatic indexes, and temporary b-trees in the plan.
+    """
+    db.query(f"""CREATE TABLE IF NOT EXISTS {SQL_PROFILE_TABLE} (
+                    run         TEXT    NOT NULL,
+                    sql_file    TEXT    NOT NULL,
+                    stmt_index  INTEGER NOT NULL,
+                    seconds     REAL,
+                    changes     INTEGER,
+                    nrows       INTEGER,
+                    full_scan   INTEGER,
+                    auto_index  INTEGER,
+                    temp_btree  INTEGER,
+                    plan        TEXT,
+                    statement   TEXT,
+                    PRIMARY KEY (run, sql_file, stmt_index)
+                 ) WITHOUT ROWID;""")
+
+def explain_query_plan(db, statement):
+    """
+    Return the EXPLAIN QUERY PLAN of statement as indented text lines.
+
+    Returns None if the statement cannot be explained, e.g. if it refers to
+    a table that does not exist yet.
+    """
+    try:
+        rows = db.con.execute(f'EXPLAIN QUERY PLAN {statement}').fetchall()
+    except Exception:
+        return None
+    depth = {0: 0}
+    lines = []
+    for node, parent, notused, detail in rows:
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append('  ' * (depth[node] - 1) + detail)
+    return '\n'.join(lines)
+
+def plan_flags(plan):
+    """
+    Return (full_scan, auto_index, temp_btree) flags of a query plan.
+
+    full_scan is set by a 'SCAN table' step that does not use an index,
+    which is a full table scan. 'SCAN' steps of subqueries and CTEs, and
+    'USING COVERING INDEX' scans are not flagged.
+    """
+    full_scan = auto_index = temp_btree = 0
+    for line in (plan or '').splitlines():
+        line = line.strip()
+        if line.startswith('SCAN ') and not ' USING ' in line and \
+           not line.startswith(('SCAN CONSTANT', 'SCAN SUBQUERY')):
+            full_scan = 1
+        if 'AUTOMATIC' in line:
+            auto_index = 1
+        if 'USE TEMP B-TREE' in line:
+            temp_btree = 1
+    return full_scan, auto_index, temp_btree
+
+def _execute_statement(db, sql, is_select, selects):
+    """ Execute one statement of a file and return the number of rows returned. """
+    if is_select and selects == 'stream':
+        cur = db.con.cursor()
+        try:
+            if not db._execute(cur, sql):
+                return 0
+            return sum(1 for row in cur)
+        finally:
+            cur.close()
+    if not db._execute(db.cur, sql):
+        return 0
+    return len(db.cur.fetchall())
+
+def execute_statements_from_file(db, sql_file, profile=False, run=None,
+                                 selects='skip', commit=True, before=None):
     """
     Read and execute a series of statements from an sql statement file
-    
+
     This method does not handle statements that fail; an error occurs.
+
+    Arguments
+    ---------
+    db       : an open database instance
+    sql_file : name of the sql file
+    profile  : boolean, default False. If True, each statement is profiled
+               and the profiles are appended to table owi_sql_profile.
+    run      : str label of the profile records, by default the start time.
+               Use the same run for all files of one build.
+    selects  : What to do with statements that only query (see 
+               is_select_statement()), such as exploratory SELECTs:
+               'skip'   : default. They are not executed.
+               'stream' : They are executed and their rows counted, without
+                          keeping the rows.
+               'fetch'  : They are executed and their rows fetched.
+    commit   : boolean, default True. If True, and no transaction was open 
+               when called, the transaction is committed at the end of the 
+               file (if the context permits).  Use commit=False to commit the
+               file's edits together with later edits.
+    before   : function(db, statement), or None. If given, it is called 
+               before each statement that is executed, in the transaction,
+               for example to create the indexes the statement needs.
+
+    Returns
+    -------
+    If profile, a list of profile dicts, one per statement executed, with 
+    keys: run, sql_file, stmt_index, seconds, changes, nrows, full_scan,
+    auto_index, temp_btree, plan, statement.
+    
+    Notes
+    -----
+    -   All statements of the file are executed in one transaction.  If a
+        transaction is already open, the file joins it.
+    -   Statements that cannot run in a transaction, such as VACUUM, should
+        not be put in the files.
     """
     print (f"execute_statements_from_file: {sql_file}")
     print (f"   into {db.db_name}")
-    statements = read_sql_file(sql_file)
-    for s in statements:
-        db.query(s)
+    statements, is_select = _parse_sql_file(sql_file)
+
+    began = not db.con.in_transaction
+    if began:
+        db.cur.execute('BEGIN;')
+    run = run or datetime.datetime.now().isoformat(timespec='seconds')
+    fname = os.path.basename(sql_file)
+    profiles = []
+    skipped = 0
+    for i, (s, select) in enumerate(zip(statements, is_select)):
+        if select and selects == 'skip':
+            skipped += 1
+            continue
+        if before:
+            before(db, s)
+        if not profile:
+            _execute_statement(db, s, select, selects)
+            continue
+        plan = explain_query_plan(db, s)
+        n0 = db.con.total_changes
+        t0 = time.perf_counter()
+        nrows = _execute_statement(db, s, select, selects)
+        seconds = time.perf_counter() - t0
+        profiles.append(dict(zip(
+            ('run', 'sql_file', 'stmt_index', 'seconds', 'changes', 'nrows'),
+            (run, fname, i, seconds, db.con.total_changes - n0, nrows))))
+        profiles[-1].update(zip(('full_scan', 'auto_index', 'temp_btree'),
+                                plan_flags(plan)))
+        profiles[-1].update(plan=plan, statement=s)
+    if skipped:
+        print (f"   skipped {skipped} query-only statements")
+
+    if profiles:
+        _insert_profiles(db, profiles)
+        print (f"   profiled {len(profiles)} statements in "
+               f"{sum(p['seconds'] for p in profiles):.3f} seconds")
+    if commit and began:
+        db.commit_db(msg=fname)
+    if profile:
+        return profiles
+
+def _insert_profiles(db, profiles):
+    """ Append profile dicts to table owi_sql_profile. """
+    create_sql_profile_table(db)
+    cols = tuple(profiles[0].keys())
+    db.cur.executemany(
+        f"INSERT OR REPLACE INTO {SQL_PROFILE_TABLE} ({', '.join(cols)}) "
+        f"VALUES ({db.qmarks(cols)});",
+        [tuple(p.values()) for p in profiles])
+
+def profile_function(db, sql_file, func, run=None):
+    """
+    Run func(db) in place of sql_file, and profile it as one statement.
 
+    For a step of a build that is run in python rather than by its sql file,
+    so that it is listed by sql_profile_report() with the file's statements.
+    func's edits are not committed.
+
+    Returns a list of one profile dict, as execute_statements_from_file().
+    Its statement is the name of func, and it has no plan.
+    """
+    run = run or datetime.datetime.now().isoformat(timespec='seconds')
+    n0 = db.con.total_changes
+    t0 = time.perf_counter()
+    func(db)
+    seconds = time.perf_counter() - t0
+    profiles = [dict(run=run, sql_file=os.path.basename(sql_file), stmt_index=0,
+                     seconds=seconds, changes=db.con.total_changes - n0, nrows=0,
+                     full_scan=0, auto_index=0, temp_btree=0, plan=None,
+                     statement=f'{func.__module__}.{func.__name__}(db)')]
+    _insert_profiles(db, profiles)
+    print (f"   profiled {func.__name__} in {seconds:.3f} seconds")
+    return profiles
+
+def sql_profile_report(db, run=None, n=20, show_plans=True):
+    """
+    Print the n slowest statements of a profile run, with flagged plans.
+
+    Arguments
+    ---------
+    db         : an open database instance with table owi_sql_profile
+    run        : str run label, or None for the latest run.
+    n          : int, number of statements listed.
+    show_plans : boolean. If True, the query plan of each listed statement
+                 that has a flag is printed.
+
+    Returns
+    -------
+    List of the rows listed, from table owi_sql_profile.
+    """
+    if not SQL_PROFILE_TABLE in db.get_tablenames():
+        print (f'sql_profile_report: no table {SQL_PROFILE_TABLE}')
+        return []
+    if run is None:
+        run = db.queryone(f"SELECT max(run) FROM {SQL_PROFILE_TABLE};")
+    total = db.queryone(f"SELECT sum(seconds) FROM {SQL_PROFILE_TABLE} WHERE run = ?;",
+                        (run,)) or 0
+    rows = db.query(f"""SELECT sql_file, stmt_index, seconds, changes, nrows,
+                               full_scan, auto_index, temp_btree, plan, statement
+                        FROM {SQL_PROFILE_TABLE} WHERE run = ?
+                        ORDER BY seconds DESC LIMIT ?;""", (run, n))
+    print (f"\nSQL profile, run {run}: total {total:.3f} seconds")
+    print (f"{'rank':>4} {'seconds':>9} {'%':>5} {'changes':>8} {'rows':>7} "
+           f"flags {'file':34} stmt")
+    for rank, r in enumerate(rows, 1):
+        (sql_file, i, seconds, changes, nrows,
+         full_scan, auto_index, temp_btree, plan, statement) = r
+        flags = ('S' if full_scan else '.') + ('A' if auto_index else '.') + \
+                ('T' if temp_btree else '.')
+        pct = 100 * seconds / total if total else 0
+        print (f"{rank:4} {seconds:9.4f} {pct:5.1f} {changes:8} {nrows:7} "
+               f"{flags:5} {sql_file[:34]:34} {i}")
+        if show_plans and (full_scan or auto_index or temp_btree):
+            print ('        ' + ' '.join(statement.split())[:100])
+            for line in (plan or '').splitlines():
+                print (f'          {line}')
+    print ("flags: S=full table scan, A=automatic index, T=temp b-tree")
+    return rows
@@ -14,6 +14,7 @@ Class c4db implements only variables and methods that are agnostic as to
 the database schema and database engine.  
 
 Class c4db inherits from class DB_SQLite.
+Class c4db_pool inherits from c4db, and shares one database among threads.
 DB_SQLite holds SQLite dependent methods, and inherits the context manager 
 mixin class DB_context_manager.
 
@@ -26,10 +27,13 @@ Class DB_context_manager is a mixin class:
         with c4db(db_name) as db:  
         with c4db(db_name, commit=True):
         with c4db(db_name, open_db=False):
+        with c4db(db_name, trusted_schema=True):
     
     Defaults argument values: 
         open_db=True.  Explicitly call db.open_db() to open the connection
         commit=False.  Prohibit commits
+        trusted_schema=None.  Use DB_SQLite.trusted_schema ('OFF'); see the
+                              risk noted there before setting True.
         
 
 Methods
@@ -39,21 +43,53 @@ Methods
     showprogress()
     qmarks() or c4db.qmarks()
     c4db.query()
+    c4db.iter_query()
     c4db.queryone()
     c4db.get_tablenames()
+    c4db.clear_schema_cache()
     c4db.get_viewnames()
     c4db.get_column_names()
     c4db.get_column_type_dict()
+    c4db.get_table_info()
+    c4db.get_index_sql()
+    c4db.foreign_key_check()
+    with c4db.bulk_load():   [context manager syntax]
+    c4db.sql_function_cache_info()
+    c4db.statement_cache_info()
+    c4db.create_locs_rtree()
+    c4db.wells_in_bbox()
+    c4db.wells_within()
+    c4db.nearest_wells()
+    c4db.create_text_indexes()
+    c4db.search_text()
+    c4db.fetch_wells()
+    c4db.create_materialized_views()
+    c4db.refresh_materialized_views()
+    c4db.drop_materialized_view_triggers()
+    with c4db_pool.writing():   [context manager syntax]
+    c4db_pool.release_reader()
 
 '''
 import csv
+import math
 import os
+import pathlib
 import re
 import sqlite3 as sqlite
+import threading
 from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 
 # from OWI_config import OWI_DATA_TABLE_PREFIX
 
+# Statements that may change the schema, and so clear the schema-metadata 
+# cache when executed by DB_SQLite._execute().  ROLLBACK may undo a change.
+_SCHEMA_CHANGE = re.compile(r'(?:\s|--[^\n]*\n|/\*.*?\*/)*'
+                            r'(?:CREATE|DROP|ALTER|ATTACH|DETACH|ROLLBACK)\b', 
+                            re.IGNORECASE | re.DOTALL)
+
 def showprogress(n, b=10):
     """
     Provide a semi-graphical progress indicator in the console
@@ -126,16 +162,32 @@ def qmarks(vals):
     else:
         return ','.join(len(vals) * ['?'])
 
+@lru_cache(maxsize=512)
+def compile_regexp(pattern):
+    """ Return pattern compiled with re.IGNORECASE, caching the result. """
+    return re.compile(pattern, re.IGNORECASE)
+
+def _regexp_target(target_string):
+    """ Return target_string as str, or None if it cannot be searched. """
+    if isinstance(target_string, str):
+        return target_string
+    if isinstance(target_string, (int, float)):
+        return str(target_string)
+    return None
+
 def REGEXP(pattern, target_string):
     """ 
     Define a Regular Expression function that can be imported to sqlite.
     
     Returns True if pattern is matched in target_string, False if not matched.
+    Returns NULL if either argument is NULL, or if pattern is not a valid 
+    regular expression. Matching ignores case. Compiled patterns are cached,
+    see compile_regexp().
     
     Usage:
     First instantiate the function in the sqlite connection:
         con = sqlite.connect(dbname)
-        con.create_function("REGEXP", 2, REGEXP)
+        con.create_function("REGEXP", 2, REGEXP, deterministic=True)
     
     Search using either of 2 syntax options: (ex. pattern is '^W/d' using '?') 
         
@@ -147,36 +199,49 @@ def REGEXP(pattern, target_string):
 
         data = cur.execute(query, ('^W/d', 1) ).fetchall()  -- pattern is '^W/d'
     """    
+    if pattern is None or target_string is None:
+        return None
+    target_string = _regexp_target(target_string)
+    if target_string is None:
+        return None
     try:
-        return re.search(pattern, target_string, re.IGNORECASE) is not None
-    except Exception as e:
-        print(e)
+        return compile_regexp(pattern).search(target_string) is not None
+    except (re.error, TypeError):
+        return None
 
-def REGEXP1(pattern, target_string, group=None):
-    """ 
-    Define a Regular Expression function that can be imported to sqlite.
+def REGEXP1(pattern, target_string, group=0):
+    r""" 
+    Define a Regular Expression capture function that can be imported to sqlite.
     
-    Returns True if pattern is matched in target_string, False if not matched.
+    Returns the text captured by group in the first match of pattern in 
+    target_string: the whole match if group is 0 (default), else the numbered
+    or named group.  Returns NULL if not matched, if the group did not 
+    participate in the match, if either of pattern or target_string is NULL,
+    or if pattern or group are not valid.  Matching ignores case. 
     
     Usage:
     First instantiate the function in the sqlite connection:
         con = sqlite.connect(dbname)
-        con.create_function("REGEXP", 2, REGEXP)
+        con.create_function("REGEXP1", -1, REGEXP1, deterministic=True)
     
-    Search using either of 2 syntax options: (ex. pattern is '^W/d' using '?') 
-        
-        syntax1  <string> REGEXP <pattern>
-          ex1  = "SELECT * FROM <table> WHERE <field> REGEXP ?;"    
-
-        syntax2  REGEXP(<pattern>, <string>)
-          ex2  = "SELECT * FROM <table> WHERE REGEXP(?,<field>);"  
-
-        data = cur.execute(query, ('^W/d', 1) ).fetchall()  -- pattern is '^W/d'
+    Examples:
+        "SELECT REGEXP1('W\d+', 'was W12345')"              => 'W12345'
+        "SELECT REGEXP1('WAS H[ -]?(\d{5,9})', NOTES, 1)"   => '12345' 
+        "SELECT REGEXP1('x(?P<n>\d+)', 'x12', 'n')"         => '12' 
+        "SELECT REGEXP1('W\d+', 'no match')"                =>  NULL
     """    
+    if pattern is None or target_string is None:
+        return None
+    target_string = _regexp_target(target_string)
+    if target_string is None:
+        return None
     try:
-        return re.search(pattern, target_string, re.IGNORECASE) is not None
-    except Exception as e:
-        print(e)
+        m = compile_regexp(pattern).search(target_string)
+        if m is None:
+            return None
+        return m.group(group if group is not None else 0)
+    except (re.error, TypeError, IndexError):
+        return None
 
 W_PATTERN = re.compile(r"^(W)(\d+$)")
 CW_PATTERN = re.compile(r"^(\d\d)([W])(\d+$)") 
@@ -384,6 +449,19 @@ def MNU_FORMAT(Uliteral, default_val=None):
         #print (e)
         return default_val    
 
+# Size of the LRU caches in front of the SQL functions registered by open_db().
+SQL_FUNCTION_CACHE_SIZE = 2**16
+
+def memoized_sql_function(func, maxsize=SQL_FUNCTION_CACHE_SIZE):
+    """
+    Return func wrapped in a bounded LRU cache, for registering in sqlite.
+    
+    func must be deterministic: its result depends only on its arguments. 
+    SQL values (None, int, float, str, bytes) are all hashable.  The cache is 
+    typed, because 12345 and 12345.0 may format differently.
+    """
+    return lru_cache(maxsize=maxsize, typed=True)(func)
+
 class DB_context_manager():
     """ 
     A mixin class defining a context manager for a database. 
@@ -438,11 +516,40 @@ class DB_context_manager():
         return self._context_autocommit
 
 class DB_SQLite(DB_context_manager):
+
+    # SQL functions created on each connection by open_db(): (name, narg, func)
+    # They are registered as deterministic, so that SQLite may evaluate them
+    # once per statement for constant arguments.  They may be used in index 
+    # expressions and generated columns only if trusted_schema is ON, see 
+    # below.  REGEXP and REGEXP1 are usually applied to distinct long text
+    # values, so they cache compiled patterns rather than results.
+    sql_functions = (("REGEXP",          2, REGEXP),
+                     ("REGEXP1",        -1, REGEXP1),
+                     ("WNUM_FORMAT",    -1, memoized_sql_function(WNUM_FORMAT)),
+                     ("MNU_FORMAT",     -1, memoized_sql_function(MNU_FORMAT)),
+                     ("RELATEID_FORMAT",-1, memoized_sql_function(RELATEID_FORMAT)))
+
+    # Default value of PRAGMA trusted_schema set by open_db(), overridden per
+    # db by argument trusted_schema. Python's sqlite3 cannot mark the 
+    # sql_functions innocuous, so an index expression, generated column, view,
+    # or trigger using them can be created and used only if trusted_schema is
+    # ON.  The risk of ON: any trigger or view stored in the database file may
+    # then call the application functions, so a crafted database file runs 
+    # them with its own arguments when it is queried.  Use ON only for 
+    # databases built locally or from a trusted source.
+    trusted_schema = 'OFF'
+
+    # Size of the prepared statement cache of each connection, and of the 
+    # statement registry that counts its hits and misses.
+    cached_statements = 512
         
-    def __init__(self, db_name=None, open_db=False, commit=False, converttypes=True):
+    def __init__(self, db_name=None, open_db=False, commit=False, converttypes=True,
+                 trusted_schema=None):
         self.db_name = db_name
         self.qmarks = qmarks
         self.converttypes = converttypes  
+        if trusted_schema is not None:
+            self.trusted_schema = 'ON' if trusted_schema else 'OFF'
         if open_db: 
             self.connection_open = self.open_db()
         else: 
@@ -470,27 +577,23 @@ class DB_SQLite(DB_context_manager):
         """
         Open a connection to the db.
         
-        Creates functions:
+        Creates the deterministic functions in sql_functions:
             REGEXP
-            MNU_FORMAT
+            REGEXP1
             WNUM_FORMAT
+            MNU_FORMAT
+            RELATEID_FORMAT
             
         Handles date-times using switch "detect_types"
             https://pynative.com/python-sqlite-date-and-datetime/
         
+        Resets the schema-metadata cache and the statement registry.
         """
+        self._schema_cache = {}
+        self._statements = OrderedDict()
+        self.statement_hits = self.statement_misses = 0
         try:
-            if self.converttypes:
-                self.con = sqlite.connect(self.db_name,
-                                          detect_types=sqlite.PARSE_DECLTYPES |
-                                                       sqlite.PARSE_COLNAMES)
-            else:
-                self.con = sqlite.connect(self.db_name)
-            self.con.execute('PRAGMA trusted_schema=OFF') # see https://www.sqlite.org/appfunc.html
-            self.con.create_function("REGEXP", 2, REGEXP)
-            self.con.create_function("WNUM_FORMAT", -1, WNUM_FORMAT)
-            self.con.create_function("MNU_FORMAT", -1, MNU_FORMAT)
-
+            self.con = self._connect(self.db_name)
             self.cur = self.con.cursor()
             
             self.connection_open = True
@@ -499,6 +602,25 @@ class DB_SQLite(DB_context_manager):
             self.connection_open = False
         return self.connection_open
         
+    def _connect(self, database, uri=False, check_same_thread=True):
+        """ 
+        Return a new connection to database, with the sql_functions created.
+        """
+        if self.converttypes:
+            con = sqlite.connect(database, uri=uri,
+                                 detect_types=sqlite.PARSE_DECLTYPES |
+                                              sqlite.PARSE_COLNAMES,
+                                 cached_statements=self.cached_statements,
+                                 check_same_thread=check_same_thread)
+        else:
+            con = sqlite.connect(database, uri=uri,
+                                 cached_statements=self.cached_statements,
+                                 check_same_thread=check_same_thread)
+        con.execute(f'PRAGMA trusted_schema={self.trusted_schema}') # see https://www.sqlite.org/appfunc.html
+        for name, narg, func in self.sql_functions:
+            con.create_function(name, narg, func, deterministic=True)
+        return con
+
     def close_db(self, commit=None):    
         if commit==True:
             self.commit_db()
@@ -522,6 +644,13 @@ class DB_SQLite(DB_context_manager):
             print(e)
             return False
 
+    def sql_function_cache_info(self):
+        """ Return a dict of {name: lru cache statistics} for sql_functions. """
+        rv = {name: func.cache_info() for name, narg, func in self.sql_functions
+              if hasattr(func, 'cache_info')}
+        rv['REGEXP patterns'] = compile_regexp.cache_info()
+        return rv
+
     def vacuum(self):
         try:
             self.cur.execute('VACUUM')
@@ -530,38 +659,109 @@ class DB_SQLite(DB_context_manager):
             print (e)
             return False
         
+    def _execute(self, cur, sql, vals=None):
+        """ 
+        Execute a query on cursor cur. Print the error and return False if the
+        query fails.
+        
+        The schema-metadata cache is cleared after a statement that may change
+        the schema (CREATE, DROP, ALTER, ...).
+        """
+        self._register_statement(sql)
+        try:
+            if vals is None:
+                try:
+                    cur.execute(sql)
+                except Exception as e:
+                    print(f"ERROR A: query failed\n{sql}\n{str(e)}\n===============") 
+                    return False
+            else:             
+                try:
+                    cur.execute(sql, vals)
+                except Exception as e1:
+                    try:
+                        cur.execute(sql, tuple(vals))
+                    except Exception as e2:
+                        print(f"ERROR B: query failed\n{sql}")
+                        print(f"{str(vals)[:60]}...,{str(vals)[-60:]}")
+                        print(f">>err1: {str(e1)}\n--------------------")
+                        print(f">>err2: {str(e2)}\n====================") 
+                        return False
+            return True
+        finally:
+            if _SCHEMA_CHANGE.match(sql):
+                self.clear_schema_cache()
+
+    def _register_statement(self, sql):
+        """ 
+        Count sql as a hit or a miss in the statement registry. 
+        
+        The registry mirrors the connection's LRU cache of prepared statements,
+        which is keyed by the sql text.
+        """
+        if sql in self._statements:
+            self._statements.move_to_end(sql)
+            self._statements[sql] += 1
+            self.statement_hits += 1
+        else:
+            self._statements[sql] = 1
+            self.statement_misses += 1
+            if len(self._statements) > self.cached_statements:
+                self._statements.popitem(last=False)
+
+    def statement_cache_info(self):
+        """ 
+        Return a dict of statement registry statistics: hits, misses, size, 
+        maxsize, and the 10 most used statements in the registry with counts.
+        """
+        top = sorted(self._statements.items(), key=lambda kv: -kv[1])[:10]
+        return {'hits': self.statement_hits, 
+                'misses': self.statement_misses,
+                'size': len(self._statements), 
+                'maxsize': self.cached_statements,
+                'top': top}
+
     def query(self, sql, vals=None, n=None):
         """ 
         Execute a query and return the result set
         """
         rv = []
-        if vals is None:
-            try:
-                self.cur.execute(sql)
-                #rv = self.cur.fetchall()
-            except Exception as e:
-                print(f"ERROR A: query failed\n{sql}\n{str(e)}\n===============") 
-                return rv
-        else:             
-            try:
-                self.cur.execute(sql, vals)
-                #rv = self.cur.fetchall()
-            except Exception as e1:
-                try:
-                    self.cur.execute(sql, tuple(vals))
-                    #rv = self.cur.fetchall()
-                except Exception as e2:
-                    print(f"ERROR B: query failed\n{sql}")
-                    print(f"{str(vals)[:60]}...,{str(vals)[-60:]}")
-                    print(f">>err1: {str(e1)}\n--------------------")
-                    print(f">>err2: {str(e2)}\n====================") 
-                    return rv
+        if not self._execute(self.cur, sql, vals):
+            return rv
         if n is None:
             rv = self.cur.fetchall()
         else:
             rv = self.cur.fetchmany(n)
         return rv            
 
+    # Default number of rows fetched at a time by iter_query()
+    arraysize = 10000
+
+    def iter_query(self, sql, vals=None, arraysize=None):
+        """ 
+        Execute a query and yield the rows of the result set.
+        
+        The rows are fetched arraysize at a time (default DB_SQLite.arraysize)
+        from a cursor of their own, so memory use is bounded by arraysize, and
+        other queries may be run while iterating.  Errors are reported as in
+        query(), and no rows are yielded.
+        
+        The query is executed when iteration begins.  Do not edit the queried
+        tables while iterating.
+        """
+        cur = self.con.cursor()
+        cur.arraysize = arraysize or self.arraysize
+        try:
+            if not self._execute(cur, sql, vals):
+                return
+            while True:
+                rows = cur.fetchmany()
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+
     def queryone(self, sql, vals=None, default=None):
         """
         Execute a query and return first result tuple, or value.
@@ -581,28 +781,231 @@ class DB_SQLite(DB_context_manager):
         else:
             return default
     
+    def _schema_cached(self, key, load):
+        """ 
+        Return the schema metadata for key, calling load() if it is not cached.
+        
+        The cache is cleared by each statement that may change the schema run
+        through query() and the other query methods, see _execute().  Call
+        clear_schema_cache() after changing the schema by other means, e.g.
+        from another connection or process.
+        """
+        if not key in self._schema_cache:
+            self._schema_cache[key] = load()
+        return self._schema_cache[key]
+
+    def clear_schema_cache(self):
+        """ Clear the schema-metadata cache, see _schema_cached(). """
+        self._schema_cache = {}
+
     def get_tablenames(self):
         ''' Return a tuple of all Table names in the database'''
-        data = self.cur.execute("select name from sqlite_master where type='table'").fetchall()
-        rv = tuple(row[0] for row in data)
-        return rv
+        return self._schema_cached(('tables',), lambda: tuple(row[0] for row in 
+            self.con.execute("select name from sqlite_master where type='table'")))
 
     def get_viewnames(self):
         ''' Return a tuple of all View names in the database'''
-        data = self.cur.execute("select name from sqlite_master where type='view'").fetchall()
-        return tuple(row[0] for row in data)
+        return self._schema_cached(('views',), lambda: tuple(row[0] for row in 
+            self.con.execute("select name from sqlite_master where type='view'")))
+
+    def get_table_info(self, table_name):
+        """ Return a tuple of the PRAGMA TABLE_INFO rows of table_name. """
+        return self._schema_cached(('table_info', table_name), lambda: tuple( 
+            self.con.execute(f'PRAGMA TABLE_INFO({table_name})').fetchall()))
 
     def get_column_names(self, table_name):
         """ Return a list of field_names table_name."""
-        data = self.cur.execute(f'PRAGMA TABLE_INFO({table_name})').fetchall()
-        return [str(f[1]) for f in data]
+        return [str(f[1]) for f in self.get_table_info(table_name)]
 
     def get_column_type_dict (self, table_name):
         """ 
         Return a dictionary of {field_name: field_type} for table_name.
         """
-        data = self.cur.execute(f'PRAGMA TABLE_INFO({table_name})').fetchall()
-        return OrderedDict({str(f[1]) : str(f[2]) for f in data})
+        return OrderedDict({str(f[1]) : str(f[2]) 
+                            for f in self.get_table_info(table_name)})
+
+    def get_index_sql(self, tables=None):
+        """ 
+        Return a list of (index_name, table_name, sql) for explicit indexes.
+        
+        Arguments
+        ---------
+        tables : iterable of table names, or None for all tables.
+        
+        Indexes created implicitly by UNIQUE or PRIMARY KEY constraints have no
+        sql and are not returned; they cannot be dropped.
+        """
+        data = self.cur.execute("""select name, tbl_name, sql from sqlite_master 
+                                   where type='index' and sql is not null
+                                   order by rowid""").fetchall()
+        if tables is not None:
+            utables = [t.upper() for t in tables]
+            data = [row for row in data if row[1].upper() in utables]
+        return data
+
+    def foreign_key_check(self, tables=None):
+        """
+        Run PRAGMA foreign_key_check and print a count of violations per table.
+        
+        Arguments
+        ---------
+        tables : iterable of table names, or None for all tables.
+        
+        Returns
+        -------
+        A list of violations: (table, rowid, parent table, fk index)
+        """
+        if tables is None:
+            rv = self.query('PRAGMA foreign_key_check;')
+        else:
+            rv = []
+            for t in tables:
+                rv += self.query(f'PRAGMA foreign_key_check({t});')
+        counts = OrderedDict()
+        for row in rv:
+            counts[row[0]] = counts.get(row[0], 0) + 1
+        for t, n in counts.items():
+            print (f'foreign_key_check: {n} violations in table {t}')
+        return rv
+
+    _bulk_load_pragmas = OrderedDict((('journal_mode', 'MEMORY'),
+                                      ('synchronous' , 'OFF'),
+                                      ('cache_size'  , -262144),
+                                      ('temp_store'  , 'MEMORY'),
+                                      ('foreign_keys', 'OFF')))
+
+    # Table holding the sql of the indexes dropped by bulk_load(), until 
+    # they are recreated.
+    bulk_load_index_table = 'owi_bulk_load_index'
+
+    def _restore_bulk_load_indexes(self, tables=None):
+        """
+        Handle the indexes left dropped by an interrupted bulk_load().
+        
+        The sql of each dropped index is kept in bulk_load_index_table until 
+        the index is recreated.  Return the list of (name, table_name, sql) of
+        those on tables, which are to be recreated at the end of this 
+        bulk_load.  Those on other tables are recreated now.  Indexes that 
+        cannot be recreated stay in the table, so that they are tried again.
+        """
+        if not self.bulk_load_index_table in self.get_tablenames():
+            return []
+        existing = {r[0] for r in self.cur.execute(
+                        "select name from sqlite_master where type='index'").fetchall()}
+        utables = None if tables is None else [t.upper() for t in tables]
+        alltables = [t.upper() for t in self.get_tablenames()]
+        rv = []
+        for name, table_name, sql in self.query(
+                f"SELECT name, tbl_name, sql FROM {self.bulk_load_index_table};"):
+            if name in existing or not table_name.upper() in alltables:
+                pass
+            elif utables is None or table_name.upper() in utables:
+                rv.append((name, table_name, sql))
+                continue
+            else:
+                print (f'bulk_load: recreating index {name} on {table_name}, '
+                        'left dropped by an interrupted bulk_load')
+                if not self._execute(self.cur, sql):
+                    continue
+            self.query(f"DELETE FROM {self.bulk_load_index_table} WHERE name = ?;", 
+                       (name,))
+        if rv:
+            print (f'bulk_load: {len(rv)} indexes were left dropped by an '
+                    'interrupted bulk_load')
+        return rv
+
+    @contextmanager
+    def bulk_load(self, tables=None, check_foreign_keys=False):
+        """
+        Context manager for loading large amounts of data into tables.
+        
+        Arguments
+        ---------
+        tables : iterable of table names, or None for all tables. Only indexes
+                 on these tables are dropped and recreated.
+        check_foreign_keys : If True, PRAGMA foreign_key_check is run on 
+                 tables at exit.
+        
+        On entry:
+        -   Any open transaction is committed (if the context permits).
+        -   The pragmas in _bulk_load_pragmas are saved and then set for speed:
+            in-memory journal, no syncing, a 256MB cache, temp store in memory,
+            and foreign keys off.
+        -   The explicit indexes on tables are captured in table 
+            owi_bulk_load_index, and dropped.  Indexes on tables left dropped
+            by an interrupted bulk_load are taken from owi_bulk_load_index; 
+            those on other tables are recreated.
+        On exit:
+        -   The indexes are recreated, one pass per index, and removed from 
+            owi_bulk_load_index.
+        -   Edits are committed (if the context permits). 
+        -   The saved pragmas are restored.
+        -   If check_foreign_keys, PRAGMA foreign_key_check is run on tables, 
+            and the violations are stored in self.foreign_key_violations.
+        
+        Usage
+        -----
+        with c4db(db_name, commit=True) as db:
+            with db.bulk_load(('c4ix', 'c4id')):
+                <insert data>
+        
+        Notes
+        -----
+        -   UNIQUE constraints declared in CREATE TABLE statements are enforced
+            by automatic indexes that cannot be dropped, so they remain active.
+        -   Recreating a UNIQUE index fails if the loaded data violates it. The
+            error is printed and the index is not recreated; its sql is kept 
+            in owi_bulk_load_index, and the next bulk_load tries again.
+        -   The index drops are made inside a transaction, together with the 
+            record of their sql, so if the context does not permit commits the
+            indexes are restored by rollback.  If the body commits and is then
+            interrupted, the indexes are recreated by the next bulk_load.
+        -   journal_mode, synchronous, and foreign_keys cannot be changed 
+            inside an open transaction, so they are not changed if commits are
+            forbidden.
+        """
+        if self.con.in_transaction:
+            self.commit_db(msg='bulk_load: pending edits')
+        txn_pragmas = ('journal_mode', 'synchronous', 'foreign_keys')
+        if self.con.in_transaction or not self._context_autocommit:
+            fixed = txn_pragmas
+        else:
+            fixed = ()
+        saved = OrderedDict((p, self.queryone(f'PRAGMA {p};')) 
+                            for p in self._bulk_load_pragmas if not p in fixed)
+        for p in saved:
+            self.query(f'PRAGMA {p} = {self._bulk_load_pragmas[p]};')
+        
+        if not self.con.in_transaction:
+            self.cur.execute('BEGIN;')
+        indexes = self._restore_bulk_load_indexes(tables) + self.get_index_sql(tables)
+        self.query(f"""CREATE TABLE IF NOT EXISTS {self.bulk_load_index_table} (
+                          name     TEXT PRIMARY KEY,
+                          tbl_name TEXT NOT NULL,
+                          sql      TEXT NOT NULL) WITHOUT ROWID;""")
+        self.cur.executemany(
+            f"INSERT OR REPLACE INTO {self.bulk_load_index_table} VALUES (?,?,?);", 
+            indexes)
+        for name, table_name, sql in indexes:
+            self.query(f'DROP INDEX IF EXISTS "{name}";')
+        print (f'bulk_load: dropped {len(indexes)} indexes')
+        try:
+            yield self
+        finally:
+            for name, table_name, sql in indexes:
+                print (f'bulk_load: recreating index {name} on {table_name}')
+                if self._execute(self.cur, sql):
+                    self.query(f"DELETE FROM {self.bulk_load_index_table} WHERE name = ?;",
+                               (name,))
+            self.commit_db(msg='bulk_load: complete')
+            for p, val in saved.items():
+                if p in txn_pragmas and self.con.in_transaction:
+                    continue
+                self.query(f'PRAGMA {p} = {val};')
+            if check_foreign_keys:
+                self.foreign_key_violations = self.foreign_key_check(tables)
+            else:
+                self.foreign_key_violations = None
 
     def export_table_to_csv(self, table_name, csv_name, where=''):   
         """      
@@ -638,16 +1041,47 @@ class DB_SQLite(DB_context_manager):
                             dialect='excel')
 #                            quoting=csv.QUOTE_NONNUMERIC)
             w.writerow(cols)
-            for row in self.query(s):
-                w.writerow(row)
+            w.writerows(self.iter_query(s))
         print (f"{table_name} written to {csv_name}")
 
 class c4db(DB_SQLite): 
+
+    # R*Tree virtual table of the c4locs well locations, keyed by wellid.
+    locs_rtree = 'c4locs_rtree'
+
+    # FTS5 full-text indexes: 
+    #     {index name: (source table, key column, indexed columns)}
+    # The indexes are external content tables over the source tables, linked 
+    # by the key column, so the text is not stored twice. The key should be an
+    # INTEGER PRIMARY KEY, so that VACUUM does not renumber it (the c4 tables
+    # of the owi schemas declare rowid INTEGER PRIMARY KEY).  Each source 
+    # table has wellid.
+    text_indexes = OrderedDict((
+        ('c4rm_fts',      ('c4rm',      'rowid', ('REMARKS',))),
+        ('c4st_fts',      ('c4st',      'rowid', ('DRLLR_DESC',))),
+        ('c4ad_fts',      ('c4ad',      'rowid', ('NAME', 'HOUSE_NO', 'STREET', 'ROAD_TYPE',
+                                                  'ROAD_DIR', 'CITY', 'STATE', 'ZIPCODE'))),
+        ('MDHsealed_fts', ('MDHsealed', 'irow',  ('NOTES', 'COMMENTS'))),
+    ))
+
+    # Tables with wellid that are read by fetch_wells(), in the order reported.
+    dossier_tables = ('c4ix', 'c4locs', 'c4ad', 'c4an', 'c4c1', 'c4c2', 'c4pl', 
+                      'c4rm', 'c4st', 'c4wl', 'o1id')
+
+    # Views materialized by create_materialized_views() into tables mv_<view>.
+    # Edits of the dossier_tables are tracked by triggers, by wellid, in table
+    # owi_mv_dirty. Views are keyed by their wellid (and Mwellid) columns.
+    materialized_view_names = ('v1idsets', 'vo1ix', 'vo1ad', 'vo1an', 'vo1c1', 
+                               'vo1c2', 'vo1pl', 'vo1rm', 'vo1st', 'vo1wl', 
+                               'vo1locs')
+
     def __init__(self, db_name=None, 
                        open_db=False, 
-                       commit=False):
+                       commit=False,
+                       trusted_schema=None):
         
-        DB_SQLite.__init__(self, db_name, open_db=open_db, commit=commit)
+        DB_SQLite.__init__(self, db_name, open_db=open_db, commit=commit,
+                           trusted_schema=trusted_schema)
         
 #         datatables = 'ix ad an c1 c2 id pl rm st wl locs'.split()
 #         self.datatables = [f"{OWI_DATA_TABLE_PREFIX}{t}" for t in datatables]
@@ -687,6 +1121,415 @@ class c4db(DB_SQLite):
             print ('update_unique_no_from_wellid():\n  ', e)
             return False 
 
+    def create_locs_rtree(self):
+        """
+        Create or rebuild the R*Tree index of well locations in c4locs.
+        
+        Each located well in c4locs is stored as a point (UTME, UTMN) keyed
+        by wellid.  Wells without wellid or coordinates are omitted.
+        
+        Notes
+        -----
+        This routine does not issue a COMMIT.  It is not maintained by 
+        triggers, so rebuild it after c4locs is edited.  The count and extent
+        of the index are cached for nearest_wells().
+        """
+        ok = (self._execute(self.cur, f"DROP TABLE IF EXISTS {self.locs_rtree};") and
+              self._execute(self.cur, f"""CREATE VIRTUAL TABLE {self.locs_rtree} USING rtree(
+                                             wellid, minx, maxx, miny, maxy);""") and
+              self._execute(self.cur, f"""INSERT OR REPLACE INTO {self.locs_rtree} 
+                                           SELECT wellid, UTME, UTME, UTMN, UTMN FROM c4locs
+                                           WHERE wellid IS NOT NULL 
+                                             AND UTME IS NOT NULL AND UTMN IS NOT NULL;"""))
+        if not ok:
+            print (f"create_locs_rtree: ERROR - {self.locs_rtree} was not built.")
+            return False
+        n = self._locs_extent()[0]
+        print (f"create_locs_rtree: {n} wells indexed in {self.locs_rtree}")
+        return True
+
+    def _locs_extent(self):
+        """
+        Return (count, xmin, xmax, ymin, ymax) of the wells in locs_rtree, or
+        None if it does not exist.
+        
+        The value is cached with the schema metadata.  It is recomputed after
+        create_locs_rtree(), which rebuilds locs_rtree.
+        """
+        def load():
+            try:
+                return tuple(self.con.execute(
+                    f"""SELECT count(*), min(minx), max(maxx), min(miny), max(maxy) 
+                        FROM {self.locs_rtree};""").fetchone())
+            except sqlite.OperationalError:
+                return None
+        return self._schema_cached(('locs_extent',), load)
+
+    def wells_in_bbox(self, xmin, ymin, xmax, ymax):
+        """
+        Return a list of (wellid, UTME, UTMN) for wells in a bounding box.
+        
+        Arguments are UTM coordinates, in the projection of c4locs.UTME/UTMN.
+        The box includes its edges.  Requires create_locs_rtree().
+        """
+        return self.query(f"""
+            SELECT L.wellid, L.UTME, L.UTMN
+            FROM {self.locs_rtree} R
+            JOIN c4locs L ON L.wellid = R.wellid
+            WHERE R.minx <= ? AND R.maxx >= ? AND R.miny <= ? AND R.maxy >= ?
+              AND L.UTME BETWEEN ? AND ? AND L.UTMN BETWEEN ? AND ?
+            ORDER BY L.wellid;""",
+            (xmax, xmin, ymax, ymin, xmin, xmax, ymin, ymax))
+
+    def wells_within(self, x, y, radius):
+        """
+        Return a list of (wellid, distance) for wells within radius of (x,y).
+        
+        The list is sorted by distance, nearest first.  Coordinates and 
+        radius are in UTM meters.  Requires create_locs_rtree().
+        """
+        rows = self.query(f"""
+            SELECT wellid, d2 FROM (
+                SELECT L.wellid, (L.UTME-?)*(L.UTME-?) + (L.UTMN-?)*(L.UTMN-?) AS d2
+                FROM {self.locs_rtree} R
+                JOIN c4locs L ON L.wellid = R.wellid
+                WHERE R.minx <= ? AND R.maxx >= ? AND R.miny <= ? AND R.maxy >= ?)
+            WHERE d2 <= ?
+            ORDER BY d2, wellid;""",
+            (x, x, y, y, x+radius, x-radius, y+radius, y-radius, radius*radius))
+        return [(wellid, math.sqrt(d2)) for wellid, d2 in rows]
+
+    def nearest_wells(self, x, y, k=1):
+        """
+        Return a list of (wellid, distance) for the k wells nearest to (x,y).
+        
+        The list is sorted by distance, nearest first.  Requires 
+        create_locs_rtree().
+        
+        The search radius starts at the radius expected to hold k wells at 
+        the average density of wells, and is doubled until k wells are found.
+        
+        Raises sqlite3.OperationalError if locs_rtree does not exist.
+        """
+        extent = self._locs_extent()
+        if extent is None:
+            raise sqlite.OperationalError(
+                f"nearest_wells: no such table: {self.locs_rtree}, run create_locs_rtree() first")
+        n, xmin, xmax, ymin, ymax = extent
+        if not n or k < 1:
+            return []
+        k = min(k, n)
+        # Any well is within the distance to the farthest corner of the extent.
+        rmax = math.hypot(max(abs(x-xmin), abs(x-xmax)), 
+                          max(abs(y-ymin), abs(y-ymax))) + 1
+        area = max((xmax - xmin) * (ymax - ymin), 1.0)
+        radius = min(max(math.sqrt(area * k / (math.pi * n)), 1.0), rmax)
+        while True:
+            rv = self.wells_within(x, y, radius)
+            if len(rv) >= k or radius >= rmax:
+                return rv[:k]
+            radius = min(2 * radius, rmax)
+
+    def create_text_indexes(self, indexes=None, tables=None):
+        """
+        Create or rebuild FTS5 full-text indexes defined in text_indexes.
+        
+        Arguments
+        ---------
+        indexes : iterable of index names in text_indexes, or None for all.
+                  Indexes whose source table or columns are missing are skipped.
+        tables  : iterable of source table names, or None.  If given, only 
+                  the indexes of these tables are rebuilt.
+        
+        Notes
+        -----
+        This routine does not issue a COMMIT.  The indexes are not maintained
+        by triggers: with PRAGMA trusted_schema OFF (see DB_SQLite), SQLite 
+        refuses a trigger that writes an FTS5 table, so every edit of a source
+        table would fail.  Rebuild the indexes of a table after it is edited, 
+        e.g. create_text_indexes(tables=('c4rm',)); RUN_import_csv rebuilds 
+        them at each build.  A stale index may return deleted or renumbered 
+        rows.
+        """
+        if indexes is None:
+            indexes = self.text_indexes.keys()
+        if tables is not None:
+            indexes = [fts for fts in indexes if self.text_indexes[fts][0] in tables]
+        tables = self.get_tablenames()
+        rv = []
+        for fts in indexes:
+            src, key, cols = self.text_indexes[fts]
+            if not src in tables or not set(cols + ('wellid',)).issubset(
+                                          self.get_column_names(src)):
+                print (f"create_text_indexes: skipping {fts}, {src} is missing or incomplete")
+                continue
+            if not any(f[1] == key and f[2].upper() == 'INTEGER' and f[5] == 1 
+                       for f in self.get_table_info(src)):
+                if key != 'rowid':
+                    print (f"create_text_indexes: skipping {fts}, {src}.{key} is not an INTEGER PRIMARY KEY")
+                    continue
+                print (f"create_text_indexes: {src} has no INTEGER PRIMARY KEY rowid, rebuild {fts} after VACUUM")
+            self.query(f"DROP TABLE IF EXISTS {fts};")
+            self.query(f"""CREATE VIRTUAL TABLE {fts} USING fts5(
+                              {', '.join(cols)}, 
+                              content='{src}', content_rowid='{key}');""")
+            self.query(f"INSERT INTO {fts}({fts}) VALUES('rebuild');")
+            print (f"create_text_indexes: {fts} indexes {src}({', '.join(cols)})")
+            rv.append(fts)
+        return rv
+
+    def search_text(self, match, indexes=None, limit=100, snippet_tokens=12):
+        """
+        Search the full-text indexes, returning ranked results with snippets.
+        
+        Arguments
+        ---------
+        match   : FTS5 query string, e.g. 'sandstone', 'flowing NEAR well', 
+                  '"DNR OB"*', or 'NAME: smith' (a column filter requires 
+                  indexes that all have the column).
+        indexes : iterable of index names in text_indexes, or None for all 
+                  existing indexes.
+        limit   : maximum number of results returned from each index.
+        snippet_tokens : approximate number of tokens in each snippet.
+        
+        Returns
+        -------
+        A list of (table_name, wellid, key, rank, snippet), where key is the 
+        value of the key column of the index (see text_indexes). The results
+        are ranked within each index, best match first, and the indexes are 
+        in the order given. rank is the bm25() score of the index: more 
+        negative is a better match.  bm25() depends on the term statistics 
+        of its own index, so ranks of different indexes are not comparable.
+        Matched terms are marked in snippets with [ ]. 
+        
+        Requires create_text_indexes().
+        """
+        tables = self.get_tablenames()
+        if indexes is None:
+            indexes = self.text_indexes.keys()
+        rv = []
+        for fts in indexes:
+            if not fts in tables:
+                continue
+            src, key, cols = self.text_indexes[fts]
+            rv += self.query(f"""
+                SELECT '{src}', S.wellid, S.{key}, bm25({fts}) AS rank,
+                       snippet({fts}, -1, '[', ']', '...', ?)
+                FROM {fts}
+                JOIN {src} S ON S.{key} = {fts}.rowid
+                WHERE {fts} MATCH ?
+                ORDER BY rank
+                LIMIT ?;""", (snippet_tokens, match, limit))
+        return rv
+
+    def fetch_wells(self, wellids, tables=None, by_table=False, batch_size=10000):
+        """
+        Yield the records of many wells from many tables, a batch at a time.
+        
+        Each batch of wellids is loaded into the temporary table 
+        temp.owi_fetch_wellid, and each table is read once per batch by a 
+        join on wellid.  Memory use is bounded by batch_size wells.  The 
+        edits of the temporary table are committed only if no transaction 
+        was open, so pending edits are never committed.
+        
+        Arguments
+        ---------
+        wellids    : iterable of wellids (int). Duplicates are ignored.
+        tables     : iterable of table names with a wellid column, or None for
+                     dossier_tables.  Missing tables are skipped.
+        by_table   : If False, yield per well; if True yield per batch.
+        batch_size : number of wellids per batch.
+        
+        Yields
+        ------
+        If by_table is False: (wellid, {table_name: [row, ...]}) for each 
+            requested wellid, in order of wellid within each batch. Tables 
+            with no records for the well have an empty list.
+        If by_table is True: {table_name: [row, ...]} for each batch, with the
+            rows of each table ordered by wellid.
+        Rows are tuples of all columns, in the order of get_column_names().
+        
+        Usage
+        -----
+        for wellid, dossier in db.fetch_wells(wellids):
+            print (wellid, len(dossier['c4st']))
+        """
+        if tables is None:
+            tables = self.dossier_tables
+        existing = self.get_tablenames()
+        tables = [t for t in tables if t in existing]
+        self.query("""CREATE TEMP TABLE IF NOT EXISTS owi_fetch_wellid (
+                        wellid INTEGER PRIMARY KEY);""")
+        wellids = iter(wellids)
+        try:
+            while True:
+                batch = [(w,) for w in islice(wellids, batch_size)]
+                if not batch:
+                    break
+                own_txn = not self.con.in_transaction
+                self.query("DELETE FROM temp.owi_fetch_wellid;")
+                self.cur.executemany(
+                    "INSERT OR IGNORE INTO temp.owi_fetch_wellid VALUES (?);", batch)
+                if own_txn:
+                    # End the implicit transaction, which only edited temp.
+                    self.con.commit()
+                rows = {t: self.query(f"""
+                            SELECT T.* FROM temp.owi_fetch_wellid W
+                            JOIN {t} T ON T.wellid = W.wellid
+                            ORDER BY W.wellid, T.rowid;""") for t in tables}
+                if by_table:
+                    yield rows
+                    continue
+                ids = [r[0] for r in self.query(
+                          "SELECT wellid FROM temp.owi_fetch_wellid ORDER BY wellid;")]
+                dossiers = {w: {t: [] for t in tables} for w in ids}
+                for t in tables:
+                    iwellid = self.get_column_names(t).index('wellid')
+                    for row in rows[t]:
+                        dossiers[row[iwellid]][t].append(row)
+                del rows
+                yield from dossiers.items()
+        finally:
+            own_txn = not self.con.in_transaction
+            self.query("DELETE FROM temp.owi_fetch_wellid;")
+            if own_txn:
+                self.con.commit()
+
+    def get_materialized_views(self):
+        """ Return a dict of {view name: materialized table name}. """
+        if not 'owi_materialized_view' in self.get_tablenames():
+            return {}
+        return dict(self.query(
+            "SELECT view_name, table_name FROM owi_materialized_view;"))
+
+    def _materialize_view(self, view, table):
+        """ (Re)create table from view, with indexes on its wellid columns. """
+        self.query(f"DROP TABLE IF EXISTS {table};")
+        self.query(f"CREATE TABLE {table} AS SELECT * FROM {view};")
+        for key in self._materialized_view_keys(table):
+            self.query(f"CREATE INDEX IF NOT EXISTS idx_{table}_{key} ON {table}({key});")
+
+    def _materialized_view_keys(self, table):
+        return [c for c in ('wellid', 'Mwellid') if c in self.get_column_names(table)]
+
+    def create_materialized_views(self, views=None):
+        """
+        Materialize views into tables, and track edits to refresh them.
+        
+        Each view is copied to table mv_<view>, indexed on wellid (and 
+        Mwellid), and recorded in table owi_materialized_view.  Triggers on 
+        the dossier_tables record the wellid of each inserted, updated, or 
+        deleted record in owi_mv_dirty, see refresh_materialized_views().
+        
+        Arguments
+        ---------
+        views : iterable of view names, or None for materialized_view_names.
+                Views that are missing or fail are skipped.
+        
+        Notes
+        -----
+        This routine does not issue a COMMIT.
+        """
+        if views is None:
+            views = self.materialized_view_names
+        self.query("""CREATE TABLE IF NOT EXISTS owi_materialized_view (
+                        view_name  TEXT PRIMARY KEY,
+                        table_name TEXT NOT NULL,
+                        refreshed  TEXT);""")
+        existing = self.get_viewnames()
+        for view in views:
+            if not view in existing:
+                print (f"create_materialized_views: view {view} is missing")
+                continue
+            table = f"mv_{view}"
+            try:
+                self._materialize_view(view, table)
+            except Exception as e:
+                print (f"create_materialized_views: {view} failed\n  {e}")
+                continue
+            if not self._materialized_view_keys(table):
+                print (f"create_materialized_views: {view} has no wellid")
+                self.query(f"DROP TABLE IF EXISTS {table};")
+                continue
+            self.query("""INSERT OR REPLACE INTO owi_materialized_view 
+                          VALUES (?, ?, datetime('now'));""", (view, table))
+            print (f"create_materialized_views: {view} materialized as {table}")
+        self.create_materialized_view_triggers()
+        self.query("DELETE FROM owi_mv_dirty;")
+
+    def create_materialized_view_triggers(self):
+        """ Create the triggers that track edits of the dossier_tables. """
+        self.query("""CREATE TABLE IF NOT EXISTS owi_mv_dirty (
+                        wellid INTEGER PRIMARY KEY);""")
+        existing = self.get_tablenames()
+        for t in self.dossier_tables:
+            if not t in existing:
+                continue
+            for event, rows in (('INSERT', ('NEW',)),
+                                ('UPDATE', ('OLD', 'NEW')),
+                                ('DELETE', ('OLD',))):
+                select = '\n UNION '.join(f"SELECT {r}.wellid WHERE {r}.wellid IS NOT NULL"
+                                          for r in rows)
+                self.query(f"""CREATE TRIGGER IF NOT EXISTS owi_mv_{t}_{event.lower()}
+                               AFTER {event} ON {t}
+                               BEGIN
+                                 INSERT OR IGNORE INTO owi_mv_dirty {select};
+                               END;""")
+
+    def drop_materialized_view_triggers(self):
+        """
+        Drop the triggers that track edits for refresh_materialized_views().
+        
+        Use before bulk imports that replace the tables, followed by 
+        refresh_materialized_views(full=True), which recreates the triggers.
+        """
+        for (name,) in self.query("""SELECT name FROM sqlite_master 
+                                     WHERE type='trigger' AND name LIKE 'owi_mv_%';"""):
+            self.query(f"DROP TRIGGER IF EXISTS {name};")
+
+    def refresh_materialized_views(self, full=False):
+        """
+        Refresh the materialized views.
+        
+        Incrementally, only the rows of wells recorded in owi_mv_dirty are
+        recomputed: they are deleted from each materialized table, reselected
+        from its view, and owi_mv_dirty is emptied.  If full is True, every
+        materialized table is recreated from its view, and the triggers are
+        recreated.
+        
+        Returns the number of wellids refreshed, or None if full.
+        
+        Notes
+        -----
+        This routine does not issue a COMMIT.
+        """
+        mviews = self.get_materialized_views()
+        if full:
+            for view, table in mviews.items():
+                self._materialize_view(view, table)
+                self.query("""UPDATE owi_materialized_view SET refreshed = datetime('now') 
+                              WHERE view_name = ?;""", (view,))
+            if mviews:
+                self.create_materialized_view_triggers()
+                self.query("DELETE FROM owi_mv_dirty;")
+            print (f"refresh_materialized_views: {len(mviews)} views recreated")
+            return None
+        if not mviews:
+            return 0
+        n = self.queryone("SELECT count(*) FROM owi_mv_dirty;")
+        if n:
+            for view, table in mviews.items():
+                keys = self._materialized_view_keys(table)
+                where = ' OR '.join(f"{k} IN (SELECT wellid FROM owi_mv_dirty)" 
+                                    for k in keys)
+                self.query(f"DELETE FROM {table} WHERE {where};")
+                self.query(f"INSERT INTO {table} SELECT * FROM {view} WHERE {where};")
+                self.query("""UPDATE owi_materialized_view SET refreshed = datetime('now') 
+                              WHERE view_name = ?;""", (view,))
+            self.query("DELETE FROM owi_mv_dirty;")
+        print (f"refresh_materialized_views: {n} wells refreshed in {len(mviews)} views")
+        return n
+
      
 #     def set_triggers_enabled(self, enable):
 #         assert isinstance(enable, bool)
@@ -698,6 +1541,193 @@ class c4db(DB_SQLite):
 # def triggers_off():      
 #     return 0  
 
+class c4db_pool(c4db):
+    """
+    A c4db that may be shared by threads, with a read connection per thread.
+    
+    The database is put in WAL mode, so that readers and the writer do not 
+    block each other.  Each thread reads through its own read-only connection,
+    opened on first use.  Edits are made through the single writer connection,
+    by one thread at a time, inside the writing() context. All connections 
+    have the sql_functions (REGEXP, WNUM_FORMAT, MNU_FORMAT, ...).
+    
+    Usage
+    -----
+    with c4db_pool(db_name, commit=True) as db:
+        with ThreadPoolExecutor() as ex:
+            rv = list(ex.map(lambda w: db.nearest_wells(*w, k=5), sites))
+        with db.writing():
+            db.query(update, vals)
+            db.commit_db()
+    
+    Notes
+    -----
+    -   Outside writing(), db.con and db.cur are the calling thread's read 
+        connection and cursor, so every c4db query method may be used from 
+        any thread.  Statements that edit the database fail there with 
+        "attempt to write a readonly database".
+    -   Inside writing(), db.con and db.cur are the writer connection, so 
+        methods that edit (e.g. bulk_load, create_text_indexes) may be used.
+    -   Readers see only committed edits.
+    -   A ':memory:' database cannot be shared, use c4db.
+    """
+    def __init__(self, db_name=None, 
+                       open_db=False, 
+                       commit=False,
+                       trusted_schema=None):
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._lock = threading.RLock()
+        self._readers = []
+        c4db.__init__(self, db_name, open_db=open_db, commit=commit,
+                      trusted_schema=trusted_schema)
+
+    def __repr__(self):
+        rv = (f"c4db_pool(db_name='{self.db_name}'," 
+              f" open_db={self.connection_open}," 
+              f" commit={self._context_autocommit})")
+        return rv
+
+    @property
+    def con(self):
+        if getattr(self._local, 'writing', False):
+            return self._writer
+        return self._reader()[0]
+
+    @con.setter
+    def con(self, con):
+        self._writer = con
+
+    @property
+    def cur(self):
+        if getattr(self._local, 'writing', False):
+            return self._writer_cur
+        return self._reader()[1]
+
+    @cur.setter
+    def cur(self, cur):
+        self._writer_cur = cur
+
+    def open_db(self):
+        """
+        Open the writer connection to the db, and set WAL journal mode.
+        
+        Read connections are opened by each thread on first use.
+        """
+        if self.db_name == ':memory:':
+            print ("c4db_pool: ERROR - a ':memory:' database cannot be shared.")
+            self.connection_open = False
+            return False
+        self._schema_cache = {}
+        self._statements = OrderedDict()
+        self.statement_hits = self.statement_misses = 0
+        try:
+            self._writer = self._connect(self.db_name, check_same_thread=False)
+            self._writer_cur = self._writer.cursor()
+            mode = self._writer.execute('PRAGMA journal_mode=WAL;').fetchone()[0]
+            if mode.lower() != 'wal':
+                print (f"c4db_pool: WARNING - journal_mode is {mode}, not WAL.")
+            self._uri = pathlib.Path(self.db_name).resolve().as_uri() + '?mode=ro'
+            self.connection_open = True
+        except Exception as e:
+            print (f"c4db_pool/db_open: ERROR - could not open database: {self.db_name}.\n  {e}")
+            self.connection_open = False
+        return self.connection_open
+
+    def _reader(self):
+        """ Return (connection, cursor) for reading in the current thread. """
+        rv = getattr(self._local, 'reader', None)
+        if rv is None:
+            con = self._connect(self._uri, uri=True, check_same_thread=False)
+            # No implicit transactions, which would hold an old read snapshot.
+            con.isolation_level = None
+            rv = (con, con.cursor())
+            self._local.reader = rv
+            with self._lock:
+                self._readers.append(rv)
+        return rv
+
+    def release_reader(self):
+        """ 
+        Close the read connection of the calling thread, if it has one. 
+        
+        Call this from a thread that is about to end, so that its connection
+        is not held open until close_db().
+        """
+        rv = getattr(self._local, 'reader', None)
+        if rv is None:
+            return
+        self._local.reader = None
+        with self._lock:
+            self._readers.remove(rv)
+        rv[1].close()
+        rv[0].close()
+
+    @contextmanager
+    def writing(self):
+        """
+        Context in which the calling thread uses the writer connection.
+        
+        Only one thread at a time is in the writing() context; others wait.
+        Edits are not committed on exit: call commit_db().
+        """
+        with self._write_lock:
+            was_writing = getattr(self._local, 'writing', False)
+            self._local.writing = True
+            try:
+                yield self
+            finally:
+                self._local.writing = was_writing
+
+    def commit_db(self, msg=''):
+        """ 
+        Commit the edits made on the writer connection. 
+        
+        The schema-metadata cache is cleared, because readers may have cached
+        the schema as it was before an uncommitted schema change.
+        """
+        with self.writing():
+            rv = c4db.commit_db(self, msg=msg)
+        self.clear_schema_cache()
+        return rv
+
+    def close_db(self, commit=None):
+        """ Close the writer and all of the read connections. """
+        if commit==True:
+            self.commit_db()
+        with self._lock:
+            for con, cur in self._readers:
+                cur.close()
+                con.close()
+            self._readers = []
+        self._local = threading.local()
+        if hasattr(self, '_writer'):
+            self._writer_cur.close()
+            self._writer.close()
+        self.connection_open = False
+
+    @property
+    def reader_count(self):
+        """ Number of open read connections. """
+        return len(self._readers)
+
+    def _register_statement(self, sql):
+        with self._lock:
+            c4db._register_statement(self, sql)
+
+    def _schema_cached(self, key, load):
+        with self._lock:
+            return c4db._schema_cached(self, key, load)
+
+    def clear_schema_cache(self):
+        with self._lock:
+            c4db.clear_schema_cache(self)
+
+    def vacuum(self):
+        with self.writing():
+            return c4db.vacuum(self)
+
+
 if __name__=='__main__':
     if 1:
         DB_NAME = r'/home/bill/R/cwi/OWI40.sqlite'
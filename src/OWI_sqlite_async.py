@@ -0,0 +1,176 @@
+'''
+An asyncio interface to c4db, for services running in an event loop.
+
+Class c4db_async runs the blocking c4db methods in a dedicated thread pool
+executor, so that awaiting a query does not block the event loop.  A file
+database is opened as a c4db_pool, so that queries from several coroutines
+run concurrently, each in an executor thread with its own read connection.
+A ':memory:' database is opened as a c4db with a single executor thread.
+
+The commit semantics are those of DB_context_manager: edits are committed
+only if the context permits (commit=True), by commit_db() or on exit.
+
+    Usage:
+        async with c4db_async(db_name) as db:
+            rows = await db.query(sql, vals)
+            wellid = await db.queryone(sql, vals)
+            async for row in db.iter_query(sql, vals):
+                ...
+            near = await db.run(lambda c4: c4.nearest_wells(x, y, 5))
+
+        async with c4db_async(db_name, commit=True) as db:
+            await db.execute(update, vals)
+            await db.commit_db()
+
+Methods
+-------
+    async with c4db_async() as db:     [context manager syntax]
+    c4db_async.open_db()
+    c4db_async.close_db()
+    c4db_async.commit_db()
+    c4db_async.query()
+    c4db_async.queryone()
+    c4db_async.iter_query()            [async generator]
+    c4db_async.execute()
+    c4db_async.run()
+'''
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from OWI_sqlite import c4db, c4db_pool
+
+
+class c4db_async():
+    """
+    An asyncio facade over c4db_pool (or c4db for ':memory:').
+
+    Arguments
+    ---------
+    db_name     : str, database file name, or ':memory:'
+    commit      : bool, default False. Commits are permitted only if True.
+    max_workers : int, number of executor threads.  Ignored for ':memory:',
+                  which is always served by one thread.
+    """
+    def __init__(self, db_name=None, commit=False, max_workers=4):
+        self.db_name = db_name
+        self.commit = commit
+        if db_name == ':memory:':
+            max_workers = 1
+        self.max_workers = max_workers
+        self.executor = None
+        self.db = None
+
+    def __repr__(self):
+        return (f"c4db_async(db_name='{self.db_name}',"
+                f" commit={self.commit},"
+                f" max_workers={self.max_workers})")
+
+    async def _call(self, func, *args, **kwargs):
+        """ Await func(*args, **kwargs) run in the executor. """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+                   self.executor, functools.partial(func, *args, **kwargs))
+
+    async def open_db(self):
+        """ Start the executor and open the database. Return True if open. """
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                           thread_name_prefix='c4db_async')
+        if self.max_workers == 1:
+            self.db = c4db(self.db_name, commit=self.commit)
+        else:
+            self.db = c4db_pool(self.db_name, commit=self.commit)
+        # A c4db connection may only be used by the thread that opened it.
+        return await self._call(self.db.open_db)
+
+    async def close_db(self, commit=None):
+        """ Close the database and shut down the executor. """
+        if self.db is not None:
+            await self._call(self.db.close_db, commit=commit)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.executor = None
+
+    async def __aenter__(self):
+        await self.open_db()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        if self.db._context_autocommit == True:
+            OK = await self.commit_db()
+            print ('commit=',OK)
+        await self.close_db()
+        self.db._context_autocommit = False
+
+    async def commit_db(self, msg=''):
+        """ Commit edits, if the context permits. See DB_SQLite.commit_db(). """
+        return await self._call(self.db.commit_db, msg=msg)
+
+    async def query(self, sql, vals=None, n=None):
+        """ Execute a query and return the result set. See DB_SQLite.query(). """
+        return await self._call(self.db.query, sql, vals=vals, n=n)
+
+    async def queryone(self, sql, vals=None, default=None):
+        """
+        Execute a query and return first result tuple, or value.
+        See DB_SQLite.queryone().
+        """
+        return await self._call(self.db.queryone, sql, vals=vals, default=default)
+
+    async def iter_query(self, sql, vals=None, arraysize=None):
+        """
+        Execute a query and yield the rows of the result set.
+
+        The rows are fetched arraysize at a time, so memory use is bounded by
+        arraysize.  See DB_SQLite.iter_query().
+        
+        A cursor must be stepped by the thread whose connection it belongs 
+        to, so the whole stream runs in one thread: a single-worker executor
+        of its own, which reads through its own connection (or the executor 
+        of a ':memory:' database, which has one thread).
+        """
+        arraysize = arraysize or self.db.arraysize
+        loop = asyncio.get_running_loop()
+        if isinstance(self.db, c4db_pool):
+            executor = ThreadPoolExecutor(max_workers=1, 
+                                          thread_name_prefix='c4db_async_stream')
+        else:
+            executor = self.executor
+        rows = self.db.iter_query(sql, vals=vals, arraysize=arraysize)
+        try:
+            while True:
+                batch = await loop.run_in_executor(
+                            executor, lambda: list(islice(rows, arraysize)))
+                if not batch:
+                    break
+                for row in batch:
+                    yield row
+        finally:
+            await loop.run_in_executor(executor, rows.close)
+            if executor is not self.executor:
+                await loop.run_in_executor(executor, self.db.release_reader)
+                executor.shutdown(wait=True)
+
+    async def execute(self, sql, vals=None):
+        """
+        Execute a statement that edits the database, and return the result set.
+
+        Edits are made through the writer connection, and are not committed.
+        """
+        return await self.run(lambda db: db.query(sql, vals=vals), write=True)
+
+    async def run(self, func, write=False):
+        """
+        Await func(db) run in the executor, where db is the c4db (or c4db_pool).
+
+        Use this for any c4db method, e.g.
+            await db.run(lambda c4: c4.search_text('flowing'))
+        If write is True, func runs in the writing() context of c4db_pool.
+        """
+        def call():
+            if write and isinstance(self.db, c4db_pool):
+                with self.db.writing():
+                    return func(self.db)
+            return func(self.db)
+        return await self._call(call)
@@ -22,9 +22,10 @@ Version
 from OWI_download_ftp import RUN_download_cwi
 from OWI_import_csv import RUN_import_csv, RUN_import_swuds
 
-RUN_download_cwi()
-RUN_import_csv()
+if __name__ == '__main__':
+    RUN_download_cwi()
+    RUN_import_csv()
 
-if 0: RUN_import_swuds()
+    if 0: RUN_import_swuds()
 
-print ("/////////// DONE with Run_new.py ////////////")
+    print ("/////////// DONE with Run_new.py ////////////")
@@ -28,8 +28,8 @@ It is assumed that the fields match the fields that are named in method:
 '''
 import datetime
 import os
-import shapefile
 
+from OWI_shapefile import shapefile_fields, shapefile_rows
 from OWI_sqlite import c4db, MNU_FORMAT, RELATEID_FORMAT
 
 from OWI_config import OWI_version as C
@@ -63,6 +63,12 @@ def shp_generator(shpname):
     
     The first column in a shapefile is an internal flag that is not of interest.
     The order and values of all other columns are preserved
+
+    The shapes and records are read in a single sequential pass, see
+    OWI_shapefile.shapefile_rows(), with text decoded by the encoding of the
+    .cpg file. A shape that cannot be read is written with NULL coordinates, 
+    a field value that cannot be decoded as NULL, and a deleted record with 
+    NULL attributes.
     
     Returns
     -------
@@ -70,24 +76,7 @@ def shp_generator(shpname):
     """
     assert os.path.exists(shpname), f"Shape file not found {shpname}."
 
-    with shapefile.Reader(shpname) as shpf: 
-        s = shpf.shapes()
-        n = len(s)
-        keys = tuple((f[0] for f in shpf.fields[1:]))
-        nullrecord = [None for k in keys]
-
-        for i in range(n):
-            try:
-                s = shpf.shape(i)
-                x,y = s.points[0][0], s.points[0][1] 
-            except:
-                x,y = None, None
-            try:
-                r = shpf.record(i)
-                rec = tuple([i+1, x, y] + [r[k] for k in keys])
-            except:
-                rec = tuple([i+1, x, y] + nullrecord)
-            yield rec
+    yield from shapefile_rows(shpname)
 
 def RUN_import_sealings():    
     """
@@ -117,11 +106,10 @@ def RUN_import_sealings():
     d = {'D':'DATE',
          'N':'INT',
          'C':'TEXT'}
-    with shapefile.Reader(shpname) as shpf: 
-        cols    = ['irow','UTME','UTMN'] + [f[0]  for f in shpf.fields[1:]]
-        coldefs = ['irow INT','UTME REAL','UTMN REAL'] \
-                + [f"{f[0]} {d[f[1]]}" for f in shpf.fields[1:]]
-        keys = tuple((f[0] for f in shpf.fields[1:]))
+    fields = shapefile_fields(shpname)
+    cols    = ['irow','UTME','UTMN'] + [f[0]  for f in fields]
+    coldefs = ['irow INTEGER PRIMARY KEY','UTME REAL','UTMN REAL'] \
+            + [f"{f[0]} {d[f[1]]}" for f in fields]
     
     # from chardet.universaldetector import UniversalDetector
     # 
@@ -156,8 +144,9 @@ def RUN_import_sealings():
     # return
     with c4db(db_name=DB_NAME, commit=True) as db:
         db.query(delete)
+        db.query("DROP TABLE IF EXISTS MDHsealed_fts;")
         db.query(create)
-        with shapefile.Reader(shpname) as shpf: 
+        with db.bulk_load((TABLENAME,)):
             db.cur.executemany(insert, shp_generator(shpname))
             
             # for x in shpf.iterShapes():
@@ -208,7 +197,7 @@ def add_fields_to_MDHsealed(db_name):
     DROP TABLE MDHsealed;
     @
     CREATE TABLE MDHsealed (
-        irow       INT,
+        irow       INTEGER PRIMARY KEY,
         wellid     INT,
         MNUNIQ     TEXT,
         WMWSR      TEXT,
@@ -342,6 +331,7 @@ def add_fields_to_MDHsealed(db_name):
             line1 = s.split('\n')[1]
             print (f"Run query sequence {i}: {line1} ...")
             db.query(s)
+        db.create_text_indexes(('MDHsealed_fts',))
     print (f'Table MDHsealed modified in {db_name}')    
 
 
@@ -556,6 +546,7 @@ def RUN_analyze_Hnums(db_name, commit=False):
             for i,u in enumerate(uu.split('@')):
                 print (f"Run query sequence {i} ...")
                 db.query(u)
+            db.create_text_indexes(tables=('c4ad', 'c4rm'))
 
 # def RUN_updatefromjoin():
 #     """